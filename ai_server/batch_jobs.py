@@ -0,0 +1,289 @@
+"""
+In-memory batch jobs: run a list of items through an async worker with bounded
+parallelism, expose progress for polling, and fan results out to streaming
+subscribers as each item completes.
+
+Jobs live in process memory and expire BATCH_JOB_TTL seconds after they finish;
+at most BATCH_MAX_JOBS are kept (oldest finished jobs are dropped first). At
+most BATCH_MAX_RUNNING jobs run at once per worker — beyond that a new batch is
+refused with a 503 and Retry-After rather than piling more work onto Ollama.
+With several workers, progress is also snapshotted to the shared state dir so a
+poll that lands on a different worker still finds the job; a background sweep
+deletes snapshots BATCH_JOB_TTL seconds after their last write.
+
+Env config:
+    BATCH_JOB_TTL=3600
+    BATCH_MAX_JOBS=200
+    BATCH_MAX_RUNNING=8
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from fastapi import HTTPException
+
+import shared_state
+
+logger = logging.getLogger(__name__)
+
+BATCH_JOB_TTL = float(os.environ.get('BATCH_JOB_TTL', '3600'))
+BATCH_MAX_JOBS = int(os.environ.get('BATCH_MAX_JOBS', '200'))
+BATCH_MAX_RUNNING = int(os.environ.get('BATCH_MAX_RUNNING', '8'))
+
+
+class JobsBusy(HTTPException):
+    """Raised when BATCH_MAX_RUNNING jobs are already running."""
+
+    def __init__(self, retry_after: int = 30):
+        super().__init__(
+            status_code=503,
+            detail='Too many batch jobs are running. Please try again shortly.',
+            headers={'Retry-After': str(retry_after)},
+        )
+
+
+class BatchJob:
+    def __init__(self, kind: str, items: list):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.items = items
+        self.results = [None] * len(items)
+        self.completed = 0
+        self.failed = 0
+        self.created_at = time.time()
+        self.started = time.perf_counter()
+        self.finished_at = None
+        self.elapsed = None
+        self.task = None
+        self.on_progress = None  # optional async callback after each item
+        self._subscribers = []
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    async def run(self, worker, concurrency: int):
+        """Call `await worker(item)` for every item, at most `concurrency` at a time."""
+        sem = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(index: int, item):
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    result = {'index': index, 'status': 'done', **(await worker(item))}
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    detail = getattr(e, 'detail', None) or str(e) or type(e).__name__
+                    result = {'index': index, 'status': 'error', 'error': detail}
+                    self.failed += 1
+                result['latency_ms'] = round((time.perf_counter() - t0) * 1000, 1)
+            self.results[index] = result
+            self.completed += 1
+            self._publish(result)
+            if self.on_progress is not None:
+                await self.on_progress(self)
+
+        try:
+            await asyncio.gather(*(one(i, item) for i, item in enumerate(self.items)))
+        finally:
+            self.elapsed = time.perf_counter() - self.started
+            self.finished_at = time.time()
+            self._publish(None)
+            if self.on_progress is not None:
+                await self.on_progress(self)
+
+    def subscribe(self) -> asyncio.Queue:
+        """Queue of results (already-finished ones first); None marks the end."""
+        queue = asyncio.Queue()
+        for result in self.results:
+            if result is not None:
+                queue.put_nowait(result)
+        if self.done:
+            queue.put_nowait(None)
+        else:
+            self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    def _publish(self, event):
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+        if event is None:
+            self._subscribers.clear()
+
+    def summary(self) -> dict:
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+        latencies = sorted(r['latency_ms'] for r in self.results if r is not None)
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': 'done' if self.done else 'running',
+            'total': len(self.items),
+            'completed': self.completed,
+            'failed': self.failed,
+            'elapsed_ms': round(elapsed * 1000, 1),
+            'items_per_min': round(self.completed / elapsed * 60, 1) if elapsed > 0 else 0.0,
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies), 1) if latencies else 0.0,
+                'p50': latencies[len(latencies) // 2] if latencies else 0.0,
+                'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0,
+                'max': latencies[-1] if latencies else 0.0,
+            },
+        }
+
+    def to_dict(self) -> dict:
+        return {**self.summary(), 'results': self.results}
+
+
+class _PersistedJob:
+    """Read-only view of a job snapshot written by another worker."""
+
+    def __init__(self, data: dict):
+        self.kind = data.get('kind')
+        self._data = data
+
+    def to_dict(self) -> dict:
+        return self._data
+
+
+class JobStore:
+    def __init__(self, ttl: float = BATCH_JOB_TTL, max_jobs: int = BATCH_MAX_JOBS,
+                 persist_dir: str = None, persist_interval: float = 0.5, max_running: int = BATCH_MAX_RUNNING):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.max_running = max(1, max_running)
+        self.persist_dir = persist_dir
+        self.persist_interval = persist_interval
+        self._jobs = OrderedDict()
+        self._persisted_at = {}
+        self._write_lock = asyncio.Lock()
+        self._sweeper = None
+        self.refused = 0
+        self.swept = 0
+
+    def running(self) -> int:
+        return sum(1 for j in self._jobs.values() if not j.done)
+
+    def start(self, kind: str, items: list, worker, concurrency: int) -> BatchJob:
+        """Run a new job in the background; raises JobsBusy once max_running jobs are running."""
+        self._evict()
+        if self.running() >= self.max_running:
+            self.refused += 1
+            logger.warning(f"Refusing {kind} batch: {self.max_running} jobs already running")
+            raise JobsBusy()
+        job = BatchJob(kind, items)
+        self._jobs[job.id] = job
+        if self.persist_dir:
+            job.on_progress = self._persist
+        # The job owns its task so it keeps running if the submitting client goes away.
+        job.task = asyncio.ensure_future(job.run(worker, concurrency))
+        return job
+
+    def get(self, job_id: str):
+        self._evict()
+        job = self._jobs.get(job_id)
+        if job is None and self.persist_dir and job_id.isalnum():
+            job = self._load(job_id)
+        return job
+
+    async def _persist(self, job: BatchJob):
+        # Throttled: at most one snapshot per persist_interval, plus the final one.
+        now = time.monotonic()
+        if not job.done and now - self._persisted_at.get(job.id, 0) < self.persist_interval:
+            return
+        self._persisted_at[job.id] = now
+        payload = json.dumps(job.to_dict(), default=str)
+        try:
+            # Serialised so an older snapshot can never land after the final one.
+            async with self._write_lock:
+                await asyncio.to_thread(self._write, job.id, payload)
+        except OSError as e:
+            logger.warning(f"Could not snapshot batch job {job.id}: {e}")
+
+    def _write(self, job_id: str, payload: str):
+        os.makedirs(self.persist_dir, exist_ok=True)
+        path = os.path.join(self.persist_dir, f'{job_id}.json')
+        with open(f'{path}.tmp', 'w') as f:
+            f.write(payload)
+        os.replace(f'{path}.tmp', path)
+
+    def _load(self, job_id: str):
+        path = os.path.join(self.persist_dir, f'{job_id}.json')
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path) as f:
+                return _PersistedJob(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def _sweep_files(self) -> int:
+        """Blocking: delete snapshots (and stray temp files) not written for `ttl` seconds."""
+        removed = 0
+        cutoff = time.time() - self.ttl
+        try:
+            names = os.listdir(self.persist_dir)
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            path = os.path.join(self.persist_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue  # removed by another worker's sweep
+        return removed
+
+    async def _sweep_forever(self, every: float):
+        while True:
+            await asyncio.sleep(every)
+            self._evict()
+            if not self.persist_dir:
+                continue
+            try:
+                self.swept += await asyncio.to_thread(self._sweep_files)
+            except Exception as e:
+                logger.warning(f"Batch job snapshot sweep failed: {e}")
+
+    def start_sweeper(self, every: float = None):
+        """Start background expiry of finished jobs and their snapshots (call from the app lifespan)."""
+        if self._sweeper is None:
+            self._sweeper = asyncio.ensure_future(self._sweep_forever(every or min(self.ttl, 300.0)))
+
+    def _evict(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.done and now - job.finished_at > self.ttl:
+                del self._jobs[job_id]
+        if len(self._jobs) >= self.max_jobs:
+            for job_id, job in list(self._jobs.items()):
+                if len(self._jobs) < self.max_jobs:
+                    break
+                if job.done:
+                    del self._jobs[job_id]
+        for job_id in [j for j in self._persisted_at if j not in self._jobs]:
+            del self._persisted_at[job_id]
+
+    async def aclose(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        for job in self._jobs.values():
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+
+    def stats(self) -> dict:
+        return {'jobs': len(self._jobs), 'running': self.running(), 'max_running': self.max_running,
+                'refused': self.refused, 'snapshots_swept': self.swept}
+
+
+batch_jobs = JobStore(persist_dir=os.path.join(shared_state.STATE_DIR, 'jobs') if shared_state.MULTI_WORKER else None)
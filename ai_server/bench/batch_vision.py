@@ -0,0 +1,91 @@
+"""
+Throughput benchmark: bulk product-image analysis against a local mock Ollama.
+
+Compares merchants' current pattern (one /analyze-product-image call per photo,
+sent one after another) with /analyze-product-images:batch at several
+parallelism settings, and reports images/min.
+
+    cd ai_server && python bench/batch_vision.py --images 30 --concurrency 1,2,4,8
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.mock_ollama import MockConfig, MockServer  # noqa: E402
+
+
+async def _sequential(client, urls):
+    start = time.perf_counter()
+    for i, url in enumerate(urls):
+        # Distinct client IPs so the per-IP rate limiter doesn't dominate the measurement.
+        r = await client.post('/analyze-product-image', json={'image_url': url},
+                              headers={'x-forwarded-for': f'10.0.0.{i % 250}'})
+        r.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def _batch(client, urls):
+    start = time.perf_counter()
+    r = await client.post('/analyze-product-images:batch', json={'image_urls': urls})
+    r.raise_for_status()
+    status_url = r.json()['status_url']
+    while True:
+        job = (await client.get(status_url)).json()
+        if job['status'] == 'done':
+            break
+        await asyncio.sleep(0.05)
+    if job['failed']:
+        print(f"  warning: {job['failed']} images failed")
+    return time.perf_counter() - start
+
+
+async def run(args):
+    import httpx
+    import main
+    from scheduler import scheduler
+
+    scheduler.model_limits[main.VISION_MODEL] = args.ollama_slots
+    transport = httpx.ASGITransport(app=main.app)
+    rows = []
+    async with main.lifespan(main.app), httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=600) as client:
+        base = os.environ['OLLAMA_URL']
+        # Unique URLs per run so neither the processed-image cache nor single-flight skews results.
+        urls = lambda tag: [f'{base}/images/{tag}-{i}.jpg' for i in range(args.images)]
+
+        elapsed = await _sequential(client, urls('seq'))
+        rows.append(('sequential singles', elapsed))
+        for concurrency in args.concurrency:
+            main.BATCH_VISION_CONCURRENCY = concurrency
+            elapsed = await _batch(client, urls(f'batch{concurrency}'))
+            rows.append((f'batch, concurrency={concurrency}', elapsed))
+
+    print(f"\n{args.images} images, mock vision latency {args.vision_latency_ms:.0f} ms, "
+          f"{args.ollama_slots} Ollama slot(s) for {main.VISION_MODEL}")
+    print(f"{'mode':<28}{'wall s':>10}{'images/min':>14}")
+    for label, elapsed in rows:
+        print(f"{label:<28}{elapsed:>10.2f}{args.images / elapsed * 60:>14.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--concurrency', default='1,2,4,8',
+                        type=lambda s: [int(x) for x in s.split(',') if x])
+    parser.add_argument('--ollama-slots', type=int, default=2,
+                        help='concurrent vision inferences the (mock) Ollama box accepts')
+    parser.add_argument('--vision-latency-ms', type=float, default=400.0)
+    parser.add_argument('--port', type=int, default=11435)
+    args = parser.parse_args(argv)
+
+    config = MockConfig(vision_latency_ms=args.vision_latency_ms, tokens=40, token_latency_ms=2)
+    with MockServer(config, port=args.port) as url:
+        os.environ['OLLAMA_URL'] = url
+        asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
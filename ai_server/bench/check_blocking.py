@@ -0,0 +1,128 @@
+"""
+Static guard against blocking calls on the event loop.
+
+Walks the server modules (ai_server/*.py) and flags, inside `async def` bodies,
+calls that block the thread: sync HTTP clients, time.sleep, subprocesses, file
+and sqlite I/O, PIL decoding — and the sync facade itself (ollama_chat_sync,
+query_groq, sync_bridge.run), which would deadlock the loop. `asyncio.run` and
+`import requests` are flagged anywhere in a server module.
+
+Code in a nested plain `def` or lambda is skipped, since that is how work is
+handed to asyncio.to_thread / run_in_executor. Silence a deliberate call with a
+`# blocking-ok` comment on its line.
+
+    python bench/check_blocking.py            # exit 1 if anything is found
+    python bench/check_blocking.py main.py    # check specific files
+
+The runtime counterpart is loop_watchdog.py, which logs the stack of whatever
+stalls the loop in production.
+"""
+import ast
+import sys
+import glob
+import argparse
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+
+# Dotted call names (as written in the source) that block the calling thread.
+BLOCKING_CALLS = {
+    'time.sleep', 'os.system', 'socket.create_connection', 'urllib.request.urlopen', 'urlopen',
+    'subprocess.run', 'subprocess.call', 'subprocess.check_call', 'subprocess.check_output', 'subprocess.Popen',
+    'sqlite3.connect', 'open', 'Image.open', 'input', 'fcntl.flock',
+    'httpx.get', 'httpx.post', 'httpx.put', 'httpx.patch', 'httpx.delete', 'httpx.request', 'httpx.Client',
+    'sync_bridge.run', 'query_groq',
+}
+BLOCKING_PREFIXES = ('requests.',)
+BLOCKING_SUFFIXES = ('_sync',)
+NOQA = 'blocking-ok'
+
+
+def _dotted(node) -> str:
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if isinstance(node, ast.Name):
+        parts.append(node.id)
+        return '.'.join(reversed(parts))
+    return ''
+
+
+def _is_blocking(name: str) -> bool:
+    return (name in BLOCKING_CALLS or name.startswith(BLOCKING_PREFIXES)
+            or name.split('.')[-1].endswith(BLOCKING_SUFFIXES))
+
+
+class _Checker(ast.NodeVisitor):
+    def __init__(self, path: str, lines: list):
+        self.path = path
+        self.lines = lines
+        self.problems = []
+        self._async_depth = 0  # > 0 while directly inside an async def body
+        self._main_guard = False
+
+    def _report(self, node, message: str):
+        line = self.lines[node.lineno - 1] if node.lineno <= len(self.lines) else ''
+        if NOQA not in line:
+            self.problems.append(f'{self.path}:{node.lineno}: {message}')
+
+    def visit_AsyncFunctionDef(self, node):
+        saved, self._async_depth = self._async_depth, 1
+        self.generic_visit(node)
+        self._async_depth = saved
+
+    def visit_FunctionDef(self, node):
+        saved, self._async_depth = self._async_depth, 0
+        self.generic_visit(node)
+        self._async_depth = saved
+
+    def visit_Lambda(self, node):
+        saved, self._async_depth = self._async_depth, 0
+        self.generic_visit(node)
+        self._async_depth = saved
+
+    def visit_If(self, node):
+        test = node.test
+        is_main = (isinstance(test, ast.Compare) and isinstance(test.left, ast.Name)
+                   and test.left.id == '__name__')
+        saved, self._main_guard = self._main_guard, self._main_guard or is_main
+        self.generic_visit(node)
+        self._main_guard = saved
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            if alias.name == 'requests':
+                self._report(node, 'sync HTTP client `requests` imported into the async server; use http_pool')
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        name = _dotted(node.func)
+        if name == 'asyncio.run' and not self._main_guard:
+            self._report(node, 'asyncio.run starts a new event loop per call; use sync_bridge.run')
+        elif self._async_depth and name and _is_blocking(name):
+            self._report(node, f'blocking call {name}() inside async def; await an async API or use asyncio.to_thread')
+        self.generic_visit(node)
+
+
+def check_file(path: str) -> list:
+    source = Path(path).read_text(encoding='utf-8')
+    checker = _Checker(path, source.splitlines())
+    checker.visit(ast.parse(source, filename=path))
+    return checker.problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Flag blocking calls on the event loop')
+    parser.add_argument('files', nargs='*', help='defaults to the server modules in ai_server/')
+    args = parser.parse_args(argv)
+    files = args.files or sorted(glob.glob(str(SERVER_DIR / '*.py')))
+    problems = [p for f in files for p in check_file(f)]
+    for problem in problems:
+        print(problem)
+    print(f'{len(files)} files checked, {len(problems)} blocking call(s) found', file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+Microbenchmark: standard vs FAST_JSON serialization path (see fast_json.py).
+
+Measures, per reply size (short chat reply, listing description, job letter):
+
+  * decode  — one non-streaming Ollama /api/chat reply: json.loads vs orjson
+  * stream  — decode a token chunk and encode the NDJSON line sent to the client
+  * respond — a full FastAPI request for an endpoint with response_model=AIResponse,
+              returning the model (validated and serialized by FastAPI, rendered
+              with json.dumps) vs fast_json.respond() (rendered directly with orjson)
+
+The respond case calls the ASGI app in-process, so it includes FastAPI's
+routing and request handling but no network.
+
+    cd ai_server && python bench/json_path.py --sizes 300,1500,6000
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['FAST_JSON'] = '1'
+
+import fast_json  # noqa: E402
+
+WORDS = 'Doubles from de corner stand in San Fernando, fresh and hot, with extra pepper and channa '.split()
+
+
+def _text(chars: int) -> str:
+    out, i = [], 0
+    while sum(len(w) + 1 for w in out) < chars:
+        out.append(WORDS[i % len(WORDS)])
+        i += 1
+    return ' '.join(out)[:chars]
+
+
+def _ollama_reply(content: str) -> bytes:
+    return json.dumps({
+        'model': 'qwen2.5:7b', 'created_at': '2025-01-01T00:00:00.000000Z',
+        'message': {'role': 'assistant', 'content': content},
+        'done_reason': 'stop', 'done': True, 'total_duration': 4935886791, 'load_duration': 534986708,
+        'prompt_eval_count': 412, 'prompt_eval_duration': 107345000,
+        'eval_count': len(content) // 4, 'eval_duration': 4289432000,
+    }).encode()
+
+
+def _chunk(delta: str) -> bytes:
+    return json.dumps({'model': 'qwen2.5:7b', 'created_at': '2025-01-01T00:00:00.000000Z',
+                       'message': {'role': 'assistant', 'content': delta}, 'done': False}).encode()
+
+
+def _time(fn, seconds: float) -> float:
+    """Mean microseconds per call."""
+    n, start = 0, time.perf_counter()
+    while True:
+        for _ in range(50):
+            fn()
+        n += 50
+        elapsed = time.perf_counter() - start
+        if elapsed > seconds:
+            return elapsed / n * 1e6
+
+
+async def _atime(fn, seconds: float) -> float:
+    n, start = 0, time.perf_counter()
+    while True:
+        for _ in range(20):
+            await fn()
+        n += 20
+        elapsed = time.perf_counter() - start
+        if elapsed > seconds:
+            return elapsed / n * 1e6
+
+
+def _app(content: str):
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse
+    from main import AIResponse
+
+    app = FastAPI(default_response_class=JSONResponse)
+    fast = FastAPI(default_response_class=fast_json.FastJSONResponse)
+    usage = {'prompt_tokens': 412, 'completion_tokens': len(content) // 4, 'total_tokens': 412 + len(content) // 4,
+             'trimmed': False}
+
+    @app.post('/reply', response_model=AIResponse)
+    async def reply():
+        return AIResponse(content=content, model_used='qwen2.5:7b', usage=usage)
+
+    @fast.post('/reply', response_model=AIResponse)
+    async def fast_reply():
+        return fast_json.respond(AIResponse, content=content, model_used='qwen2.5:7b', usage=usage)
+
+    return app, fast
+
+
+def _caller(app):
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+             'scheme': 'http', 'path': '/reply', 'raw_path': b'/reply', 'root_path': '', 'query_string': b'',
+             'headers': [(b'host', b'bench')], 'client': ('127.0.0.1', 1), 'server': ('bench', 80)}
+    body = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.body':
+            body.append(message.get('body', b''))
+
+    async def call():
+        body.clear()
+        await app(scope, receive, send)
+        return b''.join(body)
+
+    return call
+
+
+async def run(args):
+    chunk = _chunk(' pepper')
+    std = _time(lambda: (json.dumps({'content': json.loads(chunk)['message']['content']}) + '\n').encode(),
+                args.seconds)
+    fast = _time(lambda: fast_json.dumps_line({'content': fast_json.loads(chunk)['message']['content']}),
+                 args.seconds)
+    rows = [('stream chunk', 7, len(chunk), std, fast)]
+    for size in args.sizes:
+        content = _text(size)
+        reply = _ollama_reply(content)
+        std = _time(lambda: json.loads(reply), args.seconds)
+        fast = _time(lambda: fast_json.orjson.loads(reply), args.seconds)
+        rows.append(('decode', size, len(reply), std, fast))
+
+        app, fast_app = _app(content)
+        std_call, fast_call = _caller(app), _caller(fast_app)
+        std_body, fast_body = await std_call(), await fast_call()
+        if json.loads(std_body) != json.loads(fast_body):
+            raise SystemExit(f'fast path changed the response:\n{std_body!r}\n{fast_body!r}')
+        std = await _atime(std_call, args.seconds)
+        fast = await _atime(fast_call, args.seconds)
+        rows.append(('respond (AIResponse)', size, len(std_body), std, fast))
+
+    print(f"\n{'case':<22}{'reply chars':>12}{'bytes':>8}{'standard us':>13}{'fast us':>10}{'speedup':>9}")
+    for case, size, nbytes, std, fast in rows:
+        print(f"{case:<22}{size:>12}{nbytes:>8}{std:>13.1f}{fast:>10.1f}{std / fast:>8.1f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='300,1500,6000', type=lambda s: [int(x) for x in s.split(',') if x],
+                        help='reply lengths in characters')
+    parser.add_argument('--seconds', type=float, default=0.5, help='time spent per measurement')
+    args = parser.parse_args(argv)
+    if fast_json.orjson is None:
+        raise SystemExit('orjson is not installed (pip install orjson)')
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+"""
+Load test: drive every AI server endpoint against a local mock Ollama.
+
+Starts bench/mock_ollama.py (which also stands in for Twilio and Meta Graph),
+launches the AI server as a real uvicorn process pointed at it, then runs each
+scenario closed-loop at every concurrency level: N clients each send their next
+request as soon as the previous one finishes. Reports req/s, latency
+percentiles, time to first byte and the server's RSS (all workers), and can
+save the run as a JSON baseline or compare against an earlier one.
+
+    cd ai_server
+    python bench/load_test.py --concurrency 1,8,32 --duration 10 --save bench/baselines/main.json
+    python bench/load_test.py --compare bench/baselines/main.json      # exit 1 on regression
+    python bench/load_test.py --scenarios generate,island-chat-stream --workers 4
+
+Prompts are unique per request so the response cache and single-flight don't
+flatter the numbers; pass --cacheable to measure the repeated-request path.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import itertools
+import subprocess
+import tempfile
+from dataclasses import asdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.mock_ollama import MockConfig, MockServer  # noqa: E402
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_seq = itertools.count()
+_ips = itertools.count(1)  # client IPs are never reused — not across levels, warmups or scenarios
+
+
+def _uid(cacheable: bool) -> str:
+    return '' if cacheable else f' #{next(_seq)}'
+
+
+# ── Scenarios ────────────────────────────────────────────────────────────────
+# name -> (method, path, payload builder(ctx) -> json body or None)
+
+def _listing(ctx):
+    return {'title': f"Mahogany dining table{_uid(ctx['cacheable'])}", 'category': 'Furniture',
+            'features': ['seats 6', 'solid wood'], 'condition': 'used', 'price': 2500,
+            'no_cache': not ctx['cacheable']}
+
+
+SCENARIOS = {
+    'health': ('GET', '/', None),
+    'stats': ('GET', '/stats', None),
+    'metrics': ('GET', '/metrics', None),
+    'generate': ('POST', '/generate', lambda ctx: {
+        'prompt': f"Give me three tips for selling doubles in Port of Spain{_uid(ctx['cacheable'])}"}),
+    'generate-stream': ('POST', '/generate', lambda ctx: {
+        'prompt': f"Describe a Trini lime{_uid(ctx['cacheable'])}", 'stream': True}),
+    'chatbot-reply': ('POST', '/chatbot-reply', lambda ctx: {
+        'message': f"How do I register a business name?{_uid(ctx['cacheable'])}", 'persona': 'business_expert'}),
+    'island-chat': ('POST', '/island-chat', lambda ctx: {
+        'message': f"Wha' going on? How I set up my store?{_uid(ctx['cacheable'])}", 'mode': 'onboarding',
+        'history': [{'role': 'user', 'content': 'Hi'}, {'role': 'assistant', 'content': 'Aye! Welcome.'}]}),
+    'island-chat-stream': ('POST', '/island-chat', lambda ctx: {
+        'message': f"Tell me about delivery options{_uid(ctx['cacheable'])}", 'stream': True}),
+    'job-letter': ('POST', '/generate-job-letter', lambda ctx: {
+        'applicant_name': f"Kamla{_uid(ctx['cacheable'])}", 'position': 'Cashier', 'company_name': 'Hi-Lo',
+        'skills': ['customer service'], 'experience_years': 3, 'no_cache': not ctx['cacheable']}),
+    'listing-description': ('POST', '/generate-listing-description', _listing),
+    'listing-descriptions-batch': ('POST', '/generate-listing-descriptions:batch', lambda ctx: {
+        'items': [_listing(ctx) for _ in range(5)], 'wait': True}),
+    'listing-job-poll': ('GET', '/generate-listing-descriptions/jobs/{listing_job}', None),
+    'analyze-image': ('POST', '/analyze-product-image', lambda ctx: {
+        'image_url': f"{ctx['mock']}/images/p{'' if ctx['cacheable'] else next(_seq)}.jpg"}),
+    'analyze-images-batch': ('POST', '/analyze-product-images:batch', lambda ctx: {
+        'image_urls': [f"{ctx['mock']}/images/b{'' if ctx['cacheable'] else next(_seq)}-{i}.jpg" for i in range(4)],
+        'stream': True}),
+    'image-job-poll': ('GET', '/analyze-product-images/jobs/{image_job}', None),
+    'send-whatsapp': ('POST', '/send-whatsapp', lambda ctx: {
+        'to': '18685550100', 'message': f"Your order is ready{_uid(ctx['cacheable'])}"}),
+    'meta-campaigns': ('GET', '/meta/campaigns', None),
+    'meta-create-campaign': ('POST', '/meta/campaigns', lambda ctx: {
+        'name': f"Bench{_uid(ctx['cacheable'])}", 'objective': 'OUTCOME_TRAFFIC', 'daily_budget_cents': 500}),
+    'meta-insights': ('GET', '/meta/insights', None),
+    'meta-ad-copy': ('POST', '/meta/generate-ad-copy', lambda ctx: {
+        'business_type': 'bakery', 'product': f"currants rolls{_uid(ctx['cacheable'])}",
+        'no_cache': not ctx['cacheable']}),
+}
+
+
+# ── Server process ───────────────────────────────────────────────────────────
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _children(pid: int) -> list:
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            kids = [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+    return kids + [k for kid in kids for k in _children(kid)]
+
+
+def rss_bytes(pid: int):
+    """Resident memory of a process and all its descendants (Linux /proc); None elsewhere."""
+    total = 0
+    for p in [pid] + _children(pid):
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            if p == pid:
+                return None
+    return total
+
+
+class ServerProcess:
+    """`uvicorn main:app` in a subprocess, configured to use the mock for every upstream."""
+
+    def __init__(self, mock_url: str, workers: int = 1, port: int = None, env: dict = None):
+        self.port = port or _free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self._state_dir = tempfile.TemporaryDirectory(prefix='trinibuild-bench-')
+        self.env = {
+            **os.environ,
+            'OLLAMA_URL': mock_url,
+            'TWILIO_API_BASE': mock_url,
+            'META_API_BASE': f'{mock_url}/v21.0',
+            'TWILIO_ACCOUNT_SID': 'ACbench', 'TWILIO_AUTH_TOKEN': 'bench',
+            'META_ACCESS_TOKEN': 'bench', 'META_AD_ACCOUNT_ID': '1234',
+            'WEB_CONCURRENCY': str(workers),
+            'AI_SERVER_STATE_DIR': self._state_dir.name,
+            'AI_SERVER_DATA_DIR': self._state_dir.name,
+            **(env or {}),
+        }
+        self.proc = None
+
+    def __enter__(self):
+        # Server logs (one INFO line per upstream call) go to a file, not the report.
+        self.log_path = os.path.join(self._state_dir.name, 'server.log')
+        self._log = open(self.log_path, 'w')
+        self.proc = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(self.port),
+             '--log-level', 'warning'],
+            cwd=SERVER_DIR, env=self.env, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+        import httpx
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            if self.proc.poll() is not None:
+                with open(self.log_path) as f:
+                    tail = f.read()[-2000:]
+                raise RuntimeError(f'AI server exited with code {self.proc.returncode}:\n{tail}')
+            try:
+                if httpx.get(self.url + '/', timeout=1).status_code == 200:
+                    return self
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError('AI server did not become ready')
+
+    def rss(self):
+        return rss_bytes(self.proc.pid)
+
+    def __exit__(self, *exc):
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        self._log.close()
+        self._state_dir.cleanup()
+
+
+# ── Driver ───────────────────────────────────────────────────────────────────
+
+def _pct(samples: list, q: float) -> float:
+    if not samples:
+        return 0.0
+    return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 2)
+
+
+async def _run_level(client, scenario: str, concurrency: int, duration: float, ctx: dict) -> dict:
+    method, path, build = SCENARIOS[scenario]
+    path = path.format(**ctx)
+    latencies, ttfbs, statuses = [], [], {}
+    errors = rate_limited = 0
+    stop_at = time.perf_counter() + duration
+
+    async def client_loop():
+        nonlocal errors, rate_limited
+        while time.perf_counter() < stop_at:
+            body = build(ctx) if build else None
+            # A distinct client IP per request keeps the per-IP rate limiter out of the measurement.
+            n = next(_ips)
+            headers = {'x-forwarded-for': f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}'}
+            start = time.perf_counter()
+            ttfb = None
+            try:
+                async with client.stream(method, path, json=body, headers=headers) as resp:
+                    async for _ in resp.aiter_raw():
+                        if ttfb is None:
+                            ttfb = time.perf_counter() - start
+                    status = resp.status_code
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 429:
+                rate_limited += 1  # a limiter misconfiguration, not a server error
+                continue
+            if not isinstance(status, int) or status >= 400:
+                errors += 1
+                continue
+            latencies.append(elapsed)
+            ttfbs.append(ttfb if ttfb is not None else elapsed)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    latencies.sort()
+    ttfbs.sort()
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': len(latencies) + errors + rate_limited,
+        'errors': errors,
+        'rate_limited': rate_limited,
+        'statuses': {str(k): v for k, v in statuses.items()},
+        'rps': round(len(latencies) / wall, 2) if wall else 0.0,
+        'latency_ms': {'p50': _pct(latencies, 0.50), 'p95': _pct(latencies, 0.95),
+                       'p99': _pct(latencies, 0.99), 'max': _pct(latencies, 1.0)},
+        'ttfb_ms': {'p50': _pct(ttfbs, 0.50), 'p95': _pct(ttfbs, 0.95)},
+    }
+
+
+async def _prepare(client, ctx: dict):
+    """Create one job of each kind so the polling scenarios have something to poll."""
+    r = await client.post('/generate-listing-descriptions:batch', json={'items': [_listing(ctx)], 'wait': True})
+    ctx['listing_job'] = r.json().get('job_id', 'missing')
+    r = await client.post('/analyze-product-images:batch', json={'image_urls': [f"{ctx['mock']}/images/setup.jpg"]})
+    ctx['image_job'] = r.json().get('job_id', 'missing')
+
+
+async def drive(server: ServerProcess, mock_url: str, args) -> list:
+    import httpx
+    ctx = {'mock': mock_url, 'cacheable': args.cacheable}
+    limits = httpx.Limits(max_connections=max(args.concurrency) + 4, max_keepalive_connections=max(args.concurrency))
+    results = []
+    async with httpx.AsyncClient(base_url=server.url, timeout=args.timeout, limits=limits) as client:
+        await _prepare(client, ctx)
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                if args.warmup:
+                    await _run_level(client, scenario, concurrency, args.warmup, ctx)
+                row = await _run_level(client, scenario, concurrency, args.duration, ctx)
+                rss = server.rss()
+                row['rss_mb'] = round(rss / 2 ** 20, 1) if rss is not None else None
+                results.append(row)
+                _print_row(row)
+    return results
+
+
+# ── Reporting & baselines ────────────────────────────────────────────────────
+
+_HEADER = f"{'scenario':<28}{'conc':>5}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}" \
+          f"{'ttfb50':>9}{'errors':>8}{'429s':>6}{'rss MB':>9}"
+
+
+def _print_row(row: dict):
+    lat = row['latency_ms']
+    print(f"{row['scenario']:<28}{row['concurrency']:>5}{row['rps']:>10.1f}{lat['p50']:>10.1f}{lat['p95']:>10.1f}"
+          f"{lat['p99']:>10.1f}{row['ttfb_ms']['p50']:>9.1f}{row['errors']:>8}{row.get('rate_limited', 0):>6}"
+          f"{row['rss_mb'] or 0:>9.1f}",
+          flush=True)
+
+
+def _git_rev():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> bool:
+    """Print per-row deltas; True if any row regressed beyond `tolerance` percent."""
+    old = {(r['scenario'], r['concurrency']): r for r in baseline['results']}
+    regressed = False
+    print(f"\nvs baseline {baseline['meta'].get('git_rev')} ({baseline['meta'].get('timestamp')}), "
+          f"tolerance {tolerance:.0f}%")
+    print(f"{'scenario':<28}{'conc':>5}{'req/s Δ%':>11}{'p95 Δ%':>10}{'p99 Δ%':>10}  verdict")
+    for row in current['results']:
+        before = old.get((row['scenario'], row['concurrency']))
+        if before is None:
+            continue
+
+        def delta(new, prev):
+            return (new - prev) / prev * 100 if prev else 0.0
+
+        d_rps = delta(row['rps'], before['rps'])
+        d_p95 = delta(row['latency_ms']['p95'], before['latency_ms']['p95'])
+        d_p99 = delta(row['latency_ms']['p99'], before['latency_ms']['p99'])
+        bad = (d_rps < -tolerance or d_p95 > tolerance or row['errors'] > before['errors']
+               or row.get('rate_limited', 0) > before.get('rate_limited', 0))
+        regressed |= bad
+        print(f"{row['scenario']:<28}{row['concurrency']:>5}{d_rps:>+11.1f}{d_p95:>+10.1f}{d_p99:>+10.1f}  "
+              f"{'REGRESSION' if bad else 'ok'}")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        type=lambda s: [x for x in s.split(',') if x],
+                        help='comma-separated subset of: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--concurrency', default='1,8,32', type=lambda s: [int(x) for x in s.split(',') if x])
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per scenario and level')
+    parser.add_argument('--warmup', type=float, default=0.5, help='unmeasured seconds before each level')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn workers (WEB_CONCURRENCY)')
+    parser.add_argument('--cacheable', action='store_true', help='repeat identical requests (cache hits)')
+    parser.add_argument('--server-env', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra env for the AI server, e.g. OLLAMA_MAX_CONCURRENCY=4')
+    parser.add_argument('--save', metavar='PATH', help='write results as a JSON baseline')
+    parser.add_argument('--compare', metavar='PATH', help='compare with a saved baseline; exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='allowed regression in percent')
+    parser.add_argument('--mock-port', type=int, default=11436)
+    parser.add_argument('--token-latency-ms', type=float, default=2.0)
+    parser.add_argument('--prompt-latency-ms', type=float, default=20.0)
+    parser.add_argument('--vision-latency-ms', type=float, default=150.0)
+    parser.add_argument('--tokens', type=int, default=30)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.2)
+    parser.add_argument('--api-latency-ms', type=float, default=40.0)
+    args = parser.parse_args(argv)
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    config = MockConfig(
+        token_latency_ms=args.token_latency_ms, prompt_latency_ms=args.prompt_latency_ms,
+        vision_latency_ms=args.vision_latency_ms, tokens=args.tokens, error_rate=args.error_rate,
+        jitter=args.jitter, api_latency_ms=args.api_latency_ms, image_side=1600,
+    )
+    server_env = dict(kv.split('=', 1) for kv in args.server_env)
+    print(_HEADER)
+    with MockServer(config, port=args.mock_port) as mock_url, \
+            ServerProcess(mock_url, workers=args.workers, env=server_env) as server:
+        results = asyncio.run(drive(server, mock_url, args))
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'git_rev': _git_rev(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'workers': args.workers,
+            'duration_s': args.duration,
+            'cacheable': args.cacheable,
+            'server_env': server_env,
+            'mock': asdict(config),
+        },
+        'results': results,
+    }
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nsaved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,364 @@
+"""
+Local stand-in for the Ollama API, for benchmarks and dev boxes without a GPU.
+
+Implements just enough of Ollama for the AI server: /api/chat (streaming and
+non-streaming, text and vision), /api/generate, /api/tags and /api/ps — plus
+synthetic product photos under /images/ so vision paths can be exercised
+without external URLs. Latency is simulated per token; --load-latency-ms and
+--max-loaded simulate cold model loads and eviction (reported by /api/ps).
+Replies to requests with a `format` schema follow that schema; --json-defect
+and --json-padding make them malformed or pad them with whitespace.
+
+It also answers the few Twilio and Meta Graph calls the server makes, so every
+endpoint can be exercised offline (point TWILIO_API_BASE / META_API_BASE here).
+Graph responses are paged, carry usage headers (--meta-usage) and batch
+requests are supported.
+
+    python bench/mock_ollama.py --port 11435 --token-latency-ms 8
+    OLLAMA_URL=http://127.0.0.1:11435 uvicorn main:app
+"""
+import io
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from dataclasses import dataclass, field
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+try:
+    from PIL import Image
+except ImportError:  # optional — a tiny fixed JPEG is served instead
+    Image = None
+
+
+@dataclass
+class MockConfig:
+    token_latency_ms: float = 10.0    # per generated token
+    prompt_latency_ms: float = 50.0   # prompt evaluation before the first token
+    vision_latency_ms: float = 400.0  # extra per request that carries images
+    tokens: int = 60                  # completion length
+    error_rate: float = 0.0           # fraction of requests answered with HTTP 500
+    image_side: int = 3000            # synthetic photo size (long side, px)
+    jitter: float = 0.0               # +/- fraction applied to every simulated latency
+    api_latency_ms: float = 80.0      # Twilio / Meta Graph round trip
+    load_latency_ms: float = 0.0      # first request for a model not yet loaded (cold load)
+    max_loaded: int = 0               # models resident at once; loading another evicts the oldest (0 = no limit)
+    api_error_rate: float = 0.0       # fraction of Twilio sends answered with 429/503 (retryable)
+    meta_campaigns: int = 5           # campaigns in the mock ad account (paged like Graph)
+    meta_usage: float = 10.0          # percent reported in X-App-Usage / X-Ad-Account-Usage
+    json_defect: str = ''             # break `format` replies: fence, trailing_comma, truncate or garbage
+    json_padding: int = 0             # whitespace tokens streamed after a `format` reply (runaway padding)
+    model_replies: dict = field(default_factory=dict)  # fixed reply text per model (e.g. a hedging small model)
+
+
+_FALLBACK_JPEG = bytes.fromhex(
+    'ffd8ffe000104a46494600010100000100010000ffdb004300080606070605080707070909080a0c140d0c0b0b0c1912130f'
+    '141d1a1f1e1d1a1c1c20242e2720222c231c1c2837292c30313434341f27393d38323c2e333432ffc0000b080001000101011100'
+    'ffc4001f0000010501010101010100000000000000000102030405060708090a0bffc400b5100002010303020403050504040000'
+    '017d01020300041105122131410613516107227114328191a1082342b1c11552d1f02433627282090a161718191a25262728292a'
+    '3435363738393a434445464748494a535455565758595a636465666768696a737475767778797a838485868788898a9293949596'
+    '9798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae1e2e3e4e5e6e7e8e9eaf1f2'
+    'f3f4f5f6f7f8f9faffda0008010100003f00fbd3ffd9'
+)
+
+LISTING_JSON = {
+    "name": "Mock Product", "price": 150, "category": "Household",
+    "description": "A sturdy everyday item. Great value for T&T shoppers.",
+    "tags": ["mock", "household", "value", "trinidad", "local"],
+}
+
+
+def _sample(schema, key: str = None):
+    """A value shaped like a JSON schema, using LISTING_JSON where the keys match."""
+    if not isinstance(schema, dict):
+        return LISTING_JSON
+    kind = schema.get('type')
+    if kind == 'object':
+        return {k: _sample(sub, k) for k, sub in (schema.get('properties') or {}).items()}
+    if kind == 'array':
+        count = max(schema.get('minItems', 0), min(schema.get('maxItems', 3), 3))
+        return LISTING_JSON[key][:count] if key in LISTING_JSON else [_sample(schema.get('items'))
+                                                                       for _ in range(count)]
+    if key in LISTING_JSON:
+        return LISTING_JSON[key]
+    return 150 if kind in ('number', 'integer') else f'Mock {key or "text"}'
+
+
+def _json_reply(fmt, defect: str) -> str:
+    text = json.dumps(_sample(fmt))
+    if defect == 'fence':
+        return '```json\n' + text + '\n```'
+    if defect == 'trailing_comma':
+        return text[:-1] + ',}'
+    if defect == 'truncate':
+        return text[:int(len(text) * 0.9)]
+    if defect == 'garbage':
+        return 'Sorry, I cannot help with that.'
+    return text
+
+
+def create_app(config: MockConfig = None) -> FastAPI:
+    config = config or MockConfig()
+    app = FastAPI(title="Mock Ollama")
+    app.state.config = config
+    app.state.calls = {'chat': 0, 'generate': 0, 'errors': 0, 'twilio': 0, 'meta': 0}
+    base_image = []
+    loaded = []  # resident models, oldest first (reported by /api/ps)
+
+    async def _load(model: str) -> float:
+        """Simulate loading `model`; returns the load time in ms (0 if already resident)."""
+        if model in loaded:
+            return 0.0
+        delay = _ms(config.load_latency_ms) * 1000
+        await asyncio.sleep(delay / 1000)
+        if model not in loaded:
+            loaded.append(model)
+            if config.max_loaded and len(loaded) > config.max_loaded:
+                loaded.pop(0)
+        return delay
+
+    def _ms(value: float) -> float:
+        """Simulated latency in seconds, with jitter applied."""
+        if config.jitter:
+            value *= 1 + random.uniform(-config.jitter, config.jitter)
+        return max(value, 0) / 1000
+
+    def _reply_text(body: dict) -> str:
+        if body.get('format'):
+            return _json_reply(body['format'], config.json_defect)
+        if body.get('model') in config.model_replies:
+            return config.model_replies[body['model']]
+        words = ['Aye', 'this', 'is', 'a', 'mock', 'reply', 'from', body.get('model', 'ollama')]
+        return ' '.join(words[i % len(words)] for i in range(config.tokens))
+
+    def _stats(prompt_tokens: int, tokens: int, load_ms: float = 0.0) -> dict:
+        return {
+            'done': True, 'done_reason': 'stop',
+            'total_duration': int((load_ms + config.prompt_latency_ms + tokens * config.token_latency_ms) * 1e6),
+            'load_duration': int(max(load_ms, 1) * 1e6),
+            'prompt_eval_count': prompt_tokens,
+            'prompt_eval_duration': int(config.prompt_latency_ms * 1e6),
+            'eval_count': tokens,
+            'eval_duration': int(max(tokens * config.token_latency_ms, 1) * 1e6),
+        }
+
+    @app.post('/api/chat')
+    async def chat(request: Request):
+        body = await request.json()
+        app.state.calls['chat'] += 1
+        if config.error_rate and random.random() < config.error_rate:
+            app.state.calls['errors'] += 1
+            return JSONResponse(status_code=500, content={'error': 'mock failure'})
+        messages = body.get('messages') or []
+        prompt_tokens = sum(len(str(m.get('content', ''))) for m in messages) // 4 + 1
+        has_images = any(m.get('images') for m in messages)
+        text = _reply_text(body)
+        max_tokens = (body.get('options') or {}).get('num_predict') or config.tokens
+        if body.get('format'):
+            # ~4 characters per token, then any runaway whitespace
+            pieces = [text[i:i + 4] for i in range(0, len(text), 4)][:max_tokens]
+            pieces += ['\n'] * min(config.json_padding, max_tokens - len(pieces))
+        else:
+            pieces = text.split(' ')[:max_tokens]
+        pre_delay = config.prompt_latency_ms + (config.vision_latency_ms if has_images else 0)
+        model = body.get('model', 'mock')
+
+        if body.get('stream', True):
+            async def gen():
+                load_ms = await _load(model)
+                await asyncio.sleep(_ms(pre_delay))
+                for i, piece in enumerate(pieces):
+                    await asyncio.sleep(_ms(config.token_latency_ms))
+                    delta = piece if i == 0 or body.get('format') else ' ' + piece
+                    yield json.dumps({'model': model, 'message': {'role': 'assistant', 'content': delta}, 'done': False}) + '\n'
+                yield json.dumps({'model': model, 'message': {'role': 'assistant', 'content': ''},
+                                  **_stats(prompt_tokens, len(pieces), load_ms)}) + '\n'
+            return StreamingResponse(gen(), media_type='application/x-ndjson')
+
+        load_ms = await _load(model)
+        await asyncio.sleep(_ms(pre_delay + len(pieces) * config.token_latency_ms))
+        joiner = '' if body.get('format') else ' '
+        return {'model': model, 'message': {'role': 'assistant', 'content': joiner.join(pieces)},
+                **_stats(prompt_tokens, len(pieces), load_ms)}
+
+    @app.post('/api/generate')
+    async def generate(request: Request):
+        body = await request.json()
+        app.state.calls['generate'] += 1
+        load_ms = await _load(body.get('model', 'mock'))
+        return {'model': body.get('model'), 'response': '', 'done': True, 'done_reason': 'load',
+                'load_duration': int(max(load_ms, 1) * 1e6)}
+
+    @app.get('/api/tags')
+    async def tags():
+        return {'models': [{'name': m, 'model': m} for m in ('qwen2.5:7b', 'qwen3:4b', 'llama3.2:3b', 'qwen3-vl:8b')]}
+
+    @app.get('/api/ps')
+    async def ps():
+        return {'models': [{'name': m, 'model': m} for m in loaded]}
+
+    @app.get('/images/{name}.jpg')
+    async def image(name: str):
+        if not base_image:
+            base_image.append(_synthetic_jpeg(config.image_side))
+        # Decoders ignore bytes after the JPEG end marker, so appending the name gives
+        # every URL distinct content (no content-hash cache hits) at no encoding cost.
+        return Response(base_image[0] + name.encode(), media_type='image/jpeg')
+
+    # ── Third-party APIs (Twilio, Meta Graph) ────────────────────────────────
+    @app.post('/2010-04-01/Accounts/{account_sid}/Messages.json')
+    async def twilio_message(account_sid: str):
+        app.state.calls['twilio'] += 1
+        await asyncio.sleep(_ms(config.api_latency_ms))
+        if random.random() < config.api_error_rate:
+            app.state.calls['errors'] += 1
+            return JSONResponse(status_code=random.choice((429, 503)), headers={'Retry-After': '1'},
+                                content={'code': 20429, 'message': 'Too Many Requests'})
+        return JSONResponse(status_code=201, content={'sid': f'SM{random.getrandbits(64):016x}', 'status': 'queued'})
+
+    def _meta_usage() -> dict:
+        usage = round(config.meta_usage, 2)
+        return {
+            'x-app-usage': json.dumps({'call_count': usage, 'total_time': usage / 2, 'total_cputime': usage / 2}),
+            'x-ad-account-usage': json.dumps({'acc_id_util_pct': usage, 'reset_time_duration': 0}),
+        }
+
+    def _meta_campaign_page(base_url: str, version: str, account_id: str, params) -> dict:
+        limit = int(params.get('limit', 25))
+        after = int(params.get('after', 0))
+        end = min(after + limit, config.meta_campaigns)
+        body = {'data': [{'id': f'{account_id}{i}', 'name': f'Mock campaign {i}', 'status': 'PAUSED',
+                          'objective': 'OUTCOME_TRAFFIC', 'daily_budget': '500'} for i in range(after, end)],
+                'paging': {'cursors': {'before': str(after), 'after': str(end)}}}
+        if end < config.meta_campaigns:
+            body['paging']['next'] = f'{base_url}{version}/act_{account_id}/campaigns?limit={limit}&after={end}'
+        return body
+
+    def _meta_insights() -> dict:
+        return {'data': [{'impressions': '12000', 'clicks': '340', 'spend': '42.10', 'ctr': '2.83',
+                          'date_start': '2024-01-01', 'date_stop': '2024-01-30'}]}
+
+    @app.get('/{version}/act_{account_id}/campaigns')
+    async def meta_campaigns(version: str, account_id: str, request: Request):
+        app.state.calls['meta'] += 1
+        await asyncio.sleep(_ms(config.api_latency_ms))
+        return JSONResponse(_meta_campaign_page(str(request.base_url), version, account_id, request.query_params),
+                            headers=_meta_usage())
+
+    @app.post('/{version}/act_{account_id}/campaigns')
+    async def meta_create_campaign(version: str, account_id: str):
+        app.state.calls['meta'] += 1
+        await asyncio.sleep(_ms(config.api_latency_ms))
+        return JSONResponse({'id': str(random.getrandbits(48))}, headers=_meta_usage())
+
+    @app.get('/{version}/act_{account_id}/insights')
+    async def meta_insights(version: str, account_id: str):
+        app.state.calls['meta'] += 1
+        await asyncio.sleep(_ms(config.api_latency_ms))
+        return JSONResponse(_meta_insights(), headers=_meta_usage())
+
+    @app.post('/{version}/')
+    async def meta_batch(version: str, request: Request):
+        """Graph batch requests (GET campaigns/insights only): one HTTP call, one answer per request."""
+        app.state.calls['meta'] += 1
+        await asyncio.sleep(_ms(config.api_latency_ms))
+        form = await request.form()
+        answers = []
+        for item in json.loads(form.get('batch') or '[]'):
+            path, _, query = item.get('relative_url', '').partition('?')
+            params = dict(pair.split('=', 1) for pair in query.split('&') if '=' in pair)
+            account_id = path.split('/')[0].removeprefix('act_')
+            if path.endswith('/campaigns'):
+                code, body = 200, _meta_campaign_page(str(request.base_url), version, account_id, params)
+            elif path.endswith('/insights'):
+                code, body = 200, _meta_insights()
+            else:
+                code, body = 400, {'error': {'message': f'Unsupported path {path}', 'code': 100}}
+            answers.append({'code': code, 'headers': [], 'body': json.dumps(body)})
+        return JSONResponse(answers, headers=_meta_usage())
+
+    @app.get('/_mock/calls')
+    async def calls():
+        return app.state.calls
+
+    return app
+
+
+def _synthetic_jpeg(side: int) -> bytes:
+    if Image is None:
+        return _FALLBACK_JPEG
+    img = Image.new('RGB', (side, side * 3 // 4), (180, 60, 40))
+    # A little noise so the JPEG has phone-photo-like entropy rather than a flat colour.
+    noise = Image.effect_noise((side, side * 3 // 4), 40).convert('RGB')
+    img = Image.blend(img, noise, 0.3)
+    out = io.BytesIO()
+    img.save(out, format='JPEG', quality=92)
+    return out.getvalue()
+
+
+class MockServer:
+    """Run the mock in a background thread: `with MockServer(port=11435) as url: ...`."""
+
+    def __init__(self, config: MockConfig = None, host: str = '127.0.0.1', port: int = 11435):
+        import uvicorn
+        self.app = create_app(config)
+        self.url = f'http://{host}:{port}'
+        self._server = uvicorn.Server(uvicorn.Config(self.app, host=host, port=port, log_level='warning'))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def __enter__(self) -> str:
+        self._thread.start()
+        deadline = time.time() + 10
+        while not self._server.started:
+            if time.time() > deadline:
+                raise RuntimeError('mock Ollama failed to start')
+            time.sleep(0.02)
+        return self.url
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+def main(argv=None):
+    import uvicorn
+    parser = argparse.ArgumentParser(description='Mock Ollama server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--token-latency-ms', type=float, default=MockConfig.token_latency_ms)
+    parser.add_argument('--prompt-latency-ms', type=float, default=MockConfig.prompt_latency_ms)
+    parser.add_argument('--vision-latency-ms', type=float, default=MockConfig.vision_latency_ms)
+    parser.add_argument('--tokens', type=int, default=MockConfig.tokens)
+    parser.add_argument('--error-rate', type=float, default=MockConfig.error_rate)
+    parser.add_argument('--jitter', type=float, default=MockConfig.jitter)
+    parser.add_argument('--api-latency-ms', type=float, default=MockConfig.api_latency_ms)
+    parser.add_argument('--load-latency-ms', type=float, default=MockConfig.load_latency_ms)
+    parser.add_argument('--max-loaded', type=int, default=MockConfig.max_loaded)
+    parser.add_argument('--api-error-rate', type=float, default=MockConfig.api_error_rate)
+    parser.add_argument('--meta-campaigns', type=int, default=MockConfig.meta_campaigns)
+    parser.add_argument('--meta-usage', type=float, default=MockConfig.meta_usage)
+    parser.add_argument('--json-defect', choices=('', 'fence', 'trailing_comma', 'truncate', 'garbage'),
+                        default=MockConfig.json_defect)
+    parser.add_argument('--json-padding', type=int, default=MockConfig.json_padding)
+    parser.add_argument('--model-reply', action='append', default=[], metavar='MODEL=TEXT',
+                        help='fixed reply for one model (repeatable)')
+    args = parser.parse_args(argv)
+    config = MockConfig(
+        token_latency_ms=args.token_latency_ms, prompt_latency_ms=args.prompt_latency_ms,
+        vision_latency_ms=args.vision_latency_ms, tokens=args.tokens, error_rate=args.error_rate,
+        jitter=args.jitter, api_latency_ms=args.api_latency_ms,
+        load_latency_ms=args.load_latency_ms, max_loaded=args.max_loaded, api_error_rate=args.api_error_rate,
+        meta_campaigns=args.meta_campaigns, meta_usage=args.meta_usage,
+        json_defect=args.json_defect, json_padding=args.json_padding,
+        model_replies=dict(spec.split('=', 1) for spec in args.model_reply),
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
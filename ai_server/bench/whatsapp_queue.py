@@ -0,0 +1,89 @@
+"""
+Throughput benchmark: queued WhatsApp sends against the mock Twilio API.
+
+Posts a burst of order notifications to /send-whatsapp, then waits for the
+queue to drain. Reports how long the endpoint takes to answer (it only writes
+the job) and how fast the dispatcher empties the queue, with Twilio answering
+a fraction of sends with 429/503 to exercise retries.
+
+    cd ai_server && python bench/whatsapp_queue.py --messages 200 --destinations 100 --error-rate 0.1
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.mock_ollama import MockConfig, MockServer  # noqa: E402
+
+
+async def run(args):
+    import httpx
+    import main
+    from whatsapp_queue import whatsapp_queue
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app), httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=600) as client:
+        latencies = []
+        start = time.perf_counter()
+        for i in range(args.messages):
+            t0 = time.perf_counter()
+            r = await client.post('/send-whatsapp', json={
+                'to': f'+1868555{i % args.destinations:04d}',
+                'message': f'Order #{i} confirmed',
+                'order_id': f'bench-{i}',
+            }, headers={'x-forwarded-for': f'10.0.{i // 250}.{i % 250}'})
+            r.raise_for_status()
+            latencies.append(time.perf_counter() - t0)
+        enqueued = time.perf_counter() - start
+
+        while True:
+            stats = whatsapp_queue.stats()
+            if stats['sent'] + stats['failed'] >= args.messages:
+                break
+            await asyncio.sleep(0.05)
+        drained = time.perf_counter() - start
+        calls = (await main.http_pool.client('twilio').get(f"{os.environ['TWILIO_API_BASE']}/_mock/calls")).json()
+
+    latencies.sort()
+    print(f"\n{args.messages} messages to {args.destinations} numbers, mock Twilio latency "
+          f"{args.api_latency_ms:.0f} ms, error rate {args.error_rate:.0%}")
+    print(f"  enqueue   p50 {statistics.median(latencies) * 1000:.1f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms, all in {enqueued:.2f} s")
+    print(f"  drained   {drained:.2f} s ({args.messages / drained * 60:.0f} msgs/min)")
+    print(f"  sent {stats['sent']}, failed {stats['failed']}, retried {stats['retried']}, "
+          f"deferred {stats['deferred']}; Twilio calls {calls['twilio']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--destinations', type=int, default=100)
+    parser.add_argument('--error-rate', type=float, default=0.1, help='fraction of Twilio calls answered 429/503')
+    parser.add_argument('--api-latency-ms', type=float, default=80.0)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--port', type=int, default=11435)
+    args = parser.parse_args(argv)
+
+    config = MockConfig(api_latency_ms=args.api_latency_ms, api_error_rate=args.error_rate)
+    with MockServer(config, port=args.port) as url, tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            'OLLAMA_URL': url,
+            'TWILIO_API_BASE': url,
+            'TWILIO_ACCOUNT_SID': 'ACbench',
+            'TWILIO_AUTH_TOKEN': 'bench',
+            'WHATSAPP_QUEUE_PATH': os.path.join(tmp, 'whatsapp_queue.db'),
+            'WHATSAPP_WORKERS': str(args.workers),
+            # Retries within the run rather than minutes later.
+            'WHATSAPP_BACKOFF_BASE': '0.2',
+            'WHATSAPP_BACKOFF_MAX': '2',
+        })
+        asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
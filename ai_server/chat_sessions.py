@@ -0,0 +1,260 @@
+"""
+Server-side conversation sessions for /island-chat.
+
+Without them every message re-uploads the recent history and the server
+rebuilds a sliding window of the last 8 turns — so the prompt prefix changes
+on every turn and Ollama re-evaluates the whole conversation from scratch.
+
+A session keeps the conversation on the server, keyed by an opaque id the
+server hands out. The prompt is built so that consecutive turns only ever
+append to it:
+
+    [persona + mode + summary of older turns] [turn 1] ... [turn n] [new message]
+
+so Ollama's prompt cache (the KV cache of the previous request on the same
+runner) covers everything but the new message, and requests for a session are
+routed to the same backend (see ollama_backends.py, affinity_key). Once the
+turns exceed ISLAND_SESSION_TOKEN_BUDGET, all but the last
+ISLAND_SESSION_KEEP_TURNS are folded into the summary by a background,
+low-priority generation — the prefix changes once per fold instead of once
+per turn.
+
+Storage mirrors response_cache.py: an LRU of compressed records bounded by
+bytes and TTL, and with several workers a shared SQLite table instead (any
+worker can serve the next turn).
+
+Env config:
+    ISLAND_SESSION_TTL=1800                 seconds of inactivity before a session expires
+    ISLAND_SESSION_MAX_BYTES=16777216       memory bound for all sessions (16 MB, compressed)
+    ISLAND_SESSION_TOKEN_BUDGET=1200        history tokens before older turns are summarised
+    ISLAND_SESSION_KEEP_TURNS=4             turns kept verbatim after a fold
+    ISLAND_SESSION_PATH=/data/sessions.db   shared SQLite store (default with multiple workers)
+"""
+import os
+import json
+import time
+import zlib
+import asyncio
+import logging
+import secrets
+import sqlite3
+from collections import OrderedDict
+
+import shared_state
+from response_cache import _DiskTier
+from token_budget import estimate
+
+logger = logging.getLogger(__name__)
+
+MAX_SESSION_ID = 64
+FOLD_TIMEOUT = 120  # seconds before an unfinished fold (e.g. worker restart) is retried
+
+
+class Session:
+    __slots__ = ('id', 'mode', 'summary', 'turns', 'folded', 'fold_started')
+
+    def __init__(self, id: str, mode: str, summary: str = '', turns: list = None, folded: int = 0,
+                 fold_started: float = 0.0):
+        self.id = id
+        self.mode = mode
+        self.summary = summary
+        self.turns = turns if turns is not None else []  # [[role, content], ...]
+        self.folded = folded                              # turns already folded into the summary
+        self.fold_started = fold_started                  # wall time of the fold in progress, 0 if none
+
+    @property
+    def summarizing(self) -> bool:
+        return time.time() - self.fold_started < FOLD_TIMEOUT
+
+    def add(self, role: str, content: str):
+        self.turns.append([role, content])
+
+    def history_tokens(self) -> int:
+        return sum(estimate(content) for _, content in self.turns)
+
+    def messages(self, system_prompt: str) -> list:
+        """Chat messages for the next turn (without the new user message)."""
+        if self.summary:
+            system_prompt += '\n\nSummary of the conversation so far:\n' + self.summary
+        return [{'role': 'system', 'content': system_prompt}] + [
+            {'role': role, 'content': content} for role, content in self.turns]
+
+    def encode(self) -> bytes:
+        blob = json.dumps([self.mode, self.summary, self.turns, self.folded, self.fold_started],
+                          ensure_ascii=False, separators=(',', ':'))
+        return zlib.compress(blob.encode('utf-8'), 1)
+
+    @classmethod
+    def decode(cls, id: str, raw: bytes) -> 'Session':
+        mode, summary, turns, folded, fold_started = json.loads(zlib.decompress(raw))
+        return cls(id, mode, summary, turns, folded, fold_started)
+
+
+class SessionStore:
+    def __init__(self, ttl: float = 1800, max_bytes: int = 16 * 1024 * 1024, token_budget: int = 1200,
+                 keep_turns: int = 4, disk_path: str = None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.token_budget = token_budget
+        self.keep_turns = max(0, keep_turns)
+        self._mem = OrderedDict()  # id -> (expires_at, encoded session)
+        self._mem_bytes = 0
+        self._disk = None
+        if disk_path:
+            try:
+                self._disk = _DiskTier(disk_path, max_bytes, table='chat_sessions')
+            except sqlite3.Error as e:
+                logger.warning(f"Chat session disk store disabled ({disk_path}): {e}")
+        self.created = 0
+        self.resumed = 0
+        self.expired = 0   # unknown or expired ids presented by clients
+        self.folds = 0
+        self.fold_failures = 0
+        self._tasks = set()
+
+    @classmethod
+    def from_env(cls) -> 'SessionStore':
+        return cls(
+            ttl=float(os.environ.get('ISLAND_SESSION_TTL', '1800')),
+            max_bytes=int(os.environ.get('ISLAND_SESSION_MAX_BYTES', str(16 * 1024 * 1024))),
+            token_budget=int(os.environ.get('ISLAND_SESSION_TOKEN_BUDGET', '1200')),
+            keep_turns=int(os.environ.get('ISLAND_SESSION_KEEP_TURNS', '4')),
+            disk_path=os.environ.get('ISLAND_SESSION_PATH') or (
+                shared_state.state_path('chat_sessions.db') if shared_state.MULTI_WORKER else None),
+        )
+
+    # ── Storage ──────────────────────────────────────────────────────────────
+
+    def new(self, mode: str) -> Session:
+        self.created += 1
+        return Session(secrets.token_urlsafe(16), mode)
+
+    async def get(self, session_id: str):
+        """The live session for `session_id`, or None (unknown, expired or evicted)."""
+        session = await self._load(session_id) if session_id and len(session_id) <= MAX_SESSION_ID else None
+        if session is None:
+            self.expired += 1
+        else:
+            self.resumed += 1
+        return session
+
+    async def _load(self, session_id: str):
+        now = time.time()
+        raw = None
+        if self._disk is not None:
+            # The shared table is the source of truth: another worker may have
+            # served the previous turn.
+            try:
+                row = await asyncio.to_thread(self._disk.get, session_id, now)
+            except sqlite3.Error as e:
+                logger.warning(f"Chat session read failed: {e}")
+                row = None
+            raw = bytes(row[0]) if row is not None else None
+        else:
+            entry = self._mem.get(session_id)
+            if entry is not None and entry[0] > now:
+                self._mem.move_to_end(session_id)
+                raw = entry[1]
+            elif entry is not None:
+                self._drop(session_id)
+        return Session.decode(session_id, raw) if raw is not None else None
+
+    async def put(self, session: Session):
+        encoded = session.encode()
+        now = time.time()
+        if self._disk is not None:
+            try:
+                await asyncio.to_thread(self._disk.put, session.id, encoded, now + self.ttl, now)
+            except sqlite3.Error as e:
+                logger.warning(f"Chat session write failed: {e}")
+            return
+        self._drop(session.id)
+        if len(encoded) > self.max_bytes:
+            return
+        self._mem[session.id] = (now + self.ttl, encoded)
+        self._mem_bytes += len(encoded)
+        while self._mem_bytes > self.max_bytes:
+            _, (_, old) = self._mem.popitem(last=False)
+            self._mem_bytes -= len(old)
+
+    def _drop(self, session_id: str):
+        entry = self._mem.pop(session_id, None)
+        if entry is not None:
+            self._mem_bytes -= len(entry[1])
+
+    async def record_turn(self, session: Session, message: str, reply: str, summarize):
+        """
+        Append a completed exchange and save it. The session is re-read first so a
+        fold that finished while the reply was generated is kept.
+        `summarize(previous_summary, turns)` is a coroutine returning a new summary.
+        """
+        current = await self._load(session.id) or session
+        current.mode = session.mode
+        current.add('user', message)
+        current.add('assistant', reply)
+        await self.put(current)
+        self._maybe_fold(current, summarize)
+
+    # ── Summarisation ────────────────────────────────────────────────────────
+
+    def _maybe_fold(self, session: Session, summarize):
+        """Fold the older turns in the background once the history exceeds the token budget."""
+        if session.summarizing or len(session.turns) <= self.keep_turns:
+            return
+        if session.history_tokens() <= self.token_budget:
+            return
+        task = asyncio.ensure_future(self._fold(session.id, summarize))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fold(self, session_id: str, summarize):
+        session = await self._load(session_id)
+        if session is None or session.summarizing:
+            return
+        session.fold_started = time.time()
+        await self.put(session)  # other turns keep appending while the summary is generated
+        count = len(session.turns) - self.keep_turns
+        folded, old_turns = session.folded, session.turns[:count]
+        try:
+            summary = await summarize(session.summary, old_turns)
+        except Exception as e:
+            summary = None
+            self.fold_failures += 1
+            logger.warning(f"Chat session summary failed: {e}")
+        current = await self._load(session_id)
+        if current is None:
+            return
+        current.fold_started = 0.0
+        if summary and current.folded == folded:
+            current.summary = summary.strip()
+            current.turns = current.turns[count:]
+            current.folded += count
+            self.folds += 1
+        elif not summary and current.history_tokens() > 2 * self.token_budget:
+            # Summaries keep failing: drop the oldest turns rather than grow without bound.
+            current.turns = current.turns[count:]
+            current.folded += count
+        await self.put(current)
+
+    async def aclose(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+    def stats(self) -> dict:
+        out = {
+            'created': self.created,
+            'resumed': self.resumed,
+            'expired': self.expired,
+            'folds': self.folds,
+            'fold_failures': self.fold_failures,
+            'memory': {'sessions': len(self._mem), 'bytes': self._mem_bytes, 'max_bytes': self.max_bytes},
+        }
+        if self._disk is not None:
+            out['disk'] = self._disk.usage()
+        return out
+
+
+chat_sessions = SessionStore.from_env()
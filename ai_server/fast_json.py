@@ -0,0 +1,84 @@
+"""
+Opt-in fast JSON path for the hot chat endpoints.
+
+By default every reply goes model -> response_model validation -> pydantic
+serialization -> json.dumps, and every Ollama reply is decoded with json.loads.
+With FAST_JSON=1 (and orjson installed):
+
+  * responses render with orjson (default_response_class, NDJSON stream lines);
+  * replies built from trusted internal values skip pydantic entirely:
+    respond(AIResponse, ...) returns the rendered JSON directly, which FastAPI
+    sends as-is without re-validating against the response_model;
+  * Ollama replies and stream chunks are decoded with orjson.
+
+The wire format is unchanged (same keys, same order, compact separators).
+Without orjson, or with FAST_JSON unset, everything takes the standard path.
+bench/json_path.py compares both on realistic payloads.
+
+Env config:
+    FAST_JSON=0
+"""
+import os
+import json
+import logging
+
+from fastapi.responses import JSONResponse as _StdJSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional — pip install orjson
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+_requested = os.environ.get('FAST_JSON', '0').lower() in ('1', 'true', 'yes')
+if _requested and orjson is None:
+    logger.warning("FAST_JSON is set but orjson is not installed; using the standard JSON path")
+ENABLED = _requested and orjson is not None
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def dumps(obj) -> bytes:
+    if ENABLED:
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def dumps_line(obj) -> bytes:
+    """One NDJSON line."""
+    return dumps(obj) + b'\n'
+
+
+def loads(data):
+    """Decode JSON from bytes or str."""
+    return orjson.loads(data) if ENABLED else json.loads(data)
+
+
+class FastJSONResponse(_StdJSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=_ORJSON_OPTIONS)
+
+
+JSONResponse = FastJSONResponse if ENABLED else _StdJSONResponse
+
+_field_defaults = {}  # model class -> {field: default}, in declaration order
+
+
+def respond(model_cls, **fields):
+    """
+    Build a `model_cls` reply from trusted values (our own strings, numbers and
+    dicts). On the fast path the JSON is rendered directly, without validation;
+    otherwise the model instance is returned for FastAPI to validate.
+    """
+    if not ENABLED:
+        return model_cls(**fields)
+    defaults = _field_defaults.get(model_cls)
+    if defaults is None:
+        defaults = _field_defaults[model_cls] = {
+            name: field.get_default(call_default_factory=True) for name, field in model_cls.model_fields.items()}
+    return FastJSONResponse({**defaults, **fields})
+
+
+def stats() -> dict:
+    return {'enabled': ENABLED, 'orjson': orjson.__version__ if orjson is not None else None}
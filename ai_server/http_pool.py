@@ -0,0 +1,155 @@
+"""
+Shared, lifespan-managed httpx connection pools — one AsyncClient per upstream.
+
+Opening a new AsyncClient per request costs a TCP connect (and a TLS handshake
+for Twilio / Meta) on every call. Instead each upstream gets one long-lived
+client with keep-alive, created lazily and closed on app shutdown.
+
+Limits are configurable per upstream via env, e.g.:
+    HTTP_POOL_MAX_CONNECTIONS=100        (default for every upstream)
+    OLLAMA_POOL_MAX_CONNECTIONS=32       (override for one upstream)
+    HTTP_POOL_MAX_KEEPALIVE=20 / <UPSTREAM>_POOL_MAX_KEEPALIVE
+    HTTP_POOL_KEEPALIVE_EXPIRY=30 / <UPSTREAM>_POOL_KEEPALIVE_EXPIRY  (seconds)
+
+Clients belong to the event loop that created them: a process that also runs
+the sync facade's background loop (sync_bridge.py) gets a separate set there.
+"""
+import os
+import time
+import asyncio
+import logging
+import weakref
+import importlib.util
+import httpx
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 needs the optional `h2` package (pip install httpx[http2]).
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+# Per-upstream defaults. `http2` is only honoured for https upstreams —
+# Ollama is plain http on the docker network, so it stays on HTTP/1.1.
+UPSTREAMS = {
+    'ollama': {'timeout': 120.0, 'http2': False},
+    'image':  {'timeout': 60.0,  'http2': True},
+    'twilio': {'timeout': 30.0,  'http2': True},
+    'meta':   {'timeout': 30.0,  'http2': True},
+}
+
+
+def _env_num(name: str, upstream: str, default, cast=int):
+    value = os.environ.get(f'{upstream.upper()}_POOL_{name}') or os.environ.get(f'HTTP_POOL_{name}')
+    if value is None or value == '':
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid pool setting {name}={value!r} for {upstream}")
+        return default
+
+
+def pool_limits(upstream: str) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=_env_num('MAX_CONNECTIONS', upstream, 100),
+        max_keepalive_connections=_env_num('MAX_KEEPALIVE', upstream, 20),
+        keepalive_expiry=_env_num('KEEPALIVE_EXPIRY', upstream, 30.0, float),
+    )
+
+
+def _connect_timer(upstream: str):
+    """
+    httpx request hook that attaches an httpcore trace callback, so new TCP/TLS
+    connections are timed into the connect histogram (TCP connect, plus the TLS
+    handshake for https). Requests on a reused keep-alive connection record nothing.
+    """
+    histogram = metrics.UPSTREAM_CONNECT.labels(upstream)
+
+    async def on_request(request: httpx.Request):
+        started = {}
+
+        async def trace(event: str, info: dict):
+            if event in ('connection.connect_tcp.started', 'connection.start_tls.started'):
+                started.setdefault('t', time.perf_counter())
+            elif event in ('connection.connect_tcp.complete', 'connection.start_tls.complete'):
+                if event == 'connection.start_tls.complete' or request.url.scheme != 'https':
+                    histogram.observe(time.perf_counter() - started.pop('t', time.perf_counter()))
+
+        request.extensions['trace'] = trace
+
+    return on_request
+
+
+class UpstreamPool:
+    """Registry of one pooled AsyncClient per named upstream."""
+
+    def __init__(self, upstreams: dict = None):
+        self._config = dict(upstreams or UPSTREAMS)
+        self._by_loop = weakref.WeakKeyDictionary()  # event loop -> {upstream: client}
+
+    @property
+    def _clients(self) -> dict:
+        """Clients of the running event loop."""
+        return self._by_loop.setdefault(asyncio.get_running_loop(), {})
+
+    def client(self, upstream: str) -> httpx.AsyncClient:
+        """Return the shared client for `upstream`, creating it on first use."""
+        clients = self._clients
+        client = clients.get(upstream)
+        if client is None or client.is_closed:
+            cfg = self._config.get(upstream, {'timeout': 30.0, 'http2': False})
+            client = httpx.AsyncClient(
+                timeout=cfg['timeout'],
+                limits=pool_limits(upstream),
+                http2=bool(cfg.get('http2')) and HTTP2_AVAILABLE,
+                event_hooks={'request': [_connect_timer(upstream)]},
+            )
+            clients[upstream] = client
+        return client
+
+    async def startup(self):
+        """Eagerly create every configured client so the first request is not slower."""
+        for upstream in self._config:
+            self.client(upstream)
+        logger.info(f"HTTP pools ready: {', '.join(self._config)} (http2={'on' if HTTP2_AVAILABLE else 'off'})")
+
+    async def aclose(self):
+        clients = self._by_loop.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing HTTP pool: {e}")
+
+    def stats(self) -> dict:
+        """Best-effort open / idle / waiting counts per upstream (reads httpcore internals)."""
+        out = {}
+        try:
+            clients = self._clients
+        except RuntimeError:  # no running loop
+            clients = {}
+        for upstream in self._config:
+            client = clients.get(upstream)
+            limits = pool_limits(upstream)
+            entry = {
+                'open': 0, 'idle': 0, 'active': 0, 'waiting': 0,
+                'http2': bool(self._config[upstream].get('http2')) and HTTP2_AVAILABLE,
+                'max_connections': limits.max_connections,
+                'max_keepalive': limits.max_keepalive_connections,
+            }
+            if client is not None and not client.is_closed:
+                pool = getattr(getattr(client, '_transport', None), '_pool', None)
+                connections = list(getattr(pool, 'connections', []) or [])
+                idle = sum(1 for c in connections if c.is_idle())
+                entry['open'] = len(connections)
+                entry['idle'] = idle
+                entry['active'] = len(connections) - idle
+                # Requests queued for a connection have none assigned yet.
+                pending = list(getattr(pool, '_requests', []) or [])
+                entry['waiting'] = sum(1 for r in pending if getattr(r, 'connection', None) is None)
+            out[upstream] = entry
+        return out
+
+
+http_pool = UpstreamPool()
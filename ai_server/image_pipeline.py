@@ -0,0 +1,181 @@
+"""
+Image preprocessing for the vision endpoints.
+
+Phone photos are often multi-MB, 12+ MP JPEGs, while qwen3-vl only makes use of
+roughly 1024px on the long side. Instead of base64-ing the original we:
+
+  1. stream the download with a hard byte cap
+  2. decode (JPEG draft mode decodes straight at reduced scale)
+  3. downsize to VISION_MAX_SIDE
+  4. re-encode as a compact JPEG
+
+Decode/resize/encode run in a small thread pool so the event loop never blocks,
+and the processed bytes are cached by content hash of the original.
+
+Pillow is optional: without it images are sent as downloaded (still capped).
+
+Env config:
+    IMAGE_MAX_BYTES=15728640       max download size (15 MB)
+    VISION_MAX_SIDE=1024           long-side pixel bound sent to the model
+    VISION_JPEG_QUALITY=85
+    IMAGE_WORKERS=2                preprocessing threads
+    IMAGE_CACHE_MAX_BYTES=67108864 processed-image cache bound (64 MB)
+"""
+import os
+import io
+import time
+import base64
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+
+from http_pool import http_pool
+import metrics
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional dependency
+    Image = None
+    logger.warning("Pillow not installed — vision images will be sent without resizing")
+
+IMAGE_MAX_BYTES = int(os.environ.get('IMAGE_MAX_BYTES', str(15 * 1024 * 1024)))
+VISION_MAX_SIDE = int(os.environ.get('VISION_MAX_SIDE', '1024'))
+VISION_JPEG_QUALITY = int(os.environ.get('VISION_JPEG_QUALITY', '85'))
+
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('IMAGE_WORKERS', '2')),
+                               thread_name_prefix='image-prep')
+
+
+class ImageTooLarge(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=413, detail=f'Image is larger than {IMAGE_MAX_BYTES // (1024 * 1024)} MB.')
+
+
+class ImageUnreadable(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=422, detail='Could not read the image. Please upload a JPEG, PNG or WebP photo.')
+
+
+class _ProcessedCache:
+    """LRU of content-hash -> base64 payload, bounded by total bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: str):
+        value = self._items.get(digest)
+        if value is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(digest)
+        self.hits += 1
+        return value
+
+    def put(self, digest: str, value: str):
+        if len(value) > self.max_bytes or digest in self._items:
+            return
+        self._items[digest] = value
+        self._bytes += len(value)
+        while self._bytes > self.max_bytes:
+            _, old = self._items.popitem(last=False)
+            self._bytes -= len(old)
+
+    def stats(self) -> dict:
+        return {'entries': len(self._items), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses}
+
+
+processed_cache = _ProcessedCache(int(os.environ.get('IMAGE_CACHE_MAX_BYTES', str(64 * 1024 * 1024))))
+
+
+async def fetch_image(url: str) -> bytes:
+    """Stream the image download, aborting as soon as it exceeds IMAGE_MAX_BYTES."""
+    async with metrics.track_upstream('image_fetch'), http_pool.client('image').stream('GET', url) as resp:
+        resp.raise_for_status()
+        declared = resp.headers.get('content-length')
+        if declared and declared.isdigit() and int(declared) > IMAGE_MAX_BYTES:
+            raise ImageTooLarge()
+        buf = bytearray()
+        async for chunk in resp.aiter_bytes():
+            buf += chunk
+            if len(buf) > IMAGE_MAX_BYTES:
+                raise ImageTooLarge()
+    return bytes(buf)
+
+
+def _process(raw: bytes, timings: dict) -> str:
+    """Blocking decode -> resize -> encode -> base64; runs in the thread pool."""
+    if Image is None:
+        t0 = time.perf_counter()
+        out = base64.b64encode(raw).decode()
+        timings['encode_ms'] = _ms(t0)
+        return out
+
+    t0 = time.perf_counter()
+    try:
+        img = Image.open(io.BytesIO(raw))
+        # JPEG draft mode lets libjpeg decode at 1/2, 1/4 or 1/8 scale directly.
+        img.draft('RGB', (VISION_MAX_SIDE, VISION_MAX_SIDE))
+        img.load()
+    except Exception as e:
+        logger.warning(f"Image decode failed: {e}")
+        raise ImageUnreadable()
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    timings['decode_ms'] = _ms(t0)
+
+    t0 = time.perf_counter()
+    if max(img.size) > VISION_MAX_SIDE:
+        img.thumbnail((VISION_MAX_SIDE, VISION_MAX_SIDE), Image.Resampling.LANCZOS)
+    timings['resize_ms'] = _ms(t0)
+
+    t0 = time.perf_counter()
+    out = io.BytesIO()
+    img.save(out, format='JPEG', quality=VISION_JPEG_QUALITY)
+    encoded = base64.b64encode(out.getbuffer()).decode()
+    timings['encode_ms'] = _ms(t0)
+    return encoded
+
+
+async def prepare_image(url: str, timings: dict, details: dict = None) -> str:
+    """
+    Fetch and preprocess an image for the vision model; returns base64 JPEG.
+    `timings` gets per-stage milliseconds only; `details`, if given, gets
+    original_bytes and cache_hit.
+    """
+    details = {} if details is None else details
+    t0 = time.perf_counter()
+    raw = await fetch_image(url)
+    timings['fetch_ms'] = _ms(t0)
+    details['original_bytes'] = len(raw)
+
+    digest = hashlib.sha256(raw).hexdigest()
+    cached = processed_cache.get(digest)
+    if cached is not None:
+        details['cache_hit'] = True
+        return cached
+
+    loop = asyncio.get_running_loop()
+    encoded = await loop.run_in_executor(_executor, _process, raw, timings)
+    processed_cache.put(digest, encoded)
+    details['cache_hit'] = False
+    return encoded
+
+
+def stats() -> dict:
+    return {'pillow': Image is not None, 'max_side': VISION_MAX_SIDE, 'max_bytes': IMAGE_MAX_BYTES,
+            'processed_cache': processed_cache.stats()}
+
+
+def _ms(t0: float) -> float:
+    return round((time.perf_counter() - t0) * 1000, 1)
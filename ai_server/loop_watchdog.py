@@ -0,0 +1,104 @@
+"""
+Event-loop lag watchdog — catches blocking calls on the event loop in production.
+
+One blocking call (a sync HTTP request, time.sleep, a big json.dumps, PIL work
+not pushed to a thread) stalls every in-flight request in the worker. A
+watchdog thread pings the loop every LOOP_LAG_INTERVAL seconds
+(call_soon_threadsafe — one self-pipe write) and:
+
+  * records how long the loop took to run the ping into
+    trinibuild_event_loop_lag_seconds;
+  * if a ping is still pending after LOOP_STALL_MS, logs the loop thread's
+    current stack once per stall — which names the blocking call while it is
+    still blocking — and counts it (exported by main.py as
+    trinibuild_event_loop_stalls_total).
+
+Env config:
+    LOOP_LAG_INTERVAL=0.1     seconds between pings (0 disables the watchdog)
+    LOOP_STALL_MS=250         loop unresponsive this long = stall (stack is logged)
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LoopWatchdog:
+    def __init__(self, interval: float = 0.1, stall_after: float = 0.25):
+        self.interval = interval
+        self.stall_after = stall_after
+        self.stalls = 0
+        self.max_lag = 0.0
+        self._loop = None
+        self._loop_thread = None
+        self._sent = None       # monotonic time of the unanswered ping, if any
+        self._thread = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_env(cls) -> 'LoopWatchdog':
+        return cls(
+            interval=float(os.environ.get('LOOP_LAG_INTERVAL', '0.1')),
+            stall_after=float(os.environ.get('LOOP_STALL_MS', '250')) / 1000,
+        )
+
+    def _pong(self, sent: float):
+        # Runs on the loop, so the metric is recorded from the loop thread.
+        lag = time.monotonic() - sent
+        self.max_lag = max(self.max_lag, lag)
+        metrics.LOOP_LAG.observe(lag)
+        self._sent = None
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(min(self.interval, self.stall_after / 2)):
+            sent = self._sent
+            if sent is None:
+                self._sent = sent = time.monotonic()
+                try:
+                    self._loop.call_soon_threadsafe(self._pong, sent)
+                except RuntimeError:  # loop closed
+                    return
+                continue
+            silent = time.monotonic() - sent
+            if silent < self.stall_after or reported == sent:
+                continue  # still within budget, or this stall was already reported
+            reported = sent
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = ''.join(traceback.format_stack(frame, limit=8)) if frame is not None else '(unavailable)\n'
+            logger.warning(f"Event loop blocked for {silent * 1000:.0f}ms+; loop thread is at:\n{stack.rstrip()}")
+
+    def start(self):
+        """Start the watchdog thread for the running loop (call from the app lifespan)."""
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._sent = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    async def aclose(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            'stalls': self.stalls,
+            'max_lag_ms': round(self.max_lag * 1000, 1),
+            'stall_threshold_ms': round(self.stall_after * 1000),
+        }
+
+
+loop_watchdog = LoopWatchdog.from_env()
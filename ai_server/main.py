@@ -1,28 +1,101 @@
 import os
+import json
+import asyncio
 import logging
 import time
-import threading
 import httpx
-from collections import defaultdict, deque
-import requests
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Depends, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 from pydantic import BaseModel, Field
 from typing import Optional, List
 from dotenv import load_dotenv
 
-# Load environment variables
+# Load environment variables (before the local modules below read their config)
 load_dotenv()
 
+import shared_state
+
+# `python main.py` with WEB_CONCURRENCY > 1: this process would only supervise
+# workers that import main:app themselves, so become the uvicorn CLI before the
+# modules below open shared memory, SQLite files and slot locks it would never
+# close. (uvicorn.run from here would also make every spawned worker import this
+# file a second time, as __mp_main__.)
+if __name__ == "__main__" and shared_state.MULTI_WORKER:
+    import sys
+    os.execv(sys.executable, [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '0.0.0.0', '--port', '8000',
+                              '--workers', str(shared_state.WORKERS),
+                              '--app-dir', os.path.dirname(os.path.abspath(__file__))])
+
+import metrics
+import fast_json
+from http_pool import http_pool
+from scheduler import scheduler, QueueFull, INTERACTIVE, BATCH
+from response_cache import response_cache, cache_key
+from singleflight import singleflight
+from ollama_backends import ollama_pool
+from model_manager import ModelManager
+from sync_bridge import sync_bridge
+from loop_watchdog import loop_watchdog
+from chat_sessions import chat_sessions
+from token_budget import token_budget
+from whatsapp_queue import whatsapp_queue, RetryableSendError
+from meta_graph import meta_graph, MetaError
+from model_router import ModelRouter, Route
+from structured_output import structured_output, strip_code_fences, StructuredOutputError
+import image_pipeline
+from batch_jobs import batch_jobs
+from rate_limiter import RateLimiter, backend_from_env
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled httpx client per upstream (Ollama, image fetch, Twilio, Meta)
+    # for the life of the process — avoids a fresh TCP/TLS handshake per call.
+    await http_pool.startup()
+    ollama_pool.start()
+    model_manager.start()
+    # Tokenizers load off the loop; token counts are estimated until they are ready.
+    tokenizers = asyncio.ensure_future(token_budget.load_all(sorted(ALLOWED_MODELS)))
+    rate_limiter.start()
+    batch_jobs.start_sweeper()
+    whatsapp_queue.start(_twilio_send)
+    loop_watchdog.start()
+    # Sync callers (query_groq, ollama_chat_sync) in worker threads run on this loop.
+    sync_bridge.attach(asyncio.get_running_loop())
+    # In multi-worker mode each worker publishes its stats for /stats?scope=cluster.
+    publisher = asyncio.ensure_future(shared_state.publish_forever(
+        {'stats': _local_stats, 'metrics': metrics.registry.snapshot})) if shared_state.MULTI_WORKER else None
+    try:
+        yield
+    finally:
+        tokenizers.cancel()
+        sync_bridge.detach()
+        if publisher is not None:
+            publisher.cancel()
+            shared_state.remove_snapshot(('stats', 'metrics'))
+        await rate_limiter.aclose()
+        await whatsapp_queue.aclose()
+        await meta_graph.aclose()
+        await loop_watchdog.aclose()
+        await model_manager.aclose()
+        await ollama_pool.aclose()
+        await batch_jobs.aclose()
+        await chat_sessions.aclose()
+        await http_pool.aclose()
+        response_cache.close()
+
 app = FastAPI(
     title="TriniBuild AI Server",
     description="AI-powered backend for TriniBuild using self-hosted Ollama",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan,
+    default_response_class=fast_json.JSONResponse,  # orjson-rendered with FAST_JSON=1
 )
 
 # Add CORS Middleware
@@ -34,20 +107,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ── Dependency-free per-IP sliding-window rate limiter ───────────────────────
+# ── Dependency-free per-IP rate limiter (GCRA, see rate_limiter.py) ──────────
 # Protects the expensive LLM/vision endpoints from cost-injection abuse.
-# Limits are per client IP, per rolling 60-second window.
+# Limits are per client IP: at most N per rolling 60-second window, with a burst
+# of ceil(N/2) and the rest refilled evenly — e.g. vision allows 6 back to back,
+# then one every ~8.6 s (the old per-IP deque allowed all N back to back).
 _RATE_LIMITS = {
-    "/analyze-product-image": 12,   # vision (most expensive) — 12/min/IP
+    "/analyze-product-image": 12,   # vision (most expensive) — 12/min/IP, burst 6
+    "/analyze-product-images:batch": 4,  # up to BATCH_MAX_IMAGES photos per call
     "/island-chat": 30,             # chatbot — 30/min/IP
     "/generate": 30,
     "/chatbot-reply": 30,
     "/generate-listing-description": 20,
+    "/generate-listing-descriptions:batch": 2,  # up to BATCH_MAX_LISTINGS items per call
     "/generate-job-letter": 20,
 }
 _RATE_WINDOW = 60  # seconds
-_rate_hits = defaultdict(deque)  # key: (ip, path) -> deque[timestamps]
-_rate_lock = threading.Lock()
+# O(1) state per (ip, path); RATE_LIMIT_BACKEND=shm shares it across workers.
+rate_limiter = RateLimiter(_RATE_LIMITS, _RATE_WINDOW, backend_from_env())
 
 def _client_ip(request: Request) -> str:
     # Honor X-Forwarded-For set by trusted proxy (Caddy). Caddy appends the
@@ -66,27 +143,60 @@ async def rate_limit_middleware(request: Request, call_next):
     limit = _RATE_LIMITS.get(path)
     if limit:
         ip = _client_ip(request)
-        key = (ip, path)
-        now = time.time()
-        with _rate_lock:
-            dq = _rate_hits[key]
-            while dq and dq[0] <= now - _RATE_WINDOW:
-                dq.popleft()
-            if len(dq) >= limit:
-                retry = int(_RATE_WINDOW - (now - dq[0])) + 1
-                logger.warning(f"Rate limit hit: {ip} {path} ({len(dq)}/{limit})")
-                return JSONResponse(
-                    status_code=429,
-                    content={"error": "Too many requests. Please slow down and try again shortly."},
-                    headers={"Retry-After": str(max(retry, 1))},
-                )
-            dq.append(now)
+        # In-process: synchronous on the loop thread. Shared memory: in a thread (flock).
+        allowed, retry = await rate_limiter.ahit((ip, path), limit)
+        if not allowed:
+            logger.warning(f"Rate limit hit: {ip} {path} (limit {limit}/{_RATE_WINDOW}s)")
+            return JSONResponse(
+                status_code=429,
+                content={"error": "Too many requests. Please slow down and try again shortly."},
+                headers={"Retry-After": str(max(int(retry) + 1, 1))},
+            )
     return await call_next(request)
 
-# Configuration — self-hosted Ollama (no API key needed, completely free)
-OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://deer-flow-ollama-1:11434')
+# ── Request metrics (see metrics.py) ─────────────────────────────────────────
+# Declared after the rate limiter so it wraps it and 429s are counted too.
+# Labelled by route template so /jobs/{job_id} polls share one series.
+_route_labels = {}
+
+def _route_label(request: Request) -> str:
+    path = request.url.path
+    label = _route_labels.get(path)
+    if label is None:
+        label = 'other'
+        for route in app.routes:
+            match, _ = route.matches(request.scope)
+            if match == Match.FULL:
+                label = route.path
+                break
+        if '{' not in label and len(_route_labels) < 1024:
+            _route_labels[path] = label  # only cache paths without per-request ids
+    return label
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    route = _route_label(request)
+    start = time.perf_counter()
+    status = 500
+    try:
+        async with metrics.HTTP_IN_FLIGHT.track(route):
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.HTTP_LATENCY.labels(route).observe(time.perf_counter() - start)
+        metrics.HTTP_REQUESTS.labels(route, str(status)).inc()
+
+# Configuration — self-hosted Ollama (no API key needed, completely free).
+# OLLAMA_URL, or OLLAMA_URLS for a pool of backends (see ollama_backends.py).
+scheduler.set_scale(len(ollama_pool))
 DEFAULT_MODEL = os.environ.get('DEFAULT_MODEL', 'qwen2.5:7b')
 VISION_MODEL = os.environ.get('VISION_MODEL', 'qwen3-vl:8b')
+# Sends easy chat requests (support FAQ, short island-chat messages) to SMALL_MODEL.
+model_router = ModelRouter.from_env(DEFAULT_MODEL)
+# Preloads DEFAULT/VISION (and SMALL only with MODEL_ROUTING=1) at startup and picks each model's
+# keep_alive — how long Ollama keeps it (and its prompt-prefix KV cache) loaded after a request.
+model_manager = ModelManager.from_env(DEFAULT_MODEL, VISION_MODEL, model_router)
 
 # Security: restrict which models a client may request via /generate.
 # Prevents model-name injection (e.g. billing/pricing abuse).
@@ -97,8 +207,11 @@ ALLOWED_MODELS = {
     'qwen3-vl:8b',
 }
 
-# Security: cap prompt length to bound cost and prevent prompt-stuffing abuse.
-MAX_PROMPT_CHARS = 4000
+# Security: cap user input (MAX_PROMPT_TOKENS, counted with the model's
+# tokenizer) to bound cost and prevent prompt-stuffing abuse.
+def _check_input(model: str, text: str):
+    if token_budget.too_long(model, text):
+        raise HTTPException(status_code=400, detail='Input too long')
 
 # --- Pydantic Models ---
 
@@ -109,6 +222,7 @@ class JobLetterRequest(BaseModel):
     skills: List[str] = []
     experience_years: int
     tone: str = "professional" # professional, enthusiastic, confident
+    no_cache: bool = False  # bypass the response cache and force a fresh generation
 
 class ListingDescriptionRequest(BaseModel):
     title: str
@@ -117,91 +231,416 @@ class ListingDescriptionRequest(BaseModel):
     condition: str
     price: Optional[float] = None
     tone: str = "persuasive"
+    no_cache: bool = False  # bypass the response cache and force a fresh generation
+
+class ListingDescriptionBatchRequest(BaseModel):
+    items: List[ListingDescriptionRequest] = Field(..., min_length=1)
+    concurrency: Optional[int] = None  # parallel workers, capped at BATCH_LISTING_CONCURRENCY
+    wait: bool = True  # False: return a job id immediately and poll for results
 
 class ChatbotRequest(BaseModel):
     message: str
     context: Optional[str] = None
     persona: str = "support_bot" # support_bot, sales_agent, business_expert
     system_prompt: Optional[str] = None
+    stream: bool = False  # opt-in NDJSON token stream
 
 class AIResponse(BaseModel):
     content: str
     model_used: str
     processing_time_ms: Optional[float] = None
+    timings_ms: Optional[dict] = None  # per-stage breakdown where available (vision)
+    image: Optional[dict] = None  # vision: original_bytes and whether the processed image was cached
+    session_id: Optional[str] = None  # /island-chat: send back with the next message
+    usage: Optional[dict] = None  # prompt_tokens, completion_tokens, total_tokens (as counted by Ollama)
 
 class GenerateRequest(BaseModel):
     prompt: str
     system_prompt: Optional[str] = None
     model: Optional[str] = None
     max_tokens: Optional[int] = 2000
+    stream: bool = False  # opt-in NDJSON token stream
 
 class AnalyzeImageRequest(BaseModel):
     image_url: str  # public URL of the uploaded product photo
     system_prompt: Optional[str] = None  # optional override of the default analysis prompt
     user_prompt: Optional[str] = None    # optional extra user instructions/hints
 
+class BatchAnalyzeImagesRequest(BaseModel):
+    image_urls: List[str] = Field(..., min_length=1)
+    system_prompt: Optional[str] = None
+    user_prompt: Optional[str] = None
+    stream: bool = False  # NDJSON results as they complete instead of a job id to poll
+
 class IslandChatRequest(BaseModel):
     message: str
+    # Returned by the previous reply; the server keeps the conversation, so
+    # `history` is only needed to seed a new or expired session.
+    session_id: Optional[str] = None
     history: Optional[List[dict]] = None  # [{role, content}, ...]
     mode: str = "support"  # support, onboarding, sales
+    stream: bool = False  # opt-in NDJSON token stream
 
 # --- Helper Functions ---
 
-async def ollama_chat(messages: list, model: str = None, temperature: float = 0.7, max_tokens: int = 1000) -> str:
-    """Call self-hosted Ollama — no API key needed, completely free"""
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        resp = await client.post(
-            f'{OLLAMA_URL}/api/chat',
-            json={
-                'model': model or DEFAULT_MODEL,
-                'messages': messages,
-                'stream': False,
-                'options': {
-                    'temperature': temperature,
-                    'num_predict': max_tokens,
-                }
-            }
-        )
+async def _ollama_post(upstream: str, payload: dict, affinity_key: str = None) -> dict:
+    """
+    POST a non-streaming /api/chat request and return Ollama's full JSON reply.
+    Records upstream latency, JSON decode time, token counts and tokens/sec.
+    """
+    async with metrics.track_upstream(upstream), ollama_pool.request(
+            payload['model'], 'POST', '/api/chat', affinity_key=affinity_key, json=payload) as resp:
         resp.raise_for_status()
-        return resp.json()['message']['content']
-
-async def ollama_vision(image_url: str, prompt: str, model: str = None) -> str:
-    """Call self-hosted Ollama vision model — qwen3-vl:8b"""
-    # Download the image and convert to base64
-    import base64
-    async with httpx.AsyncClient(timeout=60.0) as http:
-        img_resp = await http.get(image_url)
-        img_resp.raise_for_status()
-        img_b64 = base64.b64encode(img_resp.content).decode()
-
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        resp = await client.post(
-            f'{OLLAMA_URL}/api/chat',
-            json={
-                'model': model or VISION_MODEL,
-                'messages': [{
-                    'role': 'user',
-                    'content': prompt,
-                    'images': [img_b64]
-                }],
+    start = time.perf_counter()
+    data = fast_json.loads(resp.content)
+    metrics.JSON_DECODE.labels(upstream).observe(time.perf_counter() - start)
+    metrics.record_ollama(payload['model'], data)
+    model_manager.observe(payload['model'], data)
+    return data
+
+def _usage(data: dict, info: dict) -> dict:
+    """Token usage as reported by Ollama for one generation."""
+    prompt = data.get('prompt_eval_count') or 0
+    completion = data.get('eval_count') or 0
+    return {'prompt_tokens': prompt, 'completion_tokens': completion, 'total_tokens': prompt + completion,
+            'trimmed': info['trimmed']}
+
+async def ollama_chat(messages: list, model: str = None, temperature: float = 0.7, max_tokens: int = 1000,
+                      priority: int = INTERACTIVE, cache: bool = False, affinity_key: str = None,
+                      usage: dict = None) -> str:
+    """
+    Call self-hosted Ollama — no API key needed, completely free.
+    The prompt is fitted to the model's context window first (see token_budget.py).
+    With cache=True, identical (model, messages, options) are served from the response cache.
+    Identical concurrent calls are coalesced into one upstream request.
+    Calls sharing an affinity_key (e.g. a chat session) prefer the same backend.
+    If `usage` is given it is filled with prompt/completion token counts.
+    """
+    model = model or DEFAULT_MODEL
+    messages, options, info = token_budget.fit(model, messages, max_tokens)
+    options['temperature'] = temperature
+    key = cache_key(model, messages, options)
+    if cache:
+        cached = await response_cache.get(key)
+        if cached is not None:
+            if usage is not None:
+                usage.update(prompt_tokens=0, completion_tokens=0, total_tokens=0, trimmed=info['trimmed'],
+                             cached=True)
+            return cached
+
+    async def call():
+        async with scheduler.slot(model, priority):
+            data = await _ollama_post('ollama_chat', {
+                'model': model,
+                'messages': messages,
                 'stream': False,
-                'options': {'temperature': 0.3, 'num_predict': 800}
-            }
-        )
+                'options': options,
+                'keep_alive': model_manager.keep_alive(model),
+            }, affinity_key=affinity_key)
+        content = data['message']['content']
+        if cache and content:
+            await response_cache.put(key, content)
+        return content, _usage(data, info)
+
+    content, call_usage = await singleflight.do(f'chat:{key}', call)
+    if usage is not None:
+        usage.update(call_usage)
+    return content
+
+async def _ollama_stream(upstream: str, payload: dict, affinity_key: str = None, on_done=None):
+    """
+    POST a streaming /api/chat request and yield content deltas as tokens arrive.
+    `on_done(chunk)` is called with the final chunk, which carries counts and timings.
+    Closing the generator early closes the stream, and Ollama stops generating.
+    """
+    model = payload['model']
+    async with metrics.track_upstream(upstream), ollama_pool.request(
+            model, 'POST', '/api/chat', stream=True, affinity_key=affinity_key, json=payload) as resp:
         resp.raise_for_status()
-        return resp.json()['message']['content']
+        async for line in resp.aiter_lines():
+            if not line:
+                continue
+            chunk = fast_json.loads(line)
+            if chunk.get('error'):
+                raise RuntimeError(chunk['error'])
+            delta = (chunk.get('message') or {}).get('content')
+            if delta:
+                yield delta
+            if chunk.get('done'):
+                metrics.record_ollama(model, chunk)
+                model_manager.observe(model, chunk)
+                if on_done is not None:
+                    on_done(chunk)
+                break
+
+async def ollama_chat_stream(messages: list, model: str = None, temperature: float = 0.7, max_tokens: int = 1000,
+                             priority: int = INTERACTIVE, affinity_key: str = None, usage: dict = None):
+    """
+    Stream an Ollama chat completion — yields content deltas as tokens arrive.
+    If `usage` is given it is filled from the final chunk.
+    """
+    model = model or DEFAULT_MODEL
+    messages, options, info = token_budget.fit(model, messages, max_tokens)
+    options['temperature'] = temperature
+    on_done = (lambda chunk: usage.update(_usage(chunk, info))) if usage is not None else None
+    # The scheduler slot is held for the whole stream, not just until first byte.
+    async with scheduler.slot(model, priority):
+        async for delta in _ollama_stream('ollama_stream', {
+            'model': model,
+            'messages': messages,
+            'stream': True,
+            'keep_alive': model_manager.keep_alive(model),
+            'options': options,
+        }, affinity_key=affinity_key, on_done=on_done):
+            yield delta
+
+def route_chat(endpoint: str, kind: str, messages: list, custom_prompt: bool = False) -> Route:
+    """Pick the model for a chat request (see model_router.py); the last message is the user's."""
+    return model_router.route(endpoint, kind, token_budget.count(DEFAULT_MODEL, messages[-1]['content']),
+                              token_budget.count_messages(DEFAULT_MODEL, messages), custom_prompt)
+
+async def routed_chat(messages: list, route: Route, temperature: float = 0.7, max_tokens: int = 1000,
+                      affinity_key: str = None, usage: dict = None) -> tuple:
+    """
+    ollama_chat on the routed model; returns (content, model that answered).
+    A small-model reply that fails model_router.check() (or a small-model
+    error) is dropped and the request is answered by DEFAULT_MODEL.
+    """
+    start = time.perf_counter()
+    usage = {} if usage is None else usage
+    if route.small:
+        cap = min(max_tokens, model_router.small_max_tokens)
+        try:
+            content = await ollama_chat(messages, model=route.model, temperature=temperature, max_tokens=cap,
+                                        affinity_key=affinity_key, usage=usage)
+            reason = model_router.check(content, usage.get('completion_tokens') or 0, cap)
+        except Exception as e:
+            logger.warning(f"Small model {route.model} failed: {e}")
+            reason = 'error'
+        if reason is None:
+            model_router.observe(route.endpoint, route.model, time.perf_counter() - start, usage)
+            return content, route.model
+        model_router.escalate(route, reason, time.perf_counter() - start)
+    content = await ollama_chat(messages, model=DEFAULT_MODEL, temperature=temperature, max_tokens=max_tokens,
+                                affinity_key=affinity_key, usage=usage)
+    model_router.observe(route.endpoint, DEFAULT_MODEL, time.perf_counter() - start, usage)
+    return content, DEFAULT_MODEL
+
+async def routed_stream(messages: list, route: Route, temperature: float = 0.7, max_tokens: int = 1000,
+                        affinity_key: str = None, usage: dict = None, served: dict = None):
+    """
+    ollama_chat_stream on the routed model. A small-model reply is held back
+    until its first ROUTE_HOLD_CHARS characters (or the whole reply, if shorter)
+    pass model_router.check(); otherwise it is dropped unseen and DEFAULT_MODEL
+    streams the answer. `served['model']` is set to the model that answered.
+    """
+    start = time.perf_counter()
+    usage = {} if usage is None else usage
+    served = {} if served is None else served
+    if route.small:
+        cap = min(max_tokens, model_router.small_max_tokens)
+        stream = ollama_chat_stream(messages, model=route.model, temperature=temperature, max_tokens=cap,
+                                    affinity_key=affinity_key, usage=usage)
+        held, reason = [], None
+        try:
+            async for delta in stream:
+                if held is None:
+                    yield delta
+                    continue
+                held.append(delta)
+                text = ''.join(held)
+                if len(text) >= model_router.hold_chars:
+                    reason = model_router.check(text)
+                    if reason is not None:
+                        break
+                    held = None
+                    served['model'] = route.model
+                    yield text
+            if held is not None and reason is None:
+                text = ''.join(held)
+                reason = model_router.check(text, usage.get('completion_tokens') or 0, cap)
+                if reason is None:
+                    served['model'] = route.model
+                    yield text
+        except Exception as e:
+            if held is None:
+                raise  # part of the reply was sent; too late to switch models
+            logger.warning(f"Small model {route.model} failed: {e}")
+            reason = 'error'
+        finally:
+            await stream.aclose()
+        if reason is None:
+            model_router.observe(route.endpoint, route.model, time.perf_counter() - start, usage)
+            return
+        model_router.escalate(route, reason, time.perf_counter() - start)
+        usage.clear()
+    served['model'] = DEFAULT_MODEL
+    async for delta in ollama_chat_stream(messages, model=DEFAULT_MODEL, temperature=temperature,
+                                          max_tokens=max_tokens, affinity_key=affinity_key, usage=usage):
+        yield delta
+    model_router.observe(route.endpoint, DEFAULT_MODEL, time.perf_counter() - start, usage)
+
+async def ollama_structured(messages: list, schema, endpoint: str, model: str = None, temperature: float = 0.7,
+                            max_tokens: int = 1000, priority: int = INTERACTIVE, cache: bool = False):
+    """
+    Generate JSON matching `schema` (a JSON schema, or "json" for any object/array)
+    via Ollama's `format` option and return the parsed value. The reply is streamed
+    and cut off as soon as the value is complete; minor faults are repaired
+    locally and only unrepairable output is generated again (see structured_output.py).
+    Raises StructuredOutputError if no valid value was produced.
+    """
+    model = model or DEFAULT_MODEL
+    messages, options, _ = token_budget.fit(model, messages, max_tokens)
+    options['temperature'] = temperature
+    key = cache_key(model, messages, dict(options, format=schema))
+    if cache:
+        cached = await response_cache.get(key)
+        if cached is not None:
+            return json.loads(cached)
+
+    def produce():
+        return _ollama_stream('ollama_stream', {
+            'model': model,
+            'messages': messages,
+            'stream': True,
+            'format': schema,
+            'options': options,
+            'keep_alive': model_manager.keep_alive(model),
+        })
+
+    async def call():
+        async with scheduler.slot(model, priority):
+            value = await structured_output.generate(endpoint, schema, produce)
+        if cache:
+            await response_cache.put(key, json.dumps(value, ensure_ascii=False))
+        return value
+
+    return await singleflight.do(f'structured:{key}', call)
+
+def stream_reply(messages: list, model: str, temperature: float = 0.7, max_tokens: int = 1000,
+                 fallback: str = None, affinity_key: str = None, on_complete=None,
+                 done_extra: dict = None, route: Route = None) -> StreamingResponse:
+    """
+    Wrap ollama_chat_stream as an NDJSON response: one {"content": delta} line per
+    chunk, then a final {"done": true, ...} line carrying model_used,
+    ttft_ms (time to first token), processing_time_ms and usage (plus `done_extra`).
+    Upstream failures become an {"error": ...} line, or `fallback` text if nothing
+    was sent yet. `on_complete(text)` is awaited with the full reply of a stream
+    that finished without error. With a `route`, routed_stream picks the model.
+    """
+    if route is not None:
+        model = route.model
+    # Shed up front while we can still answer 503 — once streaming starts the
+    # status line has already been sent.
+    if scheduler.would_shed(model, INTERACTIVE):
+        raise QueueFull()
+
+    async def body():
+        start = time.perf_counter()
+        ttft_ms = None
+        parts = []
+        usage = {}
+        served = {'model': model}
+        if route is None:
+            deltas = ollama_chat_stream(messages, model=model, temperature=temperature, max_tokens=max_tokens,
+                                        affinity_key=affinity_key, usage=usage)
+        else:
+            deltas = routed_stream(messages, route, temperature=temperature, max_tokens=max_tokens,
+                                   affinity_key=affinity_key, usage=usage, served=served)
+        try:
+            async for delta in deltas:
+                if ttft_ms is None:
+                    ttft_ms = round((time.perf_counter() - start) * 1000, 1)
+                if on_complete is not None:
+                    parts.append(delta)
+                yield fast_json.dumps_line({"content": delta})
+            if on_complete is not None:
+                await on_complete(''.join(parts))
+        except Exception as e:
+            logger.error(f"Streaming generation error: {e}")
+            if fallback and ttft_ms is None:
+                yield fast_json.dumps_line({"content": fallback})
+            else:
+                yield fast_json.dumps_line({"error": "Generation failed. Please try again."})
+        yield fast_json.dumps_line({
+            "done": True,
+            "model_used": served['model'],
+            "ttft_ms": ttft_ms,
+            "processing_time_ms": round((time.perf_counter() - start) * 1000, 1),
+            "usage": usage or None,
+            **(done_extra or {}),
+        })
+
+    return StreamingResponse(body(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def ollama_vision(image_url: str, prompt: str, model: str = None, timings: dict = None,
+                        priority: int = INTERACTIVE, schema=None, image: dict = None):
+    """
+    Call self-hosted Ollama vision model — qwen3-vl:8b (identical concurrent calls share one inference).
+    If `timings` is given it is filled with per-stage milliseconds (fetch, decode, resize, encode, infer),
+    and `image` with the original size and preprocessing cache hit (see image_pipeline.prepare_image).
+    With a `schema` (see ollama_structured) the parsed JSON value is returned instead of text.
+    """
+    model = model or VISION_MODEL
+    key = cache_key(model, [{'role': 'user', 'content': prompt}], {'image_url': image_url, 'format': schema})
+    content, stage_timings, details = await singleflight.do(
+        f'vision:{key}', lambda: _ollama_vision_call(image_url, prompt, model, priority, schema))
+    if timings is not None:
+        timings.update(stage_timings)
+    if image is not None:
+        image.update(details)
+    return content
+
+async def _ollama_vision_call(image_url: str, prompt: str, model: str, priority: int, schema=None):
+    # Download with a byte cap, downsize and re-encode off the event loop.
+    timings, details = {}, {}
+    img_b64 = await image_pipeline.prepare_image(image_url, timings, details)
+    payload = {
+        'model': model,
+        'messages': [{
+            'role': 'user',
+            'content': prompt,
+            'images': [img_b64]
+        }],
+        'stream': False,
+        'options': {'temperature': 0.3, 'num_predict': 800, 'num_ctx': token_budget.context_window(model)},
+        'keep_alive': model_manager.keep_alive(model),
+    }
+
+    start = time.perf_counter()
+    async with scheduler.slot(model, priority):
+        if schema is None:
+            content = (await _ollama_post('ollama_vision', payload))['message']['content']
+        else:
+            payload.update(stream=True, format=schema)
+            content = await structured_output.generate(
+                'vision', schema, lambda: _ollama_stream('ollama_vision', payload))
+    timings['infer_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return content, timings, details
+
+# ── Sync facade (scripts, cron jobs, worker threads) ─────────────────────────
+# Same code path as the async API, run on a shared loop (see sync_bridge.py).
+# Never call these from async code — await the async functions instead.
+
+def ollama_chat_sync(messages: list, timeout: float = None, **kwargs) -> str:
+    """Blocking ollama_chat."""
+    return sync_bridge.run(ollama_chat, messages, timeout=timeout, **kwargs)
+
+def ollama_vision_sync(image_url: str, prompt: str, timeout: float = None, **kwargs) -> str:
+    """Blocking ollama_vision."""
+    return sync_bridge.run(ollama_vision, image_url, prompt, timeout=timeout, **kwargs)
 
 def query_groq(prompt: str, system_prompt: str = "", model: str = None, max_tokens: int = 2000) -> str:
     """
-    Backward-compat wrapper — now calls Ollama instead of Groq.
+    Backward-compat wrapper — now calls Ollama instead of Groq (blocking; see ollama_chat_sync).
     """
-    import asyncio
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
     messages.append({"role": "user", "content": prompt})
     try:
-        return asyncio.run(ollama_chat(messages, model=model, max_tokens=max_tokens))
+        return ollama_chat_sync(messages, model=model, max_tokens=max_tokens)
     except Exception as e:
         logger.error(f"Ollama API error: {e}")
         return "I apologize, but I'm currently having trouble connecting to my brain. Please try again in a moment."
@@ -212,6 +651,127 @@ def query_groq(prompt: str, system_prompt: str = "", model: str = None, max_toke
 async def health_check():
     return {"status": "ok", "service": "TriniBuild AI Server (Ollama Self-Hosted)"}
 
+def _local_stats() -> dict:
+    return {
+        "http_pool": http_pool.stats(),
+        "scheduler": scheduler.stats(),
+        "response_cache": response_cache.stats(),
+        "singleflight": singleflight.stats(),
+        "ollama_backends": ollama_pool.stats(),
+        "event_loop": loop_watchdog.stats(),
+        "chat_sessions": chat_sessions.stats(),
+        "token_budget": token_budget.stats(),
+        "whatsapp_queue": whatsapp_queue.stats(),
+        "meta_graph": meta_graph.stats(),
+        "fast_json": fast_json.stats(),
+        "model_router": model_router.stats(),
+        "structured_output": structured_output.stats(),
+        "models": model_manager.stats(),
+        "image_pipeline": image_pipeline.stats(),
+        "batch_jobs": batch_jobs.stats(),
+        "rate_limiter": rate_limiter.stats(),
+    }
+
+@app.get("/stats")
+async def server_stats(scope: str = "worker"):
+    """
+    Operational stats for monitoring (connection pools, Ollama queue, response cache, coalescing).
+    scope=cluster returns every worker's last snapshot plus an aggregate.
+    """
+    local = _local_stats()
+    if scope != "cluster":
+        return {"worker": os.getpid(), "workers_configured": shared_state.WORKERS, **local}
+    snapshots = await asyncio.to_thread(shared_state.read_snapshots)
+    snapshots[str(os.getpid())] = local  # always include a fresh view of this worker
+    return {
+        "workers_configured": shared_state.WORKERS,
+        "workers_reporting": len(snapshots),
+        "aggregate": shared_state.aggregate(list(snapshots.values())),
+        "workers": snapshots,
+    }
+
+# Subsystems that keep their own counters are exported at scrape time.
+@metrics.registry.collector
+def _subsystem_metrics():
+    yield ('trinibuild_rate_limit_rejections_total', 'counter', 'Requests rejected by the per-IP rate limiter.',
+           ('route',), {(path,): n for path, n in rate_limiter.rejections.items()})
+    cache = response_cache.stats()
+    yield ('trinibuild_response_cache_lookups_total', 'counter', 'Response cache lookups, by result.', ('result',),
+           {('hit_memory',): cache['hits']['memory'], ('hit_disk',): cache['hits']['disk'],
+            ('miss',): cache['misses'], ('bypass',): cache['bypassed']})
+    flights = singleflight.stats()
+    yield ('trinibuild_singleflight_coalesced_total', 'counter', 'Upstream calls saved by coalescing identical requests.',
+           (), {(): flights['coalesced']})
+    lanes = scheduler.stats()
+    yield ('trinibuild_ollama_active', 'gauge', 'Ollama generations holding a scheduler slot.', ('model',),
+           {(model,): lane['active'] for model, lane in lanes.items()})
+    yield ('trinibuild_ollama_queued', 'gauge', 'Requests waiting for a scheduler slot.', ('model',),
+           {(model,): lane['queued'] for model, lane in lanes.items()})
+    yield ('trinibuild_ollama_shed_total', 'counter', 'Requests shed with 503 by the scheduler.', ('model', 'priority'),
+           {(model, p): n for model, lane in lanes.items() for p, n in lane['shed'].items()})
+    backends = ollama_pool.backends
+    yield ('trinibuild_ollama_backend_up', 'gauge', 'Backend passes health probes and its circuit is not open.',
+           ('backend',), {(b.url,): int(b.healthy and b.state != b.OPEN) for b in backends})
+    yield ('trinibuild_ollama_backend_outstanding', 'gauge', 'Requests in flight per Ollama backend.',
+           ('backend',), {(b.url,): b.outstanding for b in backends})
+    yield ('trinibuild_ollama_backend_errors_total', 'counter', 'Failed requests per Ollama backend.',
+           ('backend',), {(b.url,): b.errors for b in backends})
+    yield ('trinibuild_ollama_model_resident', 'gauge', 'Model loaded in memory on a backend (per /api/ps).',
+           ('model', 'backend'), {(m, b.url): 1 for b in backends for m in b.loaded})
+    yield ('trinibuild_ollama_retries_total', 'counter', 'Requests retried on another Ollama backend.',
+           (), {(): ollama_pool.retried})
+    sessions = chat_sessions.stats()
+    yield ('trinibuild_chat_sessions_total', 'counter', 'Island-chat session lookups, by result.', ('result',),
+           {('created',): sessions['created'], ('resumed',): sessions['resumed'], ('expired',): sessions['expired']})
+    yield ('trinibuild_chat_session_folds_total', 'counter', 'Older turns folded into a session summary.',
+           ('result',), {('ok',): sessions['folds'], ('failed',): sessions['fold_failures']})
+    outbox = whatsapp_queue.stats()
+    yield ('trinibuild_whatsapp_jobs', 'gauge', 'WhatsApp queue jobs by status (refreshed every 5s).', ('status',),
+           {(status,): n for status, n in outbox['queue'].items()})
+    yield ('trinibuild_whatsapp_sends_total', 'counter', 'WhatsApp send attempts, by outcome.', ('result',),
+           {('sent',): outbox['sent'], ('failed',): outbox['failed'], ('retried',): outbox['retried'],
+            ('deferred',): outbox['deferred']})
+    graph = meta_graph.stats()
+    yield ('trinibuild_meta_cache_total', 'counter', 'Meta Graph reads by cache outcome.', ('result',),
+           {('hit',): graph['hits'], ('stale',): graph['stale_hits'], ('miss',): graph['misses']})
+    yield ('trinibuild_meta_throttled_total', 'counter', 'Meta Graph calls held back by usage-header backoff.', (),
+           {(): graph['throttled']})
+    yield ('trinibuild_model_routes_total', 'counter', 'Chat requests by routed model and reason (easy = small model).',
+           ('endpoint', 'model', 'reason'), dict(model_router.decisions))
+    yield ('trinibuild_model_escalations_total', 'counter', 'Small-model replies dropped for DEFAULT_MODEL, by reason.',
+           ('endpoint', 'reason'), {key: e['count'] for key, e in model_router.escalations.items()})
+    yield ('trinibuild_model_escalation_seconds_total', 'counter', 'Time spent on small-model replies that were dropped.',
+           ('endpoint', 'reason'), {key: e['seconds'] for key, e in model_router.escalations.items()})
+    structured = structured_output.stats()['endpoints']
+    yield ('trinibuild_structured_output_total', 'counter',
+           'Structured (JSON) generations by outcome: valid, repaired locally, or invalid.', ('endpoint', 'result'),
+           {(name, result): c[result] for name, c in structured.items() for result in ('valid', 'repaired', 'invalid')})
+    yield ('trinibuild_structured_retries_total', 'counter', 'Generations re-run because the output was malformed.',
+           ('endpoint',), {(name,): c['retried'] for name, c in structured.items()})
+    yield ('trinibuild_structured_failures_total', 'counter', 'Structured generations still malformed after retries.',
+           ('endpoint',), {(name,): c['failed'] for name, c in structured.items()})
+    yield ('trinibuild_structured_early_stops_total', 'counter',
+           'Streams closed as soon as the JSON value was complete (stopped) or broken (aborted).', ('endpoint', 'reason'),
+           {(name, reason): c[key] for name, c in structured.items()
+            for reason, key in (('complete', 'early_stops'), ('broken', 'aborted'))})
+    yield ('trinibuild_prompts_trimmed_total', 'counter', 'Prompts cut to fit the model context window.',
+           (), {(): token_budget.trimmed})
+    yield ('trinibuild_event_loop_stalls_total', 'counter', 'Times the event loop was blocked past LOOP_STALL_MS.',
+           (), {(): loop_watchdog.stalls})
+    pools = http_pool.stats()
+    yield ('trinibuild_http_pool_connections', 'gauge', 'Upstream pool connections, by state.', ('pool', 'state'),
+           {(name, state): pool[state] for name, pool in pools.items() for state in ('idle', 'active', 'waiting')})
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text exposition; combined across workers in multi-worker mode (see metrics.merge)."""
+    snapshot = metrics.registry.snapshot()
+    if shared_state.MULTI_WORKER:
+        others = await asyncio.to_thread(shared_state.read_snapshots, None, 'metrics')
+        others[str(os.getpid())] = snapshot  # use the fresh local view instead
+        snapshot = metrics.merge(others)
+    return Response(metrics.render(snapshot), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.post("/generate-job-letter", response_model=AIResponse)
 async def generate_job_letter(request: JobLetterRequest):
     system_prompt = (
@@ -227,41 +787,94 @@ async def generate_job_letter(request: JobLetterRequest):
         f"Key skills: {', '.join(request.skills)}."
     )
 
+    if request.no_cache:
+        response_cache.note_bypass()
+    usage = {}
     generated_text = await ollama_chat([
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": prompt}
-    ], model=DEFAULT_MODEL)
+    ], model=DEFAULT_MODEL, priority=BATCH, cache=not request.no_cache, usage=usage)
     
-    return AIResponse(content=generated_text, model_used=DEFAULT_MODEL)
+    return fast_json.respond(AIResponse, content=generated_text, model_used=DEFAULT_MODEL, usage=usage)
 
-@app.post("/generate-listing-description", response_model=AIResponse)
-async def generate_listing_description(request: ListingDescriptionRequest):
-    system_prompt = (
-        "You are an expert copywriter for an online marketplace in Trinidad & Tobago. "
-        "Write a compelling product description that highlights features and benefits."
-    )
-    
+# Kept byte-identical across calls so Ollama can reuse the evaluated prompt prefix.
+LISTING_SYSTEM_PROMPT = (
+    "You are an expert copywriter for an online marketplace in Trinidad & Tobago. "
+    "Write a compelling product description that highlights features and benefits."
+)
+
+# Bulk listing generation limits — a store import can be 100 products.
+BATCH_MAX_LISTINGS = int(os.environ.get('BATCH_MAX_LISTINGS', '100'))
+BATCH_LISTING_CONCURRENCY = int(os.environ.get('BATCH_LISTING_CONCURRENCY', '4'))
+
+def _listing_messages(request: ListingDescriptionRequest) -> list:
     prompt = (
         f"Write a {request.tone} description for a {request.title} ({request.category}). "
         f"Condition: {request.condition}. "
         f"Key features: {', '.join(request.features)}. "
         f"{f'Price: TT${request.price}' if request.price else ''}"
     )
-
-    generated_text = await ollama_chat([
-        {"role": "system", "content": system_prompt},
+    return [
+        {"role": "system", "content": LISTING_SYSTEM_PROMPT},
         {"role": "user", "content": prompt}
-    ], model=DEFAULT_MODEL)
+    ]
+
+@app.post("/generate-listing-description", response_model=AIResponse)
+async def generate_listing_description(request: ListingDescriptionRequest):
+    if request.no_cache:
+        response_cache.note_bypass()
+    usage = {}
+    generated_text = await ollama_chat(_listing_messages(request), model=DEFAULT_MODEL, priority=BATCH,
+                                       cache=not request.no_cache, usage=usage)
     
-    return AIResponse(content=generated_text, model_used=DEFAULT_MODEL)
+    return fast_json.respond(AIResponse, content=generated_text, model_used=DEFAULT_MODEL, usage=usage)
+
+@app.post("/generate-listing-descriptions:batch")
+async def generate_listing_descriptions_batch(request: ListingDescriptionBatchRequest):
+    """
+    Bulk listing copy for store imports. Items run through a worker pool at batch
+    priority; every item shares LISTING_SYSTEM_PROMPT as its first message and the
+    model is kept resident (keep_alive), so Ollama re-uses the cached prompt prefix
+    instead of re-evaluating it per product. Returns per-item and aggregate latency.
+    """
+    if len(request.items) > BATCH_MAX_LISTINGS:
+        raise HTTPException(status_code=400, detail=f'At most {BATCH_MAX_LISTINGS} items per batch')
+    concurrency = min(request.concurrency or BATCH_LISTING_CONCURRENCY, BATCH_LISTING_CONCURRENCY)
+
+    async def worker(item: ListingDescriptionRequest) -> dict:
+        if item.no_cache:
+            response_cache.note_bypass()
+        usage = {}
+        content = await ollama_chat(_listing_messages(item), model=DEFAULT_MODEL, priority=BATCH,
+                                    cache=not item.no_cache, usage=usage)
+        return {'title': item.title, 'content': content, 'model_used': DEFAULT_MODEL, 'usage': usage}
+
+    job = batch_jobs.start('generate-listing-descriptions', request.items, worker, concurrency)
+    if not request.wait:
+        return JSONResponse(status_code=202, content={
+            'job_id': job.id,
+            'total': len(request.items),
+            'status_url': f'/generate-listing-descriptions/jobs/{job.id}',
+        })
+    # Shielded so a client timeout leaves the job running; results stay pollable.
+    await asyncio.shield(job.task)
+    return job.to_dict()
+
+@app.get("/generate-listing-descriptions/jobs/{job_id}")
+async def generate_listing_descriptions_job(job_id: str):
+    """Poll a bulk listing job: progress, latency figures and per-item results so far."""
+    job = batch_jobs.get(job_id)
+    if job is None or job.kind != 'generate-listing-descriptions':
+        raise HTTPException(status_code=404, detail='Job not found or expired')
+    return job.to_dict()
 
 @app.post("/chatbot-reply", response_model=AIResponse)
 async def chatbot_reply(request: ChatbotRequest):
     # Security: input length cap — bound cost and prevent prompt stuffing.
-    if len(request.message or '') > MAX_PROMPT_CHARS:
-        raise HTTPException(status_code=400, detail='Input too long')
+    _check_input(DEFAULT_MODEL, request.message)
     system_prompt = request.system_prompt
-    
+    custom_prompt = bool(system_prompt)
+
     if not system_prompt:
         if request.persona == "sales_agent":
             system_prompt = "You are a persuasive sales agent helping a customer find the best deals on TriniBuild."
@@ -295,9 +908,13 @@ async def chatbot_reply(request: ChatbotRequest):
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": full_prompt},
     ]
-    generated_text = await ollama_chat(messages, model=DEFAULT_MODEL)
-    
-    return AIResponse(content=generated_text, model_used=DEFAULT_MODEL)
+    route = route_chat('chatbot', request.persona, messages, custom_prompt)
+    if request.stream:
+        return stream_reply(messages, DEFAULT_MODEL, route=route)
+    usage = {}
+    generated_text, model_used = await routed_chat(messages, route, usage=usage)
+
+    return fast_json.respond(AIResponse, content=generated_text, model_used=model_used, usage=usage)
 
 @app.post("/generate")
 async def generate_text(request: GenerateRequest):
@@ -306,18 +923,21 @@ async def generate_text(request: GenerateRequest):
         if request.model and request.model not in ALLOWED_MODELS:
             raise HTTPException(status_code=400, detail='Model not allowed')
         # Security: input length cap — bound cost and prevent prompt stuffing.
-        if len(request.prompt or '') > MAX_PROMPT_CHARS:
-            raise HTTPException(status_code=400, detail='Input too long')
+        _check_input(request.model or DEFAULT_MODEL, request.prompt)
         messages = []
         if request.system_prompt:
             messages.append({"role": "system", "content": request.system_prompt})
         messages.append({"role": "user", "content": request.prompt})
+        if request.stream:
+            return stream_reply(messages, request.model or DEFAULT_MODEL, max_tokens=request.max_tokens or 2000)
+        usage = {}
         response = await ollama_chat(
             messages,
             model=request.model or DEFAULT_MODEL,
-            max_tokens=request.max_tokens or 2000
+            max_tokens=request.max_tokens or 2000,
+            usage=usage,
         )
-        return {"content": response, "model_used": request.model or DEFAULT_MODEL}
+        return {"content": response, "model_used": request.model or DEFAULT_MODEL, "usage": usage}
     except HTTPException:
         raise
     except Exception as e:
@@ -349,96 +969,307 @@ ISLAND_BOT_MODES = {
     "sales": "The user is deciding whether to use TriniBuild. Be honest and helpful, highlight free COD selling and the founding-merchant offer, and invite them to start free. Do not pressure or exaggerate.",
 }
 
+async def _summarize_island_chat(summary: str, turns: list) -> str:
+    """Fold older island-chat turns into the running summary (background, batch priority)."""
+    transcript = "\n".join(f"{role}: {content}" for role, content in turns)
+    prompt = (
+        (f"Summary so far:\n{summary}\n\n" if summary else "")
+        + f"New conversation turns:\n{transcript}\n\n"
+        "Update the summary in at most 5 short sentences. Keep names, products, prices, "
+        "orders and anything the user asked for; drop small talk."
+    )
+    return await ollama_chat([
+        {"role": "system", "content": "You summarise customer support conversations for an assistant's memory."},
+        {"role": "user", "content": prompt},
+    ], model=DEFAULT_MODEL, temperature=0.2, max_tokens=200, priority=BATCH)
+
+ISLAND_CHAT_FALLBACK = "Aye, sorry — meh brain hiccup just now. Try me again in a moment, or reach support@trinibuild.com."
+
+# Default product-analysis prompt; client may override via system_prompt/user_prompt.
+PRODUCT_ANALYSIS_PROMPT = (
+    "You are a product listing assistant for a Trinidad & Tobago online store. "
+    "Look at this product photo and return ONLY valid JSON (no markdown, no backticks) with keys: "
+    '{"name": "concise product name max 80 chars", "price": number in TTD (your best estimate), '
+    '"category": "one short category", "description": "2-3 short persuasive sentences for T&T shoppers", '
+    '"tags": ["tag1","tag2","tag3","tag4","tag5"]}'
+)
+
+# Passed to Ollama as `format` when the default prompt is used; a client-supplied
+# system_prompt brings its own keys, so only "some JSON object" is enforced then.
+PRODUCT_LISTING_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'name': {'type': 'string'},
+        'price': {'type': 'number'},
+        'category': {'type': 'string'},
+        'description': {'type': 'string'},
+        'tags': {'type': 'array', 'items': {'type': 'string'}},
+    },
+    'required': ['name', 'price', 'category', 'description', 'tags'],
+}
+
+# Batch analysis limits — bulk catalog onboarding sends 10-50 photos at once.
+BATCH_MAX_IMAGES = int(os.environ.get('BATCH_MAX_IMAGES', '50'))
+BATCH_VISION_CONCURRENCY = int(os.environ.get('BATCH_VISION_CONCURRENCY', '4'))
+
+def _analysis_instruction(system_prompt: Optional[str], user_prompt: Optional[str]) -> str:
+    # If the client supplies its own system_prompt, use it (keeps the eBay-class
+    # optimizer's richer schema available); otherwise use the default above.
+    instruction_text = system_prompt if system_prompt else PRODUCT_ANALYSIS_PROMPT
+    # Append any extra user hints (store name, category, merchant notes).
+    if user_prompt:
+        instruction_text = f"{instruction_text}\n\n{user_prompt}"
+    return instruction_text
+
+def _analysis_schema(system_prompt: Optional[str]):
+    return 'json' if system_prompt else PRODUCT_LISTING_SCHEMA
+
+async def _analyze_image(image_url: str, instruction_text: str, priority: int = INTERACTIVE,
+                         schema=PRODUCT_LISTING_SCHEMA) -> AIResponse:
+    start = time.perf_counter()
+    timings, image = {}, {}
+    try:
+        listing = await ollama_vision(image_url, instruction_text, timings=timings, priority=priority, schema=schema,
+                                      image=image)
+        content = json.dumps(listing, ensure_ascii=False)
+    except StructuredOutputError as e:
+        # Retries are spent — pass the raw reply on rather than failing the request.
+        content = strip_code_fences(e.text)
+    return AIResponse(
+        content=content,
+        model_used=VISION_MODEL,
+        processing_time_ms=round((time.perf_counter() - start) * 1000, 1),
+        timings_ms=timings,
+        image=image or None,
+    )
+
 @app.post("/analyze-product-image", response_model=AIResponse)
 async def analyze_product_image(request: AnalyzeImageRequest):
     """Vision: turn a product photo into a ready-to-publish listing (name, price TTD, category, description, tags)."""
     try:
-        # Default product-analysis prompt; client may override via system_prompt/user_prompt.
-        default_instruction = (
-            "You are a product listing assistant for a Trinidad & Tobago online store. "
-            "Look at this product photo and return ONLY valid JSON (no markdown, no backticks) with keys: "
-            '{"name": "concise product name max 80 chars", "price": number in TTD (your best estimate), '
-            '"category": "one short category", "description": "2-3 short persuasive sentences for T&T shoppers", '
-            '"tags": ["tag1","tag2","tag3","tag4","tag5"]}'
-        )
-
-        # If the client supplies its own system_prompt, use it (keeps the eBay-class
-        # optimizer's richer schema available); otherwise use the default above.
-        instruction_text = request.system_prompt if request.system_prompt else default_instruction
-        # Append any extra user hints (store name, category, merchant notes).
-        if request.user_prompt:
-            instruction_text = f"{instruction_text}\n\n{request.user_prompt}"
-
-        content = await ollama_vision(request.image_url, instruction_text)
-        # Strip markdown code fences if model wraps output (e.g. ```json ... ```)
-        stripped = content.strip()
-        if stripped.startswith('```'):
-            lines = stripped.split('\n')
-            # Remove first line (```json or ```) and last line (```)
-            inner = lines[1:] if len(lines) > 1 else lines
-            if inner and inner[-1].strip() == '```':
-                inner = inner[:-1]
-            content = '\n'.join(inner).strip()
-        return AIResponse(content=content, model_used=VISION_MODEL)
+        instruction_text = _analysis_instruction(request.system_prompt, request.user_prompt)
+        return await _analyze_image(request.image_url, instruction_text,
+                                    schema=_analysis_schema(request.system_prompt))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Vision analyze error: {e}")
         raise HTTPException(status_code=502, detail="Image analysis is temporarily unavailable. Please try again.")
 
+@app.post("/analyze-product-images:batch")
+async def analyze_product_images_batch(request: BatchAnalyzeImagesRequest):
+    """
+    Vision in bulk: analyze many product photos in one call. Images are fetched and
+    preprocessed concurrently; vision inference runs at batch priority with bounded
+    parallelism. Returns a job id to poll, or with stream=true an NDJSON line per
+    image as it completes followed by a summary line.
+    """
+    if len(request.image_urls) > BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f'At most {BATCH_MAX_IMAGES} images per batch')
+    instruction_text = _analysis_instruction(request.system_prompt, request.user_prompt)
+    schema = _analysis_schema(request.system_prompt)
+
+    async def worker(image_url: str) -> dict:
+        try:
+            result = await _analyze_image(image_url, instruction_text, priority=BATCH, schema=schema)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Batch vision analyze error for {image_url}: {e}")
+            raise RuntimeError("Image analysis failed")
+        return {'image_url': image_url, **result.model_dump()}
+
+    job = batch_jobs.start('analyze-product-images', request.image_urls, worker, BATCH_VISION_CONCURRENCY)
+    if not request.stream:
+        return JSONResponse(status_code=202, content={
+            'job_id': job.id,
+            'total': len(request.image_urls),
+            'status_url': f'/analyze-product-images/jobs/{job.id}',
+        })
+
+    async def body():
+        queue = job.subscribe()
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield fast_json.dumps_line(event)
+            yield fast_json.dumps_line({"done": True, **job.summary()})
+        finally:
+            job.unsubscribe(queue)
+
+    return StreamingResponse(body(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Job-Id": job.id})
+
+@app.get("/analyze-product-images/jobs/{job_id}")
+async def analyze_product_images_job(job_id: str):
+    """Poll a batch analysis job: progress, throughput and per-image results so far."""
+    job = batch_jobs.get(job_id)
+    if job is None or job.kind != 'analyze-product-images':
+        raise HTTPException(status_code=404, detail='Job not found or expired')
+    return job.to_dict()
+
 @app.post("/island-chat", response_model=AIResponse)
 async def island_chat(request: IslandChatRequest):
-    """The Trini-accent island chatbot for customer support and onboarding."""
+    """
+    The Trini-accent island chatbot for customer support and onboarding.
+    Send back the returned session_id with the next message instead of the
+    history; an unknown or expired session_id without history is answered with
+    409, and the client resends with its history to start a new session.
+    """
     try:
-        mode_note = ISLAND_BOT_MODES.get(request.mode, ISLAND_BOT_MODES["support"])
-        messages = [{"role": "system", "content": ISLAND_BOT_PERSONA + "\n\n" + mode_note}]
-        if request.history:
-            # keep last 8 turns to bound tokens
-            for turn in request.history[-8:]:
-                role = turn.get("role")
-                content = turn.get("content")
-                if role in ("user", "assistant") and content:
-                    messages.append({"role": role, "content": content})
+        _check_input(DEFAULT_MODEL, request.message)
+        mode = request.mode if request.mode in ISLAND_BOT_MODES else "support"
+        session = await chat_sessions.get(request.session_id) if request.session_id else None
+        if session is None and request.session_id and not request.history:
+            raise HTTPException(status_code=409, detail="Session expired; resend with history")
+        if session is None:
+            session = chat_sessions.new(mode)
+            if request.history:
+                # Seed from client-side history (first message after an expiry):
+                # the newest turns that fit half the session's token budget, so
+                # the first exchange does not immediately trigger a fold.
+                seed, tokens = [], 0
+                for turn in reversed(request.history):
+                    role = turn.get("role")
+                    content = turn.get("content")
+                    if role not in ("user", "assistant") or not content:
+                        continue
+                    tokens += token_budget.count(DEFAULT_MODEL, str(content))
+                    if tokens > chat_sessions.token_budget // 2:
+                        break
+                    seed.append((role, str(content)))
+                for role, content in reversed(seed):
+                    session.add(role, content)
+        session.mode = mode
+        # Persona, summary and earlier turns are an unchanged prefix of the last
+        # prompt, so Ollama only evaluates the new message.
+        messages = session.messages(ISLAND_BOT_PERSONA + "\n\n" + ISLAND_BOT_MODES[mode])
         messages.append({"role": "user", "content": request.message})
 
-        content = await ollama_chat(messages, model=DEFAULT_MODEL, temperature=0.8, max_tokens=600)
-        return AIResponse(content=content, model_used=DEFAULT_MODEL)
+        async def record(reply: str):
+            await chat_sessions.record_turn(session, request.message, reply, _summarize_island_chat)
+
+        route = route_chat('island_chat', mode, messages)
+        if request.stream:
+            return stream_reply(messages, DEFAULT_MODEL, temperature=0.8, max_tokens=600,
+                                fallback=ISLAND_CHAT_FALLBACK, affinity_key=session.id,
+                                on_complete=record, done_extra={"session_id": session.id}, route=route)
+        usage = {}
+        content, model_used = await routed_chat(messages, route, temperature=0.8, max_tokens=600,
+                                                affinity_key=session.id, usage=usage)
+        await record(content)
+        return fast_json.respond(AIResponse, content=content, model_used=model_used, session_id=session.id,
+                                 usage=usage)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Island chat error: {e}")
-        return AIResponse(
-            content="Aye, sorry — meh brain hiccup just now. Try me again in a moment, or reach support@trinibuild.com.",
-            model_used=DEFAULT_MODEL,
-        )
+        return fast_json.respond(AIResponse, content=ISLAND_CHAT_FALLBACK, model_used=DEFAULT_MODEL)
 
 class WhatsAppMessage(BaseModel):
     to: str  # phone number with country code, no +
     message: str
     order_id: Optional[str] = None
+    idempotency_key: Optional[str] = None  # e.g. the caller's queue row id; retries reuse the job
 
-@app.post('/send-whatsapp')
-async def send_whatsapp(req: WhatsAppMessage):
-    # Use Twilio REST API server-side (keys are in ai_server/.env)
-    account_sid = os.environ.get('TWILIO_ACCOUNT_SID')
-    auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
-    from_number = os.environ.get('TWILIO_WHATSAPP_NUMBER', 'whatsapp:+14155238886')
+# Overridable so load tests can point at bench/mock_ollama.py.
+TWILIO_API_BASE = os.environ.get('TWILIO_API_BASE', 'https://api.twilio.com')
 
-    if not account_sid or not auth_token:
-        return {'success': False, 'error': 'Twilio not configured'}
+def _twilio_credentials():
+    # Twilio keys are server-side only (ai_server/.env)
+    return os.environ.get('TWILIO_ACCOUNT_SID'), os.environ.get('TWILIO_AUTH_TOKEN')
 
-    url = f'https://api.twilio.com/2010-04-01/Accounts/{account_sid}/Messages.json'
+async def _twilio_send(to: str, body: str) -> str:
+    """Send one WhatsApp message via the Twilio REST API; returns its sid (used by whatsapp_queue)."""
+    account_sid, auth_token = _twilio_credentials()
+    if not account_sid or not auth_token:
+        raise RuntimeError('Twilio not configured')
+    url = f'{TWILIO_API_BASE}/2010-04-01/Accounts/{account_sid}/Messages.json'
     data = {
-        'From': from_number,
-        'To': f'whatsapp:{req.to}',
-        'Body': req.message
+        'From': os.environ.get('TWILIO_WHATSAPP_NUMBER', 'whatsapp:+14155238886'),
+        'To': f'whatsapp:{to}',
+        'Body': body
     }
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(url, data=data, auth=(account_sid, auth_token))
+    async with metrics.track_upstream('twilio'):
+        resp = await http_pool.client('twilio').post(url, data=data, auth=(account_sid, auth_token))
+    if resp.status_code >= 400:
+        metrics.UPSTREAM_ERRORS.labels('twilio').inc()
+    if resp.status_code == 429 or resp.status_code >= 500:
+        retry_after = resp.headers.get('retry-after')
+        raise RetryableSendError(f'Twilio HTTP {resp.status_code}',
+                                 float(retry_after) if retry_after and retry_after.isdigit() else None)
+    if resp.status_code >= 400:
+        raise RuntimeError(f'Twilio HTTP {resp.status_code}: {resp.text[:300]}')
+    return resp.json().get('sid')
 
-    if resp.status_code == 201:
-        return {'success': True, 'sid': resp.json().get('sid')}
-    else:
-        return {'success': False, 'error': resp.text}
+def _whatsapp_job(job: dict) -> dict:
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'order_id': job['order_id'],
+        'attempts': job['attempts'],
+        'sid': job['sid'],
+        'error': job['last_error'],
+    }
+
+@app.post('/send-whatsapp', status_code=202)
+async def send_whatsapp(req: WhatsAppMessage):
+    """
+    Queue a WhatsApp message and return at once (see whatsapp_queue.py for
+    delivery, retries and rate shaping). Re-posting with the same idempotency_key
+    — or, without one, the same order_id, number and message — returns the
+    existing job instead of sending twice; poll status_url for the sid.
+    """
+    account_sid, auth_token = _twilio_credentials()
+    if not account_sid or not auth_token:
+        return JSONResponse(content={'success': False, 'error': 'Twilio not configured'})
+
+    job, created = await whatsapp_queue.enqueue(req.to, req.message, req.order_id, req.idempotency_key)
+    return {
+        'success': True,
+        'duplicate': not created,
+        'status_url': f"/send-whatsapp/jobs/{job['id']}",
+        **_whatsapp_job(job),
+    }
+
+@app.get('/send-whatsapp/jobs/{job_id}')
+async def send_whatsapp_job(job_id: str):
+    """Delivery status of a queued WhatsApp message: queued, sending, sent (with sid) or failed."""
+    job = await whatsapp_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Job not found or expired')
+    return _whatsapp_job(job)
+
+# Meta Ads API Integration (Graph calls, caching and backoff live in meta_graph.py)
+META_CAMPAIGN_FIELDS = 'id,name,status,objective,daily_budget,insights{impressions,clicks,spend,ctr}'
+META_INSIGHT_PARAMS = {
+    'fields': 'impressions,clicks,spend,ctr,cpm,reach,frequency,actions',
+    'date_preset': 'last_30d',
+    'level': 'account'
+}
 
-# Meta Ads API Integration
-META_API_BASE = 'https://graph.facebook.com/v21.0'
+def _meta_credentials():
+    return os.environ.get('META_ACCESS_TOKEN'), os.environ.get('META_AD_ACCOUNT_ID')
+
+def _meta_insights(body: dict) -> dict:
+    data = body.get('data') or [{}]
+    return data[0]
+
+async def _meta_campaigns(token: str, account_id: str) -> list:
+    return await meta_graph.cached(
+        meta_graph.cache_key('campaigns', token),
+        lambda: meta_graph.get_all(f'act_{account_id}/campaigns', {
+            'access_token': token, 'fields': META_CAMPAIGN_FIELDS, 'limit': 100}),
+        scope=account_id,
+    )
+
+async def _meta_account_insights(token: str, account_id: str) -> dict:
+    async def load():
+        return _meta_insights(await meta_graph.request(
+            'GET', f'act_{account_id}/insights', params={'access_token': token, **META_INSIGHT_PARAMS}))
+    return await meta_graph.cached(meta_graph.cache_key('insights', token), load, scope=account_id)
 
 class MetaCampaignCreate(BaseModel):
     name: str
@@ -466,26 +1297,22 @@ class MetaAdCreate(BaseModel):
 
 @app.get('/meta/campaigns')
 async def get_meta_campaigns():
-    token = os.environ.get('META_ACCESS_TOKEN')
-    account_id = os.environ.get('META_AD_ACCOUNT_ID')
+    token, account_id = _meta_credentials()
     if not token or not account_id:
         return {'success': False, 'error': 'Meta not configured', 'campaigns': []}
-    async with httpx.AsyncClient() as client:
-        r = await client.get(
-            f'{META_API_BASE}/act_{account_id}/campaigns',
-            params={'access_token': token, 'fields': 'id,name,status,objective,daily_budget,insights{impressions,clicks,spend,ctr}'}
-        )
-    return {'success': True, 'campaigns': r.json().get('data', [])}
+    try:
+        return {'success': True, 'campaigns': await _meta_campaigns(token, account_id)}
+    except MetaError as e:
+        return {'success': False, 'error': str(e), 'campaigns': []}
 
 @app.post('/meta/campaigns')
 async def create_meta_campaign(req: MetaCampaignCreate):
-    token = os.environ.get('META_ACCESS_TOKEN')
-    account_id = os.environ.get('META_AD_ACCOUNT_ID')
+    token, account_id = _meta_credentials()
     if not token or not account_id:
         return {'success': False, 'error': 'Meta not configured'}
-    async with httpx.AsyncClient() as client:
-        r = await client.post(
-            f'{META_API_BASE}/act_{account_id}/campaigns',
+    try:
+        data = await meta_graph.request(
+            'POST', f'act_{account_id}/campaigns',
             data={
                 'name': req.name,
                 'objective': req.objective,
@@ -494,28 +1321,70 @@ async def create_meta_campaign(req: MetaCampaignCreate):
                 'access_token': token
             }
         )
-    data = r.json()
+    except MetaError as e:
+        return {'success': False, 'error': str(e)}
+    meta_graph.invalidate(account_id)
     if 'id' in data:
         return {'success': True, 'campaign_id': data['id']}
-    return {'success': False, 'error': data.get('error', {}).get('message', 'Unknown error')}
+    return {'success': False, 'error': 'Unknown error'}
 
 @app.get('/meta/insights')
 async def get_meta_insights():
-    token = os.environ.get('META_ACCESS_TOKEN')
-    account_id = os.environ.get('META_AD_ACCOUNT_ID')
+    token, account_id = _meta_credentials()
     if not token or not account_id:
         return {'success': False, 'error': 'Meta not configured', 'data': {}}
-    async with httpx.AsyncClient() as client:
-        r = await client.get(
-            f'{META_API_BASE}/act_{account_id}/insights',
-            params={
-                'access_token': token,
-                'fields': 'impressions,clicks,spend,ctr,cpm,reach,frequency,actions',
-                'date_preset': 'last_30d',
-                'level': 'account'
-            }
-        )
-    return {'success': True, 'data': r.json().get('data', [{}])[0] if r.json().get('data') else {}}
+    try:
+        return {'success': True, 'data': await _meta_account_insights(token, account_id)}
+    except MetaError as e:
+        return {'success': False, 'error': str(e), 'data': {}}
+
+@app.get('/meta/dashboard')
+async def get_meta_dashboard():
+    """
+    Campaigns and account insights for the ads dashboard in one Graph batch call
+    (one round trip instead of two), cached like the separate endpoints.
+    """
+    token, account_id = _meta_credentials()
+    if not token or not account_id:
+        return {'success': False, 'error': 'Meta not configured', 'campaigns': [], 'insights': {}}
+
+    async def load():
+        campaigns, insights = await meta_graph.batch([
+            (f'act_{account_id}/campaigns', {'fields': META_CAMPAIGN_FIELDS, 'limit': 100}),
+            (f'act_{account_id}/insights', META_INSIGHT_PARAMS),
+        ], token)
+        for part in (campaigns, insights):
+            if isinstance(part, MetaError):
+                raise part
+        items = campaigns.get('data', [])
+        next_page = (campaigns.get('paging') or {}).get('next')
+        if next_page:
+            # Accounts with more campaigns than one page: the rest via the cursor.
+            items += await meta_graph.get_all(next_page)
+        return {'campaigns': items, 'insights': _meta_insights(insights)}
+
+    try:
+        data = await meta_graph.cached(meta_graph.cache_key('dashboard', token), load, scope=account_id)
+    except MetaError as e:
+        return {'success': False, 'error': str(e), 'campaigns': [], 'insights': {}}
+    return {'success': True, **data}
+
+AD_COPY_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'ads': {
+            'type': 'array',
+            'minItems': 1,
+            'maxItems': 3,
+            'items': {
+                'type': 'object',
+                'properties': {'headline': {'type': 'string'}, 'body': {'type': 'string'}, 'cta': {'type': 'string'}},
+                'required': ['headline', 'body', 'cta'],
+            },
+        },
+    },
+    'required': ['ads'],
+}
 
 @app.post('/meta/generate-ad-copy')
 async def generate_ad_copy(req: dict):
@@ -536,23 +1405,22 @@ For each variation provide:
 - Primary text (max 125 chars, Trini-friendly tone)
 - CTA: (Shop Now / Learn More / Sign Up)
 
-Format as JSON array with fields: headline, body, cta"""
+Format as a JSON object {{"ads": [...]}} where each ad has fields: headline, body, cta"""
 
-    result = await ollama_chat([{"role": "user", "content": prompt}], model=DEFAULT_MODEL)
+    use_cache = not req.get('no_cache', False)
+    if not use_cache:
+        response_cache.note_bypass()
     try:
-        import json
-        # Try to extract JSON from response
-        start = result.find('[')
-        end = result.rfind(']') + 1
-        if start >= 0 and end > start:
-            ads = json.loads(result[start:end])
-        else:
-            ads = [{'headline': 'Shop Local on Juvay', 'body': result[:125], 'cta': 'Shop Now'}]
-    except:
-        ads = [{'headline': 'Discover Caribbean Businesses', 'body': result[:125], 'cta': 'Learn More'}]
+        result = await ollama_structured([{"role": "user", "content": prompt}], AD_COPY_SCHEMA, 'ad_copy',
+                                         model=DEFAULT_MODEL, priority=BATCH, cache=use_cache)
+    except StructuredOutputError as e:
+        # Still malformed after the retry — keep the endpoint's old fallback shape.
+        text = strip_code_fences(e.text)
+        return {'success': True, 'ads': [{'headline': 'Shop Local on Juvay', 'body': text[:125], 'cta': 'Shop Now'}]}
 
-    return {'success': True, 'ads': ads}
+    return {'success': True, 'ads': result['ads']}
 
 if __name__ == "__main__":
     import uvicorn
+    # WEB_CONCURRENCY > 1 is handled at the top of the module (see shared_state.py).
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,319 @@
+"""
+Meta Graph API client: cached reads, batch requests, pagination and
+usage-aware backoff.
+
+The ads dashboards poll /meta/campaigns and /meta/insights on every view, and
+each poll used to be a live Graph call. Graph quota is counted per app and per
+ad account, and Meta throttles the whole account once it runs out, so reads go
+through a small cache here instead:
+
+  * fresh for META_CACHE_TTL seconds, then served stale for up to
+    META_CACHE_STALE seconds while one background request refreshes it
+    (stale-while-revalidate) — a dashboard view never waits on Graph once the
+    entry exists;
+  * concurrent misses for the same request share one call (singleflight.py);
+  * writes (campaign creation) invalidate the account's cached reads; a read
+    or refresh that was already in flight is not cached when it lands.
+
+batch() sends several reads as one Graph batch request (one round trip, one
+HTTP request against the quota), and pages()/get_all() follow `paging.next`
+cursors up to META_MAX_PAGES.
+
+Every response's X-App-Usage, X-Ad-Account-Usage and X-Business-Use-Case-Usage
+headers are read. Once any of them reaches META_USAGE_THROTTLE percent, or Graph
+answers with a rate-limit error, calls are held back: cached reads are served
+stale whatever their age and uncached reads fail fast with MetaThrottled until
+the backoff (Meta's estimated_time_to_regain_access, or an exponential
+backoff from META_BACKOFF_BASE) has passed.
+
+The cache is per worker; Graph responses are small and the TTL short.
+
+Env config:
+    META_API_BASE=https://graph.facebook.com/v21.0
+    META_CACHE_TTL=60
+    META_CACHE_STALE=900
+    META_CACHE_MAX_ENTRIES=256
+    META_MAX_PAGES=20
+    META_USAGE_THROTTLE=90           percent of any usage header
+    META_BACKOFF_BASE=60             seconds, doubles while Graph stays throttled (max 1 hour)
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+import httpx
+
+import metrics
+from http_pool import http_pool
+from singleflight import singleflight
+
+logger = logging.getLogger(__name__)
+
+# Graph error codes for app, user, account and business-use-case throttling.
+RATE_LIMIT_CODES = {4, 17, 32, 613, 80000, 80001, 80002, 80003, 80004, 80005, 80006, 80008, 80009, 80014}
+USAGE_HEADERS = ('x-app-usage', 'x-ad-account-usage', 'x-business-use-case-usage')
+MAX_BACKOFF = 3600.0
+
+
+class MetaError(Exception):
+    def __init__(self, message: str, status: int = None, code: int = None):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+
+class MetaThrottled(MetaError):
+    """Graph quota is (nearly) exhausted; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f'Meta API rate limit reached, retry in {int(retry_after) + 1}s', status=429)
+        self.retry_after = retry_after
+
+
+def _usage_percent(headers) -> tuple:
+    """(highest usage percent, seconds until access is regained) from Graph's usage headers."""
+    pct, regain = 0.0, 0.0
+    for name in USAGE_HEADERS:
+        raw = headers.get(name)
+        if not raw:
+            continue
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            continue
+        entries = [e for group in value.values() for e in group] if name == 'x-business-use-case-usage' else [value]
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            for key in ('call_count', 'total_time', 'total_cputime', 'acc_id_util_pct'):
+                if isinstance(entry.get(key), (int, float)):
+                    pct = max(pct, float(entry[key]))
+            regain = max(regain, float(entry.get('estimated_time_to_regain_access') or 0) * 60)
+    return pct, regain
+
+
+def _error(body) -> tuple:
+    error = body.get('error') if isinstance(body, dict) else None
+    if not isinstance(error, dict):
+        return None, None
+    return error.get('message') or 'Unknown error', error.get('code')
+
+
+class MetaGraph:
+    def __init__(self, base: str, ttl: float = 60, stale: float = 900, max_entries: int = 256,
+                 max_pages: int = 20, usage_throttle: float = 90, backoff_base: float = 60):
+        self.base = base.rstrip('/')
+        self.ttl = ttl
+        self.stale = stale
+        self.max_entries = max_entries
+        self.max_pages = max_pages
+        self.usage_throttle = usage_throttle
+        self.backoff_base = backoff_base
+        self._cache = OrderedDict()  # key -> (fetched_at, value)
+        self._refreshing = {}        # key -> background refresh task
+        self._generations = {}       # scope -> invalidate() count; loads started earlier are not cached
+        self._blocked_until = 0.0
+        self._strikes = 0
+        self.usage = 0.0             # highest usage percent in the last response
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.calls = 0
+        self.batch_calls = 0
+        self.throttled = 0
+
+    @classmethod
+    def from_env(cls) -> 'MetaGraph':
+        return cls(
+            base=os.environ.get('META_API_BASE', 'https://graph.facebook.com/v21.0'),
+            ttl=float(os.environ.get('META_CACHE_TTL', '60')),
+            stale=float(os.environ.get('META_CACHE_STALE', '900')),
+            max_entries=int(os.environ.get('META_CACHE_MAX_ENTRIES', '256')),
+            max_pages=int(os.environ.get('META_MAX_PAGES', '20')),
+            usage_throttle=float(os.environ.get('META_USAGE_THROTTLE', '90')),
+            backoff_base=float(os.environ.get('META_BACKOFF_BASE', '60')),
+        )
+
+    # ── Transport ────────────────────────────────────────────────────────────
+
+    def _check_throttle(self):
+        wait = self._blocked_until - time.monotonic()
+        if wait > 0:
+            self.throttled += 1
+            raise MetaThrottled(wait)
+
+    def _observe(self, r: httpx.Response, body):
+        """Track quota from usage headers and rate-limit errors; start a backoff when it runs out."""
+        pct, regain = _usage_percent(r.headers)
+        self.usage = pct
+        _, code = _error(body)
+        if r.status_code == 429 or code in RATE_LIMIT_CODES or pct >= self.usage_throttle:
+            self._strikes += 1
+            backoff = max(regain, min(MAX_BACKOFF, self.backoff_base * 2 ** (self._strikes - 1)))
+            self._blocked_until = time.monotonic() + backoff
+            logger.warning(f"Meta Graph usage at {pct:.0f}% (code {code}); holding calls for {backoff:.0f}s")
+        else:
+            self._strikes = 0
+
+    async def request(self, method: str, path: str, **kwargs):
+        """
+        One Graph call on the shared pool; returns the decoded body. `path` is
+        relative to META_API_BASE, or a full URL (paging.next). Raises MetaError
+        on an error answer and MetaThrottled while backing off.
+        """
+        self._check_throttle()
+        url = path if path.startswith(('http://', 'https://')) else f'{self.base}/{path}'
+        self.calls += 1
+        async with metrics.track_upstream('meta'):
+            r = await http_pool.client('meta').request(method, url, **kwargs)
+        try:
+            body = r.json()
+        except ValueError:
+            body = None
+        if r.status_code >= 400:
+            metrics.UPSTREAM_ERRORS.labels('meta').inc()
+        self._observe(r, body)
+        message, code = _error(body)
+        if r.status_code >= 400 or message:
+            raise MetaError(message or f'HTTP {r.status_code}', status=r.status_code, code=code)
+        return body
+
+    async def batch(self, requests: list, token: str) -> list:
+        """
+        Run several GET requests as one Graph batch call. `requests` are
+        (path, params) pairs; returns one decoded body per request, or a
+        MetaError instance for requests that failed inside the batch.
+        """
+        batch = [{'method': 'GET', 'relative_url': f'{path}?{urlencode(params)}' if params else path}
+                 for path, params in requests]
+        self.batch_calls += 1
+        answers = await self.request('POST', '', data={'access_token': token, 'batch': json.dumps(batch)})
+        results = []
+        for answer in answers if isinstance(answers, list) else []:
+            if not answer:  # Graph sends null for requests that timed out inside the batch
+                results.append(MetaError('Batch request timed out'))
+                continue
+            try:
+                body = json.loads(answer.get('body') or 'null')
+            except ValueError:
+                body = None
+            message, code = _error(body)
+            if answer.get('code', 200) >= 400 or message:
+                results.append(MetaError(message or f"HTTP {answer.get('code')}", answer.get('code'), code))
+            else:
+                results.append(body)
+        if len(results) != len(requests):
+            raise MetaError('Malformed batch response')
+        return results
+
+    async def pages(self, path: str, params: dict = None):
+        """
+        Yield the items of a paginated edge page by page, following paging.next.
+        `path` may itself be a paging.next URL (then leave `params` empty).
+        """
+        url, kwargs = path, ({'params': params} if params else {})
+        for _ in range(self.max_pages):
+            body = await self.request('GET', url, **kwargs)
+            for item in body.get('data', []):
+                yield item
+            url = (body.get('paging') or {}).get('next')
+            if not url:
+                return
+            kwargs = {}  # the next URL carries the cursor, token and fields
+        logger.warning(f"Meta Graph pagination for {path} stopped at {self.max_pages} pages")
+
+    async def get_all(self, path: str, params: dict = None) -> list:
+        return [item async for item in self.pages(path, params)]
+
+    # ── Cache ────────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def cache_key(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    async def cached(self, key: str, load, scope: str = ''):
+        """
+        `await load()` through the cache with stale-while-revalidate. `scope`
+        (e.g. the ad account) groups entries for invalidate().
+        """
+        key = f'{scope}:{key}'
+        entry = self._cache.get(key)
+        now = time.monotonic()
+        if entry is not None:
+            age = now - entry[0]
+            throttled = self._blocked_until > now
+            if age < self.ttl:
+                self.hits += 1
+                return entry[1]
+            if age < self.ttl + self.stale or throttled:
+                self.stale_hits += 1
+                if not throttled:
+                    self._refresh(key, load, scope)
+                return entry[1]
+        self.misses += 1
+        generation = self._generations.get(scope, 0)
+        return await singleflight.do(f'meta:{generation}:{key}', lambda: self._load(key, load, scope, generation))
+
+    async def _load(self, key: str, load, scope: str, generation: int):
+        value = await load()
+        if self._generations.get(scope, 0) != generation:
+            return value  # invalidated while loading: the value may predate the write
+        self._cache[key] = (time.monotonic(), value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return value
+
+    def _refresh(self, key: str, load, scope: str):
+        if key in self._refreshing:
+            return
+        self.refreshes += 1
+        generation = self._generations.get(scope, 0)
+
+        async def refresh():
+            try:
+                await self._load(key, load, scope, generation)
+            except Exception as e:
+                logger.warning(f"Meta Graph background refresh failed: {e}")
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.ensure_future(refresh())
+
+    def invalidate(self, scope: str):
+        """Drop cached reads for `scope` (after a write), and fence off loads already in flight."""
+        self._generations[scope] = self._generations.get(scope, 0) + 1
+        prefix = f'{scope}:'
+        for key in [k for k in self._cache if k.startswith(prefix)]:
+            del self._cache[key]
+        for key, task in list(self._refreshing.items()):
+            if key.startswith(prefix):
+                task.cancel()
+
+    async def aclose(self):
+        for task in list(self._refreshing.values()):
+            task.cancel()
+        self._refreshing.clear()
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'calls': self.calls,
+            'batch_calls': self.batch_calls,
+            'throttled': self.throttled,
+            'usage_percent': self.usage,
+            'backoff_remaining': round(max(0.0, self._blocked_until - time.monotonic()), 1),
+            'entries': len(self._cache),
+        }
+
+
+meta_graph = MetaGraph.from_env()
@@ -0,0 +1,321 @@
+"""
+Dependency-free Prometheus metrics, served at /metrics in the text exposition format.
+
+Cheap enough to leave on in production: recording is a dict lookup plus an
+integer add (histograms add one bisect over ~15 bucket bounds), with no locks —
+everything is recorded from the event loop thread. Formatting only happens
+when /metrics is scraped.
+
+Subsystems that already keep their own counters (rate limiter, response cache,
+scheduler, connection pools) are exported through collectors, called at scrape
+time, instead of being counted twice.
+
+With several workers (see shared_state.py) each worker publishes its samples
+with its stats snapshot. /metrics sums counters and histograms across workers,
+so they describe the whole server; gauges are point-in-time readings that may
+already be server-wide (queue depth in a shared table), so each worker's value
+is kept under a `worker` label instead — aggregate them with sum() or max() in
+the query. Other workers' figures lag by at most WORKER_SNAPSHOT_INTERVAL seconds.
+"""
+import abc
+import bisect
+import time
+from contextlib import asynccontextmanager
+
+# Seconds — covers sub-ms cache hits through multi-minute vision batches.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+FAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+RATE_BUCKETS = (1.0, 2.5, 5.0, 10.0, 15.0, 20.0, 30.0, 40.0, 60.0, 80.0, 120.0, 200.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labelstr(names, values, extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _fmt(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class _Metric(abc.ABC):
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._children = {}
+
+    def labels(self, *values):
+        """Child for one label combination (created on first use)."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """A fresh child holding the state of one label combination."""
+
+    # Unlabelled metrics can be used directly.
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self) -> dict:
+        return {f'{self.name}{_labelstr(self.labelnames, values)}': child.value
+                for values, child in self._children.items()}
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    @asynccontextmanager
+    async def track(self, *values):
+        """Count the enclosed block as in flight."""
+        child = self.labels(*values)
+        child.value += 1
+        try:
+            yield
+        finally:
+            child.value -= 1
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self) -> dict:
+        out = {}
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float('inf'),), child.counts):
+                cumulative += count
+                le = 'le="' + _fmt(bound) + '"'
+                out[f'{self.name}_bucket{_labelstr(self.labelnames, values, le)}'] = cumulative
+            labels = _labelstr(self.labelnames, values)
+            out[f'{self.name}_sum{labels}'] = child.sum
+            out[f'{self.name}_count{labels}'] = cumulative
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels=()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def collector(self, fn):
+        """
+        Register `fn() -> iterable of (name, kind, help, labelnames, {label values tuple: value})`,
+        called at scrape time. Usable as a decorator.
+        """
+        self._collectors.append(fn)
+        return fn
+
+    def snapshot(self) -> dict:
+        """name -> {type, help, samples}; JSON-serialisable so workers can publish it."""
+        out = {}
+        for metric in self._metrics:
+            out[metric.name] = {'type': metric.kind, 'help': metric.help, 'samples': metric.samples()}
+        for fn in self._collectors:
+            for name, kind, help, labelnames, values in fn():
+                family = out.setdefault(name, {'type': kind, 'help': help, 'samples': {}})
+                for label_values, value in values.items():
+                    family['samples'][f'{name}{_labelstr(labelnames, label_values)}'] = value
+        return out
+
+
+def _with_worker(key: str, worker: str) -> str:
+    """Add a worker label to one rendered sample key."""
+    label = 'worker="' + _escape(worker) + '"'
+    if key.endswith('}'):
+        return key[:-1] + ',' + label + '}'
+    return key + '{' + label + '}'
+
+
+def merge(snapshots: dict) -> dict:
+    """
+    Combine per-worker snapshots ({worker id: snapshot}): counters and
+    histograms are summed sample by sample, gauges are labelled by worker.
+    """
+    merged = {}
+    for worker, snap in snapshots.items():
+        for name, family in snap.items():
+            target = merged.setdefault(name, {'type': family['type'], 'help': family['help'], 'samples': {}})
+            samples = target['samples']
+            if family['type'] == 'gauge':
+                for key, value in family['samples'].items():
+                    samples[_with_worker(key, worker)] = value
+                continue
+            for key, value in family['samples'].items():
+                samples[key] = samples.get(key, 0) + value
+    return merged
+
+
+def render(snapshot: dict) -> str:
+    lines = []
+    for name, family in snapshot.items():
+        if not family['samples']:
+            continue
+        lines.append(f'# HELP {name} {family["help"]}')
+        lines.append(f'# TYPE {name} {family["type"]}')
+        lines.extend(f'{key} {_fmt(value)}' for key, value in family['samples'].items())
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# ── HTTP server ──────────────────────────────────────────────────────────────
+HTTP_REQUESTS = registry.counter(
+    'trinibuild_http_requests_total', 'Requests handled, by route and status code.', ('route', 'status'))
+HTTP_LATENCY = registry.histogram(
+    'trinibuild_http_request_duration_seconds', 'Time to response headers, by route.', ('route',))
+HTTP_IN_FLIGHT = registry.gauge(
+    'trinibuild_http_requests_in_flight', 'Requests currently being handled, by route.', ('route',))
+
+# ── Upstreams (ollama_chat, ollama_stream, ollama_vision, image_fetch, twilio, meta) ──
+UPSTREAM_LATENCY = registry.histogram(
+    'trinibuild_upstream_request_duration_seconds', 'Upstream call latency (excluding queueing).', ('upstream',))
+UPSTREAM_ERRORS = registry.counter(
+    'trinibuild_upstream_errors_total', 'Upstream calls that raised or returned an error status.', ('upstream',))
+UPSTREAM_IN_FLIGHT = registry.gauge(
+    'trinibuild_upstream_in_flight', 'Upstream calls currently in progress.', ('upstream',))
+UPSTREAM_CONNECT = registry.histogram(
+    'trinibuild_upstream_connect_seconds', 'New connection setup time (TCP + TLS), by pool.', ('pool',),
+    buckets=FAST_BUCKETS)
+
+# ── Ollama ───────────────────────────────────────────────────────────────────
+OLLAMA_QUEUE_WAIT = registry.histogram(
+    'trinibuild_ollama_queue_wait_seconds', 'Time spent waiting for a scheduler slot.', ('model', 'priority'))
+OLLAMA_PHASE = registry.histogram(
+    'trinibuild_ollama_phase_seconds', 'Ollama-reported time per phase (load, prompt_eval, eval).',
+    ('model', 'phase'))
+OLLAMA_TOKENS = registry.counter(
+    'trinibuild_ollama_tokens_total', 'Tokens processed, by kind (prompt, completion).', ('model', 'kind'))
+OLLAMA_TOKENS_PER_SECOND = registry.histogram(
+    'trinibuild_ollama_tokens_per_second', 'Generation speed (eval_count / eval_duration).', ('model',),
+    buckets=RATE_BUCKETS)
+OLLAMA_COLD_LOAD = registry.histogram(
+    'trinibuild_ollama_cold_load_seconds', 'Model loads on the request path (load_duration above 0.5s).',
+    ('model',))
+ROUTED_LATENCY = registry.histogram(
+    'trinibuild_routed_request_seconds', 'Routed chat requests end to end, by the model that answered '
+    '(time spent on an escalated small-model attempt included).', ('endpoint', 'model'))
+ROUTED_TOKENS = registry.counter(
+    'trinibuild_routed_completion_tokens_total', 'Completion tokens of routed chat replies, by answering model.',
+    ('endpoint', 'model'))
+JSON_DECODE = registry.histogram(
+    'trinibuild_json_decode_seconds', 'Time to parse upstream JSON responses.', ('upstream',),
+    buckets=FAST_BUCKETS)
+
+# ── Event loop ───────────────────────────────────────────────────────────────
+LOOP_LAG = registry.histogram(
+    'trinibuild_event_loop_lag_seconds', 'How late the loop heartbeat wakes up (see loop_watchdog.py).',
+    buckets=FAST_BUCKETS)
+
+
+@asynccontextmanager
+async def track_upstream(upstream: str):
+    """Time an upstream call and count it in flight; exceptions count as errors."""
+    child = UPSTREAM_IN_FLIGHT.labels(upstream)
+    child.value += 1
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_ERRORS.labels(upstream).inc()
+        raise
+    finally:
+        child.value -= 1
+        UPSTREAM_LATENCY.labels(upstream).observe(time.perf_counter() - start)
+
+
+def record_ollama(model: str, data: dict):
+    """Record token counts and phase timings from a final Ollama response (durations in ns)."""
+    prompt_tokens = data.get('prompt_eval_count') or 0
+    completion_tokens = data.get('eval_count') or 0
+    if prompt_tokens:
+        OLLAMA_TOKENS.labels(model, 'prompt').inc(prompt_tokens)
+    if completion_tokens:
+        OLLAMA_TOKENS.labels(model, 'completion').inc(completion_tokens)
+    for phase in ('load', 'prompt_eval', 'eval'):
+        ns = data.get(f'{phase}_duration')
+        if ns:
+            OLLAMA_PHASE.labels(model, phase).observe(ns / 1e9)
+    eval_ns = data.get('eval_duration')
+    if completion_tokens and eval_ns:
+        OLLAMA_TOKENS_PER_SECOND.labels(model).observe(completion_tokens / (eval_ns / 1e9))
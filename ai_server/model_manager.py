@@ -0,0 +1,176 @@
+"""
+Model warm-up, per-model keep_alive and cold-load tracking.
+
+A model that is not resident costs the next caller several seconds while Ollama
+loads it. To keep that off the request path:
+
+  * the hot models (DEFAULT_MODEL and VISION_MODEL, plus the router's SMALL_MODEL
+    when MODEL_ROUTING=1, unless OLLAMA_PRELOAD_MODELS says otherwise) are
+    loaded on every backend at startup, in the background, and re-loaded on
+    any backend that comes back empty (e.g. after an Ollama restart). Nothing
+    is re-warmed while a node still has another model resident, so a box too
+    small for both models does not swap back and forth.
+  * every request carries a per-model keep_alive: preloaded models stay resident
+    for OLLAMA_PRELOAD_KEEP_ALIVE, others for OLLAMA_KEEP_ALIVE, and
+    OLLAMA_MODEL_KEEP_ALIVE overrides single models.
+  * residency comes from the backends' /api/ps (probed by ollama_backends.py),
+    and routing prefers nodes where the requested model is already loaded.
+
+Any response whose load_duration exceeds COLD_LOAD_THRESHOLD counts as a cold
+load (count and duration are exported to /metrics).
+
+Env config:
+    OLLAMA_PRELOAD_MODELS=qwen3-vl:8b,qwen2.5:7b     loaded in this order (last wins if memory is short)
+    OLLAMA_PRELOAD_KEEP_ALIVE=24h
+    OLLAMA_KEEP_ALIVE=30m
+    OLLAMA_MODEL_KEEP_ALIVE=llama3.2:3b=5m,qwen3:4b=10m
+    OLLAMA_WARM_INTERVAL=60                          seconds between re-warm checks (0 disables)
+"""
+import os
+import time
+import asyncio
+import logging
+
+import metrics
+from http_pool import http_pool
+from ollama_backends import ollama_pool
+from token_budget import token_budget
+
+logger = logging.getLogger(__name__)
+
+COLD_LOAD_THRESHOLD = 0.5  # seconds of load_duration that mean the model was not resident
+
+
+def _parse_keep_alive(spec: str) -> dict:
+    out = {}
+    for part in (spec or '').split(','):
+        name, sep, value = part.strip().rpartition('=')
+        if sep and name and value:
+            out[name] = value
+    return out
+
+
+class ModelManager:
+    def __init__(self, preload: list, default_keep_alive: str = '30m', preload_keep_alive: str = '24h',
+                 overrides: dict = None, warm_interval: float = 60.0, pool=None):
+        self.preload = list(dict.fromkeys(preload))  # ordered, de-duplicated
+        self.default_keep_alive = default_keep_alive
+        self.preload_keep_alive = preload_keep_alive
+        self.overrides = dict(overrides or {})
+        self.warm_interval = warm_interval
+        self.pool = pool or ollama_pool
+        self.warmups = {}      # model -> {'ok': n, 'failed': n}
+        self.cold_loads = {}   # model -> {'count': n, 'seconds': total}
+        self._task = None
+
+    @classmethod
+    def from_env(cls, default_model: str, vision_model: str, router=None) -> 'ModelManager':
+        """`router` is the ModelRouter; its small model is preloaded only when routing is enabled."""
+        small_model = router.small_model if router is not None and router.enabled else None
+        preload = os.environ.get('OLLAMA_PRELOAD_MODELS')
+        return cls(
+            [m.strip() for m in preload.split(',') if m.strip()] if preload is not None
+            else [m for m in (vision_model, small_model, default_model) if m],
+            default_keep_alive=os.environ.get('OLLAMA_KEEP_ALIVE', '30m'),
+            preload_keep_alive=os.environ.get('OLLAMA_PRELOAD_KEEP_ALIVE', '24h'),
+            overrides=_parse_keep_alive(os.environ.get('OLLAMA_MODEL_KEEP_ALIVE', '')),
+            warm_interval=float(os.environ.get('OLLAMA_WARM_INTERVAL', '60')),
+        )
+
+    def keep_alive(self, model: str) -> str:
+        """keep_alive to send with every request for `model`."""
+        if model in self.overrides:
+            return self.overrides[model]
+        return self.preload_keep_alive if model in self.preload else self.default_keep_alive
+
+    def resident_on(self, model: str) -> list:
+        return [b.url for b in self.pool.backends if model in b.loaded]
+
+    # ── Warm-up ──────────────────────────────────────────────────────────────
+
+    async def warm(self, backend, model: str) -> bool:
+        """
+        Load `model` on one backend: /api/generate with no prompt only loads it.
+        num_ctx must match what requests send (token_budget.context_window), or
+        the first real request would make Ollama reload the model.
+        """
+        start = time.perf_counter()
+        counts = self.warmups.setdefault(model, {'ok': 0, 'failed': 0})
+        try:
+            resp = await http_pool.client('ollama').post(
+                f'{backend.url}/api/generate',
+                json={'model': model, 'keep_alive': self.keep_alive(model),
+                      'options': {'num_ctx': token_budget.context_window(model)}},
+            )
+            resp.raise_for_status()
+            data = resp.json()
+        except Exception as e:
+            counts['failed'] += 1
+            logger.warning(f"Warm-up of {model} on {backend.url} failed: {e}")
+            return False
+        counts['ok'] += 1
+        backend.loaded.add(model)
+        # Not a cold load: no caller waited for it (which is the point).
+        load_s = (data.get('load_duration') or 0) / 1e9
+        logger.info(f"Warmed {model} on {backend.url} in {time.perf_counter() - start:.1f}s (load {load_s:.1f}s)")
+        return True
+
+    async def warm_all(self):
+        """Preload every configured model on every healthy backend (backends in parallel)."""
+        # Probe first so residency is known and unreachable nodes are skipped.
+        await asyncio.gather(*(self.pool.probe(b) for b in self.pool.backends))
+
+        async def one_backend(backend):
+            for model in self.preload:
+                if model not in backend.loaded:
+                    await self.warm(backend, model)
+
+        await asyncio.gather(*(one_backend(b) for b in self.pool.backends if b.healthy))
+
+    async def _warm_forever(self):
+        await self.warm_all()
+        while self.warm_interval > 0:
+            await asyncio.sleep(self.warm_interval)
+            for backend in self.pool.backends:
+                # Only refill a node that is idle and empty: warming next to another
+                # resident model could evict it and cause exactly the swap we avoid.
+                if backend.healthy and not backend.loaded and not backend.outstanding:
+                    for model in self.preload:
+                        await self.warm(backend, model)
+
+    def start(self):
+        """Start background warm-up (call from the app lifespan, after the pool)."""
+        if self._task is None and self.preload:
+            self._task = asyncio.ensure_future(self._warm_forever())
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # ── Cold loads ───────────────────────────────────────────────────────────
+
+    def observe(self, model: str, data: dict):
+        """Inspect a final Ollama response (durations in ns) for a cold model load."""
+        seconds = (data.get('load_duration') or 0) / 1e9
+        if seconds < COLD_LOAD_THRESHOLD:
+            return
+        entry = self.cold_loads.setdefault(model, {'count': 0, 'seconds': 0.0})
+        entry['count'] += 1
+        entry['seconds'] += seconds
+        metrics.OLLAMA_COLD_LOAD.labels(model).observe(seconds)
+
+    def stats(self) -> dict:
+        models = set(self.preload) | set(self.overrides) | set(self.cold_loads)
+        for backend in self.pool.backends:
+            models |= backend.loaded
+        return {
+            model: {
+                'keep_alive': self.keep_alive(model),
+                'preload': model in self.preload,
+                'resident_on': self.resident_on(model),
+                'warmups': self.warmups.get(model, {'ok': 0, 'failed': 0}),
+                'cold_loads': self.cold_loads.get(model, {'count': 0, 'seconds': 0.0}),
+            }
+            for model in sorted(models)
+        }
@@ -0,0 +1,195 @@
+"""
+Small-model routing for cheap chat requests.
+
+Every chat persona used to run on DEFAULT_MODEL (qwen2.5:7b). Most support-bot
+FAQ answers and short island-chat messages ("hi", "how do I add a product?")
+do not need it, and a 3-4B model answers them in a fraction of the time. The
+router classifies each request by endpoint kind (chatbot persona or island-chat
+mode), the user's message length and the whole prompt length:
+
+  * an easy request goes to SMALL_MODEL, with a tighter reply cap;
+  * anything else — other personas, a client-supplied system prompt, long
+    messages, long sessions — goes to DEFAULT_MODEL as before.
+
+A small-model reply is checked before it is used (check()): empty or very
+short, hit the reply cap, hedging ("I'm not sure", "as an AI"), drifting into
+another script (CJK output from small Qwen models), or looping. A failed check
+— or an error from the small model — escalates: the same request is answered by
+DEFAULT_MODEL. Streamed replies are held back for their first ROUTE_HOLD_CHARS
+characters so the check can still escalate before anything is sent.
+
+Route decisions, escalations (with the time they cost) and per-model latency and
+completion tokens are exported to /stats and /metrics, to tune the thresholds
+below from traffic.
+
+Routing is opt-in: with MODEL_ROUTING unset every request stays on
+DEFAULT_MODEL and SMALL_MODEL is not preloaded.
+
+Env config:
+    MODEL_ROUTING=0                         set to 1 to enable
+    SMALL_MODEL=llama3.2:3b
+    ROUTE_PERSONAS=support_bot              chatbot personas eligible for the small model
+    ROUTE_MODES=support,onboarding          island-chat modes eligible for the small model
+    ROUTE_MAX_INPUT_TOKENS=48               longest user message sent to the small model
+    ROUTE_MAX_PROMPT_TOKENS=1500            longest whole prompt (persona, summary, turns)
+    ROUTE_SMALL_MAX_TOKENS=300              small-model reply cap; reaching it escalates
+    ROUTE_MIN_REPLY_CHARS=8
+    ROUTE_HOLD_CHARS=160                    streamed text held back until checked
+"""
+import os
+import re
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_HEDGES = (
+    "i'm not sure", "i am not sure", "i'm not certain", "i don't know", "i do not know",
+    "i don't have information", "i don't have access", "i cannot help", "i can't help",
+    "i'm unable", "i am unable", "as an ai", "as a language model",
+)
+_CJK = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]')  # kana, CJK ideographs, hangul
+_REPEAT_MIN_WORDS = 24
+_REPEAT_MIN_UNIQUE = 0.35  # distinct words / words below this is a loop
+
+
+def _csv(spec: str) -> set:
+    return {part.strip() for part in spec.split(',') if part.strip()}
+
+
+class Route:
+    __slots__ = ('endpoint', 'model', 'reason', 'small')
+
+    def __init__(self, endpoint: str, model: str, reason: str, small: bool):
+        self.endpoint = endpoint
+        self.model = model
+        self.reason = reason
+        self.small = small
+
+
+class ModelRouter:
+    def __init__(self, default_model: str, small_model: str, enabled: bool = True, personas=('support_bot',),
+                 modes=('support', 'onboarding'), max_input_tokens: int = 48, max_prompt_tokens: int = 1500,
+                 small_max_tokens: int = 300, min_reply_chars: int = 8, hold_chars: int = 160):
+        self.default_model = default_model
+        self.small_model = small_model
+        self.enabled = enabled and bool(small_model) and small_model != default_model
+        self.personas = set(personas)
+        self.modes = set(modes)
+        self.max_input_tokens = max_input_tokens
+        self.max_prompt_tokens = max_prompt_tokens
+        self.small_max_tokens = small_max_tokens
+        self.min_reply_chars = min_reply_chars
+        self.hold_chars = hold_chars
+        self.decisions = {}    # (endpoint, model, reason) -> count
+        self.escalations = {}  # (endpoint, reason) -> {'count': n, 'seconds': spent on the small model}
+        self.models = {}       # model -> {'requests': n, 'seconds': total, 'completion_tokens': total}
+
+    @classmethod
+    def from_env(cls, default_model: str) -> 'ModelRouter':
+        return cls(
+            default_model,
+            os.environ.get('SMALL_MODEL', 'llama3.2:3b'),
+            enabled=os.environ.get('MODEL_ROUTING', '0').lower() in ('1', 'true', 'yes'),
+            personas=_csv(os.environ.get('ROUTE_PERSONAS', 'support_bot')),
+            modes=_csv(os.environ.get('ROUTE_MODES', 'support,onboarding')),
+            max_input_tokens=int(os.environ.get('ROUTE_MAX_INPUT_TOKENS', '48')),
+            max_prompt_tokens=int(os.environ.get('ROUTE_MAX_PROMPT_TOKENS', '1500')),
+            small_max_tokens=int(os.environ.get('ROUTE_SMALL_MAX_TOKENS', '300')),
+            min_reply_chars=int(os.environ.get('ROUTE_MIN_REPLY_CHARS', '8')),
+            hold_chars=int(os.environ.get('ROUTE_HOLD_CHARS', '160')),
+        )
+
+    # ── Classification ───────────────────────────────────────────────────────
+
+    def route(self, endpoint: str, kind: str, input_tokens: int, prompt_tokens: int,
+              custom_prompt: bool = False) -> Route:
+        """
+        Pick the model for one request. `kind` is the chatbot persona or the
+        island-chat mode; token counts are for the user's message and the whole prompt.
+        """
+        eligible = self.personas if endpoint == 'chatbot' else self.modes
+        if not self.enabled:
+            reason = 'disabled'
+        elif custom_prompt:
+            reason = 'custom_prompt'
+        elif kind not in eligible:
+            reason = 'kind'
+        elif input_tokens > self.max_input_tokens:
+            reason = 'long_input'
+        elif prompt_tokens > self.max_prompt_tokens:
+            reason = 'long_prompt'
+        else:
+            reason = 'easy'
+        small = reason == 'easy'
+        route = Route(endpoint, self.small_model if small else self.default_model, reason, small)
+        key = (endpoint, route.model, reason)
+        self.decisions[key] = self.decisions.get(key, 0) + 1
+        return route
+
+    # ── Checks on small-model replies ────────────────────────────────────────
+
+    def check(self, reply: str, completion_tokens: int = None, max_tokens: int = None):
+        """
+        Why a small-model reply should be escalated, or None if it can be used.
+        Without completion_tokens the reply is a streamed prefix: only the
+        content checks apply.
+        """
+        text = reply.strip()
+        final = completion_tokens is not None
+        if final and len(text) < self.min_reply_chars:
+            return 'too_short'
+        if final and max_tokens and completion_tokens >= max_tokens:
+            return 'hit_limit'
+        lowered = text.lower().replace('’', "'")
+        if any(hedge in lowered for hedge in _HEDGES):
+            return 'low_confidence'
+        if _CJK.search(text):
+            return 'off_language'
+        words = lowered.split()
+        if len(words) >= _REPEAT_MIN_WORDS and len(set(words)) / len(words) < _REPEAT_MIN_UNIQUE:
+            return 'repetitive'
+        return None
+
+    def escalate(self, route: Route, reason: str, seconds: float):
+        """Record a small-model reply that was dropped after `seconds`."""
+        entry = self.escalations.setdefault((route.endpoint, reason), {'count': 0, 'seconds': 0.0})
+        entry['count'] += 1
+        entry['seconds'] += seconds
+        logger.info(f"Escalated {route.endpoint} from {route.model} to {self.default_model}: {reason}")
+
+    def observe(self, endpoint: str, model: str, seconds: float, usage: dict = None):
+        """Record one answered request: end-to-end time (escalations included) and completion tokens."""
+        tokens = (usage or {}).get('completion_tokens') or 0
+        metrics.ROUTED_LATENCY.labels(endpoint, model).observe(seconds)
+        if tokens:
+            metrics.ROUTED_TOKENS.labels(endpoint, model).inc(tokens)
+        entry = self.models.setdefault(model, {'requests': 0, 'seconds': 0.0, 'completion_tokens': 0})
+        entry['requests'] += 1
+        entry['seconds'] += seconds
+        entry['completion_tokens'] += tokens
+
+    def stats(self) -> dict:
+        decisions = {}
+        for (endpoint, model, reason), n in self.decisions.items():
+            decisions.setdefault(endpoint, {})[f'{model} ({reason})'] = n
+        escalations = {}
+        for (endpoint, reason), entry in self.escalations.items():
+            escalations.setdefault(endpoint, {})[reason] = {'count': entry['count'],
+                                                           'seconds': round(entry['seconds'], 3)}
+        return {
+            'enabled': self.enabled,
+            'small_model': self.small_model,
+            'default_model': self.default_model,
+            'decisions': decisions,
+            'escalations': escalations,
+            'models': {
+                model: {
+                    'requests': e['requests'],
+                    'avg_latency_ms': round(e['seconds'] / e['requests'] * 1000, 1),
+                    'completion_tokens_per_s': round(e['completion_tokens'] / e['seconds'], 1) if e['seconds'] else None,
+                }
+                for model, e in self.models.items()
+            },
+        }
@@ -0,0 +1,305 @@
+"""
+Pool of Ollama backends with routing, health probes, circuit breakers and retry.
+
+Configure several inference boxes with OLLAMA_URLS (comma-separated); a single
+OLLAMA_URL keeps working as a pool of one:
+
+    OLLAMA_URLS=http://gpu-1:11434,http://gpu-2:11434,http://cpu-1:11434
+
+Routing (OLLAMA_ROUTING):
+  * least_outstanding — the backend with the fewest requests in flight, among
+    those that have the model installed (default). A node where the model is
+    not loaded counts as OLLAMA_COLD_PENALTY extra requests, so traffic stays
+    on warm nodes until they are that much busier (see model_manager.py).
+  * affinity — prefer backends that already have the model loaded in memory
+    (per /api/ps), then a stable per-model choice (rendezvous hashing), so each
+    model stays warm on the same nodes instead of being loaded everywhere.
+    Overflows to the next node once the preferred one has OLLAMA_AFFINITY_SPILL
+    requests in flight.
+
+Callers can also pass an affinity_key (e.g. a chat session id): requests with
+the same key go to the same backend while it is not overloaded, so Ollama can
+reuse that conversation's cached prompt prefix.
+
+Each backend has a circuit breaker: OLLAMA_BREAKER_THRESHOLD consecutive
+failures open it for OLLAMA_BREAKER_COOLDOWN seconds, after which one trial
+request decides whether it closes again. Health probes hit /api/ps and
+/api/tags every OLLAMA_HEALTH_INTERVAL seconds; a node that fails them gets no
+traffic until it passes again (they also feed model residency to routing).
+
+Generations are idempotent, so a request that fails to connect or gets a 5xx is
+retried on another backend (up to OLLAMA_RETRIES times). A stream is only
+retried before its first byte.
+"""
+import os
+import time
+import zlib
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+import httpx
+from fastapi import HTTPException
+
+from http_pool import http_pool
+
+logger = logging.getLogger(__name__)
+
+LEAST_OUTSTANDING = 'least_outstanding'
+AFFINITY = 'affinity'
+
+# Failures that mean "this node could not serve it" and are safe to retry elsewhere.
+# A ReadTimeout is not retried: the generation already used its full time budget.
+_RETRYABLE = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout,
+              httpx.RemoteProtocolError, httpx.ReadError, httpx.WriteError)
+
+
+class NoBackendAvailable(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=503, detail='AI service is unavailable. Please try again shortly.',
+                         headers={'Retry-After': '10'})
+
+
+class UpstreamStatusError(Exception):
+    """A backend answered with a 5xx status."""
+
+    def __init__(self, status_code: int):
+        super().__init__(f'Ollama backend returned HTTP {status_code}')
+        self.status_code = status_code
+
+
+class Backend:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.outstanding = 0
+        self.healthy = True        # last probe result (optimistic until the first probe)
+        self.installed = None      # model names from /api/tags; None = not probed yet
+        self.loaded = set()        # model names resident in memory, from /api/ps
+        self.state = self.CLOSED
+        self.failures = 0          # consecutive
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.requests = 0
+        self.errors = 0
+
+    def available(self, now: float, cooldown: float) -> bool:
+        if self.state == self.OPEN and now - self.opened_at >= cooldown:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            return not self.trial_in_flight
+        return self.state == self.CLOSED and self.healthy
+
+    def has_model(self, model: str) -> bool:
+        return self.installed is None or model in self.installed or model in self.loaded
+
+    def stats(self) -> dict:
+        return {
+            'healthy': self.healthy,
+            'breaker': self.state,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'errors': self.errors,
+            'loaded': sorted(self.loaded),
+        }
+
+
+class BackendPool:
+    def __init__(self, urls: list, routing: str = LEAST_OUTSTANDING, retries: int = 1,
+                 breaker_threshold: int = 3, breaker_cooldown: float = 15.0,
+                 health_interval: float = 10.0, affinity_spill: int = 4, cold_penalty: int = 4):
+        if not urls:
+            raise ValueError('at least one Ollama URL is required')
+        self.backends = [Backend(u) for u in urls]
+        self.routing = routing if routing in (LEAST_OUTSTANDING, AFFINITY) else LEAST_OUTSTANDING
+        self.retries = max(0, retries)
+        self.breaker_threshold = max(1, breaker_threshold)
+        self.breaker_cooldown = breaker_cooldown
+        self.health_interval = health_interval
+        self.affinity_spill = max(1, affinity_spill)
+        self.cold_penalty = max(0, cold_penalty)
+        self.retried = 0
+        self._rr = itertools.count()
+        self._prober = None
+
+    @classmethod
+    def from_env(cls) -> 'BackendPool':
+        urls = os.environ.get('OLLAMA_URLS') or os.environ.get('OLLAMA_URL', 'http://deer-flow-ollama-1:11434')
+        return cls(
+            [u.strip() for u in urls.split(',') if u.strip()],
+            routing=os.environ.get('OLLAMA_ROUTING', LEAST_OUTSTANDING).lower(),
+            retries=int(os.environ.get('OLLAMA_RETRIES', '1')),
+            breaker_threshold=int(os.environ.get('OLLAMA_BREAKER_THRESHOLD', '3')),
+            breaker_cooldown=float(os.environ.get('OLLAMA_BREAKER_COOLDOWN', '15')),
+            health_interval=float(os.environ.get('OLLAMA_HEALTH_INTERVAL', '10')),
+            affinity_spill=int(os.environ.get('OLLAMA_AFFINITY_SPILL', '4')),
+            cold_penalty=int(os.environ.get('OLLAMA_COLD_PENALTY', '4')),
+        )
+
+    def __len__(self):
+        return len(self.backends)
+
+    @property
+    def primary(self) -> str:
+        return self.backends[0].url
+
+    # ── Routing ──────────────────────────────────────────────────────────────
+
+    def _rendezvous(self, key: str, candidates: list):
+        """Highest-random-weight order for `key`: stable, and only 1/n keys move when a node leaves."""
+        return sorted(candidates, key=lambda b: -zlib.crc32(f'{key}|{b.url}'.encode()))
+
+    def pick(self, model: str, exclude=(), affinity_key: str = None) -> Backend:
+        """Choose a backend for `model`, skipping `exclude`; None if none is available."""
+        now = time.monotonic()
+        candidates = [b for b in self.backends
+                      if b not in exclude and b.available(now, self.breaker_cooldown)]
+        if not candidates:
+            # Every node failed its probe: still try those whose breakers are closed,
+            # since real traffic is a better health signal than the probe.
+            candidates = [b for b in self.backends if b not in exclude and b.state == Backend.CLOSED]
+        if not candidates:
+            return None
+        with_model = [b for b in candidates if b.has_model(model)]
+        candidates = with_model or candidates
+        if len(candidates) == 1:
+            return candidates[0]
+        loaded = [b for b in candidates if model in b.loaded]
+        if affinity_key is not None:
+            for backend in self._rendezvous(affinity_key, loaded or candidates):
+                if backend.outstanding < self.affinity_spill:
+                    return backend
+        if self.routing == AFFINITY:
+            for backend in self._rendezvous(model, loaded or candidates):
+                if backend.outstanding < self.affinity_spill:
+                    return backend
+        # Least outstanding (cold nodes penalised); rotate the start so ties spread evenly.
+        offset = next(self._rr) % len(candidates)
+        rotated = candidates[offset:] + candidates[:offset]
+        return min(rotated, key=lambda b: b.outstanding + (0 if model in b.loaded else self.cold_penalty))
+
+    # ── Breaker bookkeeping ──────────────────────────────────────────────────
+
+    def _success(self, backend: Backend, model: str):
+        backend.loaded.add(model)  # it has just served the model, so it is resident now
+        backend.failures = 0
+        if backend.state != Backend.CLOSED:
+            logger.info(f"Ollama backend {backend.url} recovered; closing circuit")
+        backend.state = Backend.CLOSED
+
+    def _failure(self, backend: Backend, error):
+        backend.errors += 1
+        backend.failures += 1
+        if backend.state == Backend.HALF_OPEN or backend.failures >= self.breaker_threshold:
+            if backend.state != Backend.OPEN:
+                logger.warning(f"Ollama backend {backend.url} failing ({error}); opening circuit "
+                               f"for {self.breaker_cooldown:.0f}s")
+            backend.state = Backend.OPEN
+            backend.opened_at = time.monotonic()
+
+    # ── Requests ─────────────────────────────────────────────────────────────
+
+    @asynccontextmanager
+    async def request(self, model: str, method: str, path: str, *, stream: bool = False,
+                      affinity_key: str = None, **kwargs):
+        """
+        Send `method path` to a backend chosen for `model` and yield the response.
+        Connection failures and 5xx answers are retried on another backend; with
+        stream=True the body is read inside the block and is not retried.
+        """
+        tried = []
+        last_error = None
+        for attempt in range(self.retries + 1):
+            backend = self.pick(model, exclude=tried, affinity_key=affinity_key)
+            if backend is None:
+                break
+            tried.append(backend)
+            if attempt:
+                self.retried += 1
+                logger.warning(f"Retrying Ollama {path} for {model} on {backend.url} after: {last_error}")
+            trial = backend.state == Backend.HALF_OPEN
+            if trial:
+                backend.trial_in_flight = True
+            backend.outstanding += 1
+            backend.requests += 1
+            try:
+                client = http_pool.client('ollama')
+                try:
+                    resp = await client.send(client.build_request(method, f'{backend.url}{path}', **kwargs),
+                                             stream=stream)
+                except _RETRYABLE as e:
+                    self._failure(backend, e)
+                    last_error = e
+                    continue
+                except Exception as e:
+                    self._failure(backend, e)
+                    raise
+                if resp.status_code >= 500:
+                    await resp.aclose()
+                    last_error = UpstreamStatusError(resp.status_code)
+                    self._failure(backend, last_error)
+                    continue
+                try:
+                    yield resp
+                except (httpx.TransportError, UpstreamStatusError) as e:
+                    self._failure(backend, e)  # failed mid-stream: count it, but too late to retry
+                    raise
+                finally:
+                    await resp.aclose()
+                self._success(backend, model)
+                return
+            finally:
+                backend.outstanding -= 1
+                if trial:
+                    backend.trial_in_flight = False
+        if last_error is not None:
+            raise last_error
+        raise NoBackendAvailable()
+
+    # ── Health probes ────────────────────────────────────────────────────────
+
+    async def probe(self, backend: Backend):
+        client = http_pool.client('ollama')
+        try:
+            ps, tags = await asyncio.gather(
+                client.get(f'{backend.url}/api/ps', timeout=5.0),
+                client.get(f'{backend.url}/api/tags', timeout=5.0),
+            )
+            ps.raise_for_status()
+            tags.raise_for_status()
+            backend.loaded = {m.get('name') or m.get('model') for m in ps.json().get('models') or []}
+            backend.installed = {m.get('name') or m.get('model') for m in tags.json().get('models') or []}
+        except Exception as e:
+            if backend.healthy:
+                logger.warning(f"Ollama backend {backend.url} failed health probe: {e}")
+            backend.healthy = False
+            return
+        if not backend.healthy:
+            logger.info(f"Ollama backend {backend.url} passed health probe")
+        backend.healthy = True
+
+    async def _probe_forever(self):
+        while True:
+            await asyncio.gather(*(self.probe(b) for b in self.backends))
+            await asyncio.sleep(self.health_interval)
+
+    def start(self):
+        """Start background health probes (call from the app lifespan)."""
+        if self._prober is None and self.health_interval > 0:
+            self._prober = asyncio.ensure_future(self._probe_forever())
+
+    async def aclose(self):
+        if self._prober is not None:
+            self._prober.cancel()
+            self._prober = None
+
+    def stats(self) -> dict:
+        return {
+            'routing': self.routing,
+            'retried': self.retried,
+            'backends': {b.url: b.stats() for b in self.backends},
+        }
+
+
+ollama_pool = BackendPool.from_env()
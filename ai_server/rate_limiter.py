@@ -0,0 +1,282 @@
+"""
+Constant-memory per-key rate limiting (GCRA — generic cell rate algorithm).
+
+Each (ip, path) key stores a single float: its "theoretical arrival time" (TAT).
+Every request advances TAT by an interval T; it is allowed while TAT - now stays
+within a tolerance of B*T, i.e. a burst of B back-to-back requests. GCRA then
+admits at most B + t/T requests in any t seconds, so a limit of N per W seconds
+uses B = ceil(N/2) and T = W / (N - B + 1): a burst of about half the limit,
+refilled smoothly, and never more than N in any rolling W-second window (a
+burst of N with T = W/N would let through almost 2N in the first window).
+Rather than the old deque of timestamps, this is O(1) in time and memory per key.
+
+That is stricter than the deque it replaced, which allowed all N back to back:
+with one float per key the burst and the refill rate share the N, so a client
+gets ceil(N/2) at once (6 of the vision limit's 12) and then N - ceil(N/2) + 1
+per window at a steady pace (7 per minute for vision), instead of N at once and
+nothing more until the oldest falls out of the window. Raising a limit in
+main.py raises both.
+
+Backends:
+  * MemoryBackend — plain dict, no locks. All checks run synchronously on the
+    event loop thread (no await between read and write), so they are atomic
+    with respect to other requests. A background sweep drops idle keys.
+  * SharedMemoryBackend — fixed-size table in a named shared-memory segment so
+    several uvicorn workers enforce one combined limit. Keys are hashed into
+    4-way buckets; writes are serialised with an flock on a lock file, which
+    can block while another worker holds it, so async callers go through
+    check_async() / RateLimiter.ahit() and the check runs in a thread. The
+    default in multi-worker mode (see shared_state.py).
+
+Env config:
+    RATE_LIMIT_BACKEND=memory | shm
+    RATE_LIMIT_SHM_NAME=trinibuild-ratelimit
+    RATE_LIMIT_SHM_SLOTS=65536
+"""
+import os
+import sys
+import time
+import math
+import tempfile
+import struct
+import asyncio
+import zlib
+import logging
+
+import shared_state
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """Per-process store: key -> TAT (float)."""
+    blocking = False
+
+    def __init__(self):
+        self._tat = {}
+
+    def check(self, key, now: float, interval: float, window: float):
+        """
+        Return (allowed, retry_after_seconds) and record the hit if allowed.
+        `window` is the tolerance: the burst size times `interval`.
+        """
+        tat = self._tat.get(key, now)
+        if tat < now:
+            tat = now
+        new_tat = tat + interval
+        if new_tat - now > window:
+            return False, new_tat - now - window
+        self._tat[key] = new_tat
+        return True, 0.0
+
+    def sweep(self, now: float) -> int:
+        """Drop keys whose budget has fully recovered — they carry no state."""
+        idle = [k for k, tat in self._tat.items() if tat <= now]
+        for k in idle:
+            del self._tat[k]
+        return len(idle)
+
+    def __len__(self):
+        return len(self._tat)
+
+    def close(self):
+        self._tat.clear()
+
+
+class SharedMemoryBackend:
+    """
+    Cross-process store in a shared-memory segment.
+
+    Layout: `slots` entries of (fingerprint: u64, tat: f64), grouped into 4-way
+    buckets. A key lives in the bucket chosen by its hash; if the bucket is full
+    the entry with the oldest TAT (the one closest to idle) is replaced.
+    """
+    blocking = True  # check() takes an flock
+    _ENTRY = struct.Struct('<Qd')
+    _WAYS = 4
+    _BUCKET = struct.Struct('<' + 'Qd' * _WAYS)  # read a whole bucket in one call
+
+    def __init__(self, name: str = 'trinibuild-ratelimit', slots: int = 65536, lock_dir: str = None):
+        import fcntl
+        from multiprocessing import shared_memory
+        self._fcntl = fcntl
+        lock_dir = lock_dir or tempfile.gettempdir()
+        self._lock_fd = os.open(os.path.join(lock_dir, f'{name}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        # Every attached process holds a shared lock on the users file; whoever can
+        # upgrade to exclusive on close is the last one out and unlinks the segment.
+        self._users_fd = os.open(os.path.join(lock_dir, f'{name}.users'), os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._users_fd, fcntl.LOCK_SH)
+        size = max(1, slots // self._WAYS) * self._WAYS * self._ENTRY.size
+        # Lifetime is managed by the users lock, not Python's per-process resource tracker
+        # (which would unlink the segment as soon as the creating worker exits).
+        untracked = {'track': False} if sys.version_info >= (3, 13) else {}
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size, **untracked)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name, create=False, **untracked)
+        if not untracked:
+            _untrack(self._shm)
+        # Size from the segment itself: an attaching worker must agree with its creator.
+        self.buckets = max(1, self._shm.size // (self._WAYS * self._ENTRY.size))
+        self._buf = self._shm.buf
+
+    @staticmethod
+    def _fingerprint(key) -> int:
+        # Stable across processes (unlike hash()) and cheap; 0 is reserved for "empty".
+        data = ('\x00'.join(key) if isinstance(key, tuple) else str(key)).encode()
+        return (zlib.crc32(data) << 32 | zlib.adler32(data)) or 1
+
+    def check(self, key, now: float, interval: float, window: float):
+        fp = self._fingerprint(key)
+        offset = (fp % self.buckets) * self._BUCKET.size
+        self._fcntl.flock(self._lock_fd, self._fcntl.LOCK_EX)
+        try:
+            bucket = self._BUCKET.unpack_from(self._buf, offset)
+            slot, tat, victim, victim_tat = None, now, 0, math.inf
+            for way in range(self._WAYS):
+                f, t = bucket[2 * way], bucket[2 * way + 1]
+                if f == fp:
+                    slot, tat = way, t
+                    break
+                if f == 0 or t < victim_tat:
+                    victim, victim_tat = way, (-1.0 if f == 0 else t)
+            if tat < now:
+                tat = now
+            new_tat = tat + interval
+            if new_tat - now > window:
+                return False, new_tat - now - window
+            way = victim if slot is None else slot
+            self._ENTRY.pack_into(self._buf, offset + way * self._ENTRY.size, fp, new_tat)
+            return True, 0.0
+        finally:
+            self._fcntl.flock(self._lock_fd, self._fcntl.LOCK_UN)
+
+    def sweep(self, now: float) -> int:
+        return 0  # fixed-size table; idle entries are overwritten in place
+
+    def __len__(self):
+        entry = self._ENTRY
+        return sum(1 for i in range(self.buckets * self._WAYS)
+                   if entry.unpack_from(self._buf, i * entry.size)[0])
+
+    def close(self):
+        self._buf = None
+        os.close(self._lock_fd)
+        self._shm.close()
+        fcntl = self._fcntl
+        fcntl.flock(self._users_fd, fcntl.LOCK_UN)
+        try:
+            fcntl.flock(self._users_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            try:
+                _unlink(self._shm)
+            except FileNotFoundError:
+                pass
+        except BlockingIOError:
+            pass  # other workers still attached
+        os.close(self._users_fd)
+
+
+def _untrack(shm):
+    """Before Python 3.13 every SharedMemory registers with the tracker: undo that once."""
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+def _unlink(shm):
+    """
+    Remove the segment's name. SharedMemory.unlink() before 3.13 also unregisters
+    it from the resource tracker — a second unregister after _untrack(), which
+    the tracker reports as a KeyError — so go straight to shm_unlink there.
+    """
+    if sys.version_info >= (3, 13):
+        shm.unlink()
+    else:
+        import _posixshmem
+        _posixshmem.shm_unlink(shm._name)
+
+
+async def check_async(backend, key, now: float, interval: float, window: float):
+    """backend.check() from async code: off the event loop when the backend can block."""
+    if backend.blocking:
+        return await asyncio.to_thread(backend.check, key, now, interval, window)
+    return backend.check(key, now, interval, window)
+
+
+class RateLimiter:
+    def __init__(self, limits: dict, window: float, backend=None):
+        self.limits = limits
+        self.window = window
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.rejections = {}
+        self._sweeper = None
+
+    def params(self, limit: int):
+        """(interval, tolerance) for the backends: at most `limit` requests in any rolling window."""
+        burst = (limit + 1) // 2
+        interval = self.window / (limit - burst + 1)
+        return interval, burst * interval
+
+    def hit(self, key, limit: int, now: float = None):
+        """Record one request for `key` against `limit` per window; returns (allowed, retry_after)."""
+        interval, tolerance = self.params(limit)
+        allowed, retry = self.backend.check(key, now if now is not None else time.monotonic(),
+                                            interval, tolerance)
+        return self._record(key, allowed, retry)
+
+    async def ahit(self, key, limit: int, now: float = None):
+        """hit() for async callers; runs in a thread when the backend can block."""
+        interval, tolerance = self.params(limit)
+        allowed, retry = await check_async(self.backend, key, now if now is not None else time.monotonic(),
+                                           interval, tolerance)
+        return self._record(key, allowed, retry)
+
+    def _record(self, key, allowed: bool, retry: float):
+        if not allowed:
+            path = key[1] if isinstance(key, tuple) else key
+            self.rejections[path] = self.rejections.get(path, 0) + 1
+        return allowed, retry
+
+    async def _sweep_forever(self, every: float):
+        while True:
+            await asyncio.sleep(every)
+            try:
+                self.backend.sweep(time.monotonic())
+            except Exception as e:
+                logger.warning(f"Rate limiter sweep failed: {e}")
+
+    def start(self, every: float = None):
+        """Start background eviction of idle keys (call from the app lifespan)."""
+        if self._sweeper is None:
+            self._sweeper = asyncio.ensure_future(self._sweep_forever(every or self.window))
+
+    async def aclose(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        self.backend.close()
+
+    def stats(self) -> dict:
+        return {
+            'backend': type(self.backend).__name__,
+            'keys': len(self.backend),
+            'rejections': dict(self.rejections),
+        }
+
+
+def backend_from_env(name: str = 'ratelimit'):
+    """GCRA store for one limiter; `name` keeps limiters apart in shared memory."""
+    default = 'shm' if shared_state.MULTI_WORKER else 'memory'
+    kind = os.environ.get('RATE_LIMIT_BACKEND', default).lower()
+    if kind == 'shm':
+        # Scoped to this deployment so a restarted server never inherits stale counts.
+        shm_name = f'trinibuild-{name}-{shared_state.deployment_id()}'
+        if name == 'ratelimit':
+            shm_name = os.environ.get('RATE_LIMIT_SHM_NAME', shm_name)
+        try:
+            return SharedMemoryBackend(name=shm_name, slots=int(os.environ.get('RATE_LIMIT_SHM_SLOTS', '65536')))
+        except (ImportError, OSError) as e:
+            logger.warning(f"Shared-memory rate limiter unavailable ({e}); falling back to per-process memory")
+    return MemoryBackend()
@@ -0,0 +1,229 @@
+"""
+Content-addressed cache for deterministic generation endpoints.
+
+Keys are a SHA-256 over (model, normalized messages, generation options), so a
+re-submitted product template or a client retry is served without another LLM
+call. Two tiers:
+
+  * memory — LRU with TTL, bounded by total value bytes
+  * disk   — optional SQLite file (WAL) that survives restarts; enabled by
+             setting RESPONSE_CACHE_PATH
+
+Env config:
+    RESPONSE_CACHE_TTL=86400               seconds an entry stays valid
+    RESPONSE_CACHE_MAX_BYTES=33554432      memory tier size bound (32 MB)
+    RESPONSE_CACHE_PATH=/data/cache.db     enable the on-disk tier (on by default with
+                                           multiple workers, so they share one cache)
+    RESPONSE_CACHE_DISK_MAX_BYTES=268435456  disk tier size bound (256 MB)
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import shared_state
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(model: str, messages: list, options: dict) -> str:
+    """Stable key: whitespace-normalized messages, sorted options."""
+    normalized = [
+        {'role': m.get('role'), 'content': ' '.join(str(m.get('content') or '').split())}
+        for m in messages
+    ]
+    blob = json.dumps({'model': model, 'messages': normalized, 'options': options or {}},
+                      sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class _DiskTier:
+    """
+    SQLite-backed tier (also used by chat_sessions.py, with its own table).
+    All methods are blocking — call via asyncio.to_thread.
+
+    Size is tracked with a running total updated on each write, so a put costs
+    one primary-key lookup rather than a table scan. Only when the total
+    crosses max_bytes does an eviction pass recount the table (picking up
+    rows other workers wrote to the same file) and trim it to LOW_WATER of
+    the bound, so a full cache does not recount on every put.
+    """
+
+    LOW_WATER = 0.9
+
+    def __init__(self, path: str, max_bytes: int, table: str = 'response_cache'):
+        self.max_bytes = max_bytes
+        self.table = table
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} ('
+            ' key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,'
+            ' expires_at REAL NOT NULL, last_access REAL NOT NULL)'
+        )
+        self._db.execute(f'CREATE INDEX IF NOT EXISTS {table}_access ON {table}(last_access)')
+        self.entries, self.bytes = self._db.execute(
+            f'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {table}').fetchone()
+
+    def get(self, key: str, now: float):
+        with self._lock:
+            row = self._db.execute(
+                f'SELECT value, expires_at FROM {self.table} WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._db.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                self.entries = max(0, self.entries - 1)
+                self.bytes = max(0, self.bytes - len(row[0]))
+                return None
+            self._db.execute(f'UPDATE {self.table} SET last_access = ? WHERE key = ?', (now, key))
+            return row
+
+    def put(self, key: str, value: bytes, expires_at: float, now: float):
+        with self._lock:
+            old = self._db.execute(f'SELECT size FROM {self.table} WHERE key = ?', (key,)).fetchone()
+            self._db.execute(
+                f'INSERT OR REPLACE INTO {self.table} (key, value, size, expires_at, last_access)'
+                ' VALUES (?, ?, ?, ?, ?)', (key, value, len(value), expires_at, now))
+            if old is None:
+                self.entries += 1
+            self.bytes += len(value) - (old[0] if old else 0)
+            if self.bytes > self.max_bytes:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        self._db.execute(f'DELETE FROM {self.table} WHERE expires_at <= ?', (now,))
+        self.entries, total = self._db.execute(
+            f'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}').fetchone()
+        self.bytes = total
+        target = int(self.max_bytes * self.LOW_WATER)
+        if total <= target:
+            return
+        # Drop least-recently-used rows until we are back under the low-water mark.
+        excess = total - target
+        doomed = []
+        for key, size in self._db.execute(f'SELECT key, size FROM {self.table} ORDER BY last_access'):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany(f'DELETE FROM {self.table} WHERE key = ?', doomed)
+        self.entries -= len(doomed)
+        self.bytes = target + excess  # excess is now <= 0
+
+    def usage(self) -> dict:
+        # This process's running totals — never touches the database.
+        return {'entries': self.entries, 'bytes': self.bytes, 'max_bytes': self.max_bytes}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class ResponseCache:
+    def __init__(self, ttl: float = 86400, max_bytes: int = 32 * 1024 * 1024,
+                 disk_path: str = None, disk_max_bytes: int = 256 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._mem = OrderedDict()  # key -> (expires_at, encoded value)
+        self._mem_bytes = 0
+        self._disk = None
+        if disk_path:
+            try:
+                self._disk = _DiskTier(disk_path, disk_max_bytes)
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache disk tier disabled ({disk_path}): {e}")
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    @classmethod
+    def from_env(cls) -> 'ResponseCache':
+        return cls(
+            ttl=float(os.environ.get('RESPONSE_CACHE_TTL', '86400')),
+            max_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+            disk_path=os.environ.get('RESPONSE_CACHE_PATH') or (
+                shared_state.state_path('response_cache.db') if shared_state.MULTI_WORKER else None),
+            disk_max_bytes=int(os.environ.get('RESPONSE_CACHE_DISK_MAX_BYTES', str(256 * 1024 * 1024))),
+        )
+
+    async def get(self, key: str):
+        now = time.time()
+        entry = self._mem.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._mem.move_to_end(key)
+                self.hits_memory += 1
+                return json.loads(entry[1])
+            self._drop(key)
+        if self._disk is not None:
+            try:
+                row = await asyncio.to_thread(self._disk.get, key, now)
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache disk read failed: {e}")
+                row = None
+            if row is not None:
+                self.hits_disk += 1
+                raw, expires_at = bytes(row[0]), row[1]
+                self._store(key, raw, expires_at)  # promote to memory
+                return json.loads(raw)
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, value):
+        now = time.time()
+        encoded = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self._store(key, encoded, now + self.ttl)
+        if self._disk is not None:
+            try:
+                await asyncio.to_thread(self._disk.put, key, encoded, now + self.ttl, now)
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache disk write failed: {e}")
+
+    def note_bypass(self):
+        self.bypassed += 1
+
+    def _store(self, key: str, encoded: bytes, expires_at: float):
+        if len(encoded) > self.max_bytes:
+            return
+        self._drop(key)
+        self._mem[key] = (expires_at, encoded)
+        self._mem_bytes += len(encoded)
+        while self._mem_bytes > self.max_bytes:
+            _, (_, old) = self._mem.popitem(last=False)
+            self._mem_bytes -= len(old)
+
+    def _drop(self, key: str):
+        entry = self._mem.pop(key, None)
+        if entry is not None:
+            self._mem_bytes -= len(entry[1])
+
+    def stats(self) -> dict:
+        hits = self.hits_memory + self.hits_disk
+        lookups = hits + self.misses
+        out = {
+            'hits': {'memory': self.hits_memory, 'disk': self.hits_disk},
+            'misses': self.misses,
+            'bypassed': self.bypassed,
+            'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+            'memory': {'entries': len(self._mem), 'bytes': self._mem_bytes, 'max_bytes': self.max_bytes},
+        }
+        if self._disk is not None:
+            out['disk'] = self._disk.usage()
+        return out
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+
+response_cache = ResponseCache.from_env()
@@ -0,0 +1,255 @@
+"""
+In-process admission scheduler in front of Ollama.
+
+Every generation takes a slot for its model before calling Ollama. Each model
+has a concurrency cap; callers beyond the cap wait in a priority queue
+(interactive chat is always served before batch copywriting). The queue is
+bounded — when it is full we shed load immediately with a 503 instead of
+letting latency pile up.
+
+With several uvicorn workers the per-model caps are enforced across all of
+them: after local admission a request also takes one of the model's
+cross-worker slots (lock files, see shared_state.CrossWorkerSlots). Priority
+ordering applies within each worker.
+
+Env config:
+    OLLAMA_MAX_CONCURRENCY=2                        default in-flight cap per model
+    OLLAMA_MODEL_CONCURRENCY=qwen3-vl:8b=1,qwen2.5:7b=3   per-model overrides
+    OLLAMA_MAX_QUEUE=32                             max waiters per model
+    OLLAMA_QUEUE_TIMEOUT=30                         max seconds a request may wait
+
+The caps are per Ollama backend: with N backends configured (OLLAMA_URLS) a
+model admits N times as many concurrent generations.
+"""
+import os
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+
+import shared_state
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Priority classes — lower value is served first.
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BATCH: 'batch'}
+
+
+class QueueFull(HTTPException):
+    """Raised when a request is shed because Ollama's queue is saturated."""
+
+    def __init__(self, retry_after: int = 5):
+        super().__init__(
+            status_code=503,
+            detail='AI service is busy. Please try again shortly.',
+            headers={'Retry-After': str(retry_after)},
+        )
+
+
+def _parse_model_limits(spec: str) -> dict:
+    limits = {}
+    for part in (spec or '').split(','):
+        name, sep, value = part.strip().rpartition('=')
+        if not sep or not name:
+            continue
+        try:
+            limits[name] = max(1, int(value))
+        except ValueError:
+            logger.warning(f"Ignoring invalid concurrency setting {part!r}")
+    return limits
+
+
+def _granted(fut) -> bool:
+    return fut.done() and not fut.cancelled() and fut.exception() is None
+
+
+class _Lane:
+    """Per-model state: in-flight count plus a heap of (priority, seq, future) waiters."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.queued = 0
+        self.heap = []
+        self.admitted = {INTERACTIVE: 0, BATCH: 0}
+        self.shed = {INTERACTIVE: 0, BATCH: 0}
+        self.waits = deque(maxlen=1024)  # recent queue-wait samples (seconds)
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class AdmissionScheduler:
+    def __init__(self, default_limit: int = 2, model_limits: dict = None,
+                 max_queue: int = 32, queue_timeout: float = 30.0, cross_worker=None):
+        self.default_limit = max(1, default_limit)
+        self.model_limits = dict(model_limits or {})
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.cross_worker = cross_worker
+        self.scale = 1  # number of Ollama backends sharing the load
+        self._lanes = {}
+        self._seq = itertools.count()
+
+    @classmethod
+    def from_env(cls) -> 'AdmissionScheduler':
+        return cls(
+            default_limit=int(os.environ.get('OLLAMA_MAX_CONCURRENCY', '2')),
+            model_limits=_parse_model_limits(os.environ.get('OLLAMA_MODEL_CONCURRENCY', '')),
+            max_queue=int(os.environ.get('OLLAMA_MAX_QUEUE', '32')),
+            queue_timeout=float(os.environ.get('OLLAMA_QUEUE_TIMEOUT', '30')),
+            cross_worker=shared_state.CrossWorkerSlots(os.path.join(shared_state.STATE_DIR, 'slots'))
+            if shared_state.MULTI_WORKER else None,
+        )
+
+    def _lane(self, model: str) -> _Lane:
+        lane = self._lanes.get(model)
+        if lane is None:
+            lane = self._lanes[model] = _Lane(self.model_limits.get(model, self.default_limit) * self.scale)
+        return lane
+
+    def set_scale(self, backends: int):
+        """Multiply every per-model cap by the number of backends serving it."""
+        self.scale = max(1, backends)
+        for model, lane in self._lanes.items():
+            lane.limit = self.model_limits.get(model, self.default_limit) * self.scale
+
+    def would_shed(self, model: str, priority: int = INTERACTIVE) -> bool:
+        """True if a request arriving now would be rejected outright."""
+        lane = self._lane(model)
+        if lane.active < lane.limit and lane.queued == 0:
+            return False
+        if lane.queued < self.max_queue:
+            return False
+        # A full queue still admits interactive work if there is batch work to evict.
+        return priority != INTERACTIVE or not any(
+            p > priority and not f.done() for p, _, f in lane.heap)
+
+    def _evict_lowest(self, lane: _Lane, priority: int) -> bool:
+        """Make room for `priority` by rejecting the newest lower-priority waiter."""
+        victim = None
+        for entry in lane.heap:
+            if entry[0] > priority and not entry[2].done():
+                if victim is None or entry[:2] > victim[:2]:
+                    victim = entry
+        if victim is None:
+            return False
+        victim[2].set_exception(QueueFull())
+        lane.queued -= 1
+        lane.shed[victim[0]] = lane.shed.get(victim[0], 0) + 1
+        return True
+
+    async def acquire(self, model: str, priority: int = INTERACTIVE) -> float:
+        """Wait for a slot on `model`; returns the seconds spent queued."""
+        lane = self._lane(model)
+        if lane.active < lane.limit and lane.queued == 0:
+            lane.active += 1
+            self._record(lane, priority, 0.0)
+            return 0.0
+
+        if lane.queued >= self.max_queue and not self._evict_lowest(lane, priority):
+            lane.shed[priority] = lane.shed.get(priority, 0) + 1
+            logger.warning(f"Ollama queue full for {model}; shedding {PRIORITY_NAMES.get(priority, priority)} request")
+            raise QueueFull()
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(lane.heap, (priority, next(self._seq), fut))
+        lane.queued += 1
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            # If the slot was handed over just as we timed out, keep it.
+            if not _granted(fut):
+                if not fut.done():
+                    fut.cancel()
+                    lane.queued -= 1
+                lane.shed[priority] = lane.shed.get(priority, 0) + 1
+                raise QueueFull()
+        except asyncio.CancelledError:
+            if _granted(fut):
+                self.release(model)  # granted while we were being cancelled
+            elif not fut.done():
+                fut.cancel()
+                lane.queued -= 1
+            raise
+        waited = time.perf_counter() - start
+        self._record(lane, priority, waited)
+        return waited
+
+    def release(self, model: str):
+        lane = self._lane(model)
+        while lane.heap:
+            _, _, fut = heapq.heappop(lane.heap)
+            if fut.done():
+                continue  # cancelled, timed out or evicted
+            lane.queued -= 1
+            fut.set_result(None)  # hand our slot straight to the next waiter
+            return
+        lane.active = max(0, lane.active - 1)
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: int = INTERACTIVE):
+        waited = await self.acquire(model, priority)
+        try:
+            token = None
+            if self.cross_worker is not None:
+                lane = self._lane(model)
+                deadline = time.monotonic() + max(0.0, self.queue_timeout - waited)
+                start = time.perf_counter()
+                token = await self.cross_worker.acquire(model, lane.limit, deadline)
+                if token is None:
+                    lane.shed[priority] = lane.shed.get(priority, 0) + 1
+                    raise QueueFull()
+                extra = time.perf_counter() - start
+                lane.wait_total += extra
+                lane.wait_max = max(lane.wait_max, waited + extra)
+                waited += extra
+            metrics.OLLAMA_QUEUE_WAIT.labels(model, PRIORITY_NAMES.get(priority, str(priority))).observe(waited)
+            try:
+                yield
+            finally:
+                if token is not None:
+                    self.cross_worker.release(token)
+        finally:
+            self.release(model)
+
+    @staticmethod
+    def _record(lane: _Lane, priority: int, waited: float):
+        lane.admitted[priority] = lane.admitted.get(priority, 0) + 1
+        lane.waits.append(waited)
+        lane.wait_total += waited
+        lane.wait_max = max(lane.wait_max, waited)
+
+    def stats(self) -> dict:
+        out = {}
+        for model, lane in self._lanes.items():
+            samples = sorted(lane.waits)
+            admitted = sum(lane.admitted.values())
+
+            def pct(q):
+                return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 1) if samples else 0.0
+
+            out[model] = {
+                'limit': lane.limit,
+                'active': lane.active,
+                'queued': lane.queued,
+                'admitted': {PRIORITY_NAMES.get(p, p): n for p, n in lane.admitted.items()},
+                'shed': {PRIORITY_NAMES.get(p, p): n for p, n in lane.shed.items()},
+                'queue_wait_ms': {
+                    'mean': round(lane.wait_total / admitted * 1000, 1) if admitted else 0.0,
+                    'p50': pct(0.50),
+                    'p99': pct(0.99),
+                    'max': round(lane.wait_max * 1000, 1),
+                },
+            }
+        return out
+
+
+scheduler = AdmissionScheduler.from_env()
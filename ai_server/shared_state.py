@@ -0,0 +1,197 @@
+"""
+Multi-worker deployment support.
+
+Run several uvicorn workers by setting WEB_CONCURRENCY (uvicorn's own env var
+for --workers, so `uvicorn main:app` in the Dockerfile picks it up too):
+
+    WEB_CONCURRENCY=4 uvicorn main:app --host 0.0.0.0 --port 8000
+
+When more than one worker is configured, state that must be global is shared
+through local mechanisms under AI_SERVER_STATE_DIR (default /tmp/trinibuild-ai):
+
+  * rate limiter       — shared-memory GCRA table (rate_limiter.SharedMemoryBackend)
+  * response cache     — SQLite WAL tier at <state dir>/response_cache.db
+  * Ollama concurrency — one flock'd lock file per slot (CrossWorkerSlots)
+  * batch jobs         — progress snapshots so any worker can answer a poll
+  * metrics            — each worker publishes a stats snapshot; /stats?scope=cluster
+                         returns per-worker figures plus an aggregate, and
+                         /metrics sums every worker's Prometheus samples
+
+Each of these can still be configured explicitly (e.g. RATE_LIMIT_BACKEND,
+RESPONSE_CACHE_PATH); the multi-worker mode only changes the defaults.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+WORKERS = max(1, int(os.environ.get('WEB_CONCURRENCY', '1') or 1))
+MULTI_WORKER = WORKERS > 1
+STATE_DIR = os.environ.get('AI_SERVER_STATE_DIR', os.path.join(tempfile.gettempdir(), 'trinibuild-ai'))
+SNAPSHOT_INTERVAL = float(os.environ.get('WORKER_SNAPSHOT_INTERVAL', '5'))
+
+
+def state_path(*parts: str) -> str:
+    """Path under the shared state dir, creating parent directories as needed."""
+    path = os.path.join(STATE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def deployment_id() -> str:
+    """Identifier shared by all workers of one server: the uvicorn supervisor's pid."""
+    return str(os.getppid()) if MULTI_WORKER else str(os.getpid())
+
+
+class CrossWorkerSlots:
+    """
+    Process-shared counting semaphore built from lock files: slot i of a model is
+    `<state dir>/slots/<model>.<i>.lock`, held with a non-blocking flock. The kernel
+    drops the lock if a worker dies, so slots can never leak.
+    """
+
+    def __init__(self, directory: str, poll_interval: float = 0.02):
+        import fcntl
+        self._fcntl = fcntl
+        self.directory = directory
+        self.poll_interval = poll_interval
+        os.makedirs(directory, exist_ok=True)
+        self._fds = {}  # (model, index) -> fd, opened once per process
+        self._held = set()
+
+    def _fd(self, model: str, index: int) -> int:
+        key = (model, index)
+        fd = self._fds.get(key)
+        if fd is None:
+            safe = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in model)
+            fd = os.open(os.path.join(self.directory, f'{safe}.{index}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+            self._fds[key] = fd
+        return fd
+
+    def try_acquire(self, model: str, limit: int):
+        for index in range(limit):
+            if (model, index) in self._held:
+                continue
+            fd = self._fd(model, index)
+            try:
+                self._fcntl.flock(fd, self._fcntl.LOCK_EX | self._fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            self._held.add((model, index))
+            return (model, index)
+        return None
+
+    async def acquire(self, model: str, limit: int, deadline: float):
+        """Poll for a free slot until `deadline` (time.monotonic()); None on timeout."""
+        delay = self.poll_interval
+        while True:
+            token = self.try_acquire(model, limit)
+            if token is not None or time.monotonic() >= deadline:
+                return token
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, 0.25)
+
+    def release(self, token):
+        if token in self._held:
+            self._held.discard(token)
+            self._fcntl.flock(self._fds[token], self._fcntl.LOCK_UN)
+
+    def close(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+        self._held.clear()
+
+
+# ── Per-worker stats snapshots ───────────────────────────────────────────────
+
+# Figures that describe configuration or a distribution — never summed across workers.
+_NON_ADDITIVE = {
+    'limit', 'max_bytes', 'max_connections', 'max_keepalive', 'max_side',
+    'mean', 'p50', 'p95', 'p99', 'max', 'hit_ratio', 'max_lag_ms', 'stall_threshold_ms',
+}
+
+
+def _workers_dir() -> str:
+    return os.path.join(STATE_DIR, 'workers', deployment_id())
+
+
+def write_snapshot(stats: dict, kind: str = 'stats'):
+    path = state_path('workers', deployment_id(), f'{os.getpid()}.{kind}.json')
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'pid': os.getpid(), 'updated_at': time.time(), 'stats': stats}, f)
+    os.replace(tmp, path)
+
+
+def read_snapshots(max_age: float = None, kind: str = 'stats') -> dict:
+    """pid -> snapshot of `kind` for every worker that published recently."""
+    max_age = max_age if max_age is not None else SNAPSHOT_INTERVAL * 4
+    out = {}
+    directory = _workers_dir()
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return out
+    now = time.time()
+    for name in names:
+        if not name.endswith(f'.{kind}.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if now - snap.get('updated_at', 0) <= max_age:
+            out[str(snap['pid'])] = snap['stats']
+    return out
+
+
+def remove_snapshot(kinds=('stats',)):
+    for kind in kinds:
+        try:
+            os.remove(os.path.join(_workers_dir(), f'{os.getpid()}.{kind}.json'))
+        except FileNotFoundError:
+            pass
+
+
+def aggregate(snapshots: list) -> dict:
+    """Merge worker stats: counters are summed, limits/percentiles take the max."""
+    merged = {}
+    for snap in snapshots:
+        merged = _merge(merged, snap)
+    cache = merged.get('response_cache')
+    if isinstance(cache, dict):
+        hits = sum((cache.get('hits') or {}).values())
+        lookups = hits + cache.get('misses', 0)
+        cache['hit_ratio'] = round(hits / lookups, 4) if lookups else 0.0
+    return merged
+
+
+def _merge(a, b, key: str = None):
+    if isinstance(b, dict):
+        out = dict(a) if isinstance(a, dict) else {}
+        for k, v in b.items():
+            out[k] = _merge(out.get(k), v, k)
+        return out
+    if isinstance(b, bool) or not isinstance(b, (int, float)):
+        return a if a is not None else b
+    if not isinstance(a, (int, float)) or isinstance(a, bool):
+        return b
+    return max(a, b) if key in _NON_ADDITIVE else a + b
+
+
+async def publish_forever(collectors: dict, interval: float = None):
+    """Lifespan task: every `interval` seconds write one snapshot per kind, {kind: collect_fn}."""
+    interval = interval or SNAPSHOT_INTERVAL
+    while True:
+        for kind, collect in collectors.items():
+            try:
+                await asyncio.to_thread(write_snapshot, collect(), kind)
+            except Exception as e:
+                logger.warning(f"Worker {kind} snapshot failed: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,65 @@
+"""
+Single-flight request coalescing.
+
+Concurrent calls with the same key share one upstream call and its result
+(e.g. a merchant double-clicking "analyze photo", or a frontend retry racing
+the original request). The shared call runs in its own task so that the
+leader's client disconnecting does not cancel it for everyone else; it is
+only cancelled once every caller waiting on it has gone away.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def do(self, key: str, fn):
+        """Run `fn()` (a coroutine factory) once per key among concurrent callers."""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _t, key=key, call=call: self._forget(key, call))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Every caller left (client disconnects) — stop the upstream work.
+                self.abandoned += 1
+                self._forget(key, call)
+                call.task.cancel()
+
+    def _forget(self, key: str, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'coalesced': self.coalesced,
+            'abandoned': self.abandoned,
+        }
+
+
+singleflight = SingleFlight()
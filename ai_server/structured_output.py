@@ -0,0 +1,395 @@
+"""
+Structured (JSON) output for the vision and ad-copy endpoints.
+
+Callers pass a JSON schema as Ollama's `format` option, so generation is
+constrained to valid JSON of the right shape, and stream the reply through
+generate():
+
+  * every chunk is fed to a JsonScanner, which tracks brackets and strings as
+    they arrive — as soon as the top-level value closes (or the output breaks,
+    e.g. a mismatched bracket) the stream is closed, which stops generation on
+    the Ollama side. Constrained decoding can otherwise pad the reply with
+    whitespace up to num_predict.
+  * the text is parsed and checked against the schema; minor faults are
+    repaired locally — code fences, prose around the value, trailing commas,
+    Python literals, raw newlines in strings, unbalanced brackets, output cut
+    off at num_predict, "TT$150" for a number, "a, b" for a list of strings.
+  * only output that cannot be repaired is generated again (STRUCTURED_RETRIES
+    times); each retry is counted per endpoint and exported to /metrics.
+
+The schema subset understood here is what the endpoints use: type, properties,
+required, items, minItems, maxItems. format="json" (any object or array) is
+accepted where the caller has no schema, e.g. a client-supplied prompt.
+
+Env config:
+    STRUCTURED_RETRIES=1      regenerations after output that could not be repaired
+    STRUCTURED_EARLY_STOP=1   close the stream once the JSON value is complete
+"""
+import os
+import re
+import json
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+_CLOSERS = {'{': '}', '[': ']'}
+_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null'}
+_NUMBER = re.compile(r'-?\d[\d,]*(?:\.\d+)?')
+_TYPES = {
+    'object': lambda v: isinstance(v, dict),
+    'array': lambda v: isinstance(v, list),
+    'string': lambda v: isinstance(v, str),
+    'number': lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    'integer': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'boolean': lambda v: isinstance(v, bool),
+}
+
+
+class StructuredOutputError(ValueError):
+    """Model output that is not (and could not be repaired into) valid JSON for the schema."""
+
+    def __init__(self, message: str, text: str = ''):
+        super().__init__(message)
+        self.text = text  # the raw output, for callers that fall back to it
+
+
+class JsonScanner:
+    """
+    Incremental structure check over streamed text. Text before the first
+    `{` or `[` (prose, a code fence) is skipped; feed() returns True once the
+    top-level value is complete or the structure is broken (see `error`).
+    """
+    __slots__ = ('_parts', '_stack', '_in_string', '_escape', '_pos', 'start', 'end', 'error')
+
+    def __init__(self):
+        self._parts = []
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._pos = 0
+        self.start = -1
+        self.end = -1
+        self.error = None
+
+    @property
+    def done(self) -> bool:
+        return self.end >= 0 or self.error is not None
+
+    @property
+    def text(self) -> str:
+        return ''.join(self._parts)
+
+    def feed(self, delta: str) -> bool:
+        if self.done:
+            return True
+        self._parts.append(delta)
+        pos = self._pos
+        self._pos += len(delta)
+        stack = self._stack
+        for i, ch in enumerate(delta):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif self.start < 0:
+                if ch in _CLOSERS:
+                    self.start = pos + i
+                    stack.append(_CLOSERS[ch])
+            elif ch == '"':
+                self._in_string = True
+            elif ch in _CLOSERS:
+                stack.append(_CLOSERS[ch])
+            elif ch == '}' or ch == ']':
+                if stack[-1] != ch:
+                    self.error = f'expected {stack[-1]!r} but got {ch!r} at offset {pos + i}'
+                    return True
+                stack.pop()
+                if not stack:
+                    self.end = pos + i + 1
+                    return True
+        return False
+
+
+def strip_code_fences(content: str) -> str:
+    # Strip markdown code fences if model wraps output (e.g. ```json ... ```)
+    stripped = content.strip()
+    if stripped.startswith('```'):
+        lines = stripped.split('\n')
+        # Remove first line (```json or ```) and last line (```)
+        inner = lines[1:] if len(lines) > 1 else lines
+        if inner and inner[-1].strip() == '```':
+            inner = inner[:-1]
+        content = '\n'.join(inner).strip()
+    return content
+
+
+def _mend(text: str):
+    """
+    Rewrite almost-JSON: trailing commas, Python literals, raw control characters
+    in strings, mismatched or missing closers. Returns (candidates, fixes); the
+    candidates end progressively earlier, for output that was cut off mid-element.
+    """
+    out, stack, fixes = [], [], set()
+    cuts = []  # (length of out, closers still open) at each comma outside a string
+    in_string = escape = False
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+            elif ch < ' ':
+                out.append(json.dumps(ch)[1:-1])
+                fixes.add('control characters')
+                i += 1
+                continue
+            out.append(ch)
+        elif ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+            out.append(ch)
+        elif ch == '}' or ch == ']':
+            j = len(out) - 1
+            while j >= 0 and out[j].isspace():
+                j -= 1
+            if j >= 0 and out[j] == ',':
+                del out[j]
+                fixes.add('trailing comma')
+            if ch not in stack:
+                fixes.add('stray closer')
+                i += 1
+                continue
+            while stack[-1] != ch:
+                out.append(stack.pop())
+                fixes.add('unbalanced brackets')
+            out.append(stack.pop())
+            if not stack:
+                break
+        elif ch.isalpha():
+            j = i
+            while j < n and text[j].isalpha():
+                j += 1
+            word = text[i:j]
+            if word in _LITERALS:
+                word = _LITERALS[word]
+                fixes.add('python literals')
+            out.append(word)
+            i = j
+            continue
+        else:
+            if ch == ',':
+                cuts.append((len(out), ''.join(reversed(stack))))
+            out.append(ch)
+        i += 1
+
+    if in_string:
+        out.append('"')
+        fixes.add('unterminated string')
+    if not stack:
+        return [''.join(out)], fixes
+    fixes.add('truncated')
+    body = ''.join(out).rstrip()
+    candidates = [body.rstrip(',') + ''.join(reversed(stack))]
+    for length, closers in reversed(cuts[-8:]):  # drop the incomplete trailing element(s)
+        candidates.append(''.join(out[:length]) + closers)
+    return candidates, fixes
+
+
+def coerce(value, schema, path: str = '$'):
+    """Nudge near-misses into the schema's types; returns (value, fixes)."""
+    if not isinstance(schema, dict):
+        return value, []
+    kind, fixes = schema.get('type'), []
+    if kind == 'object':
+        props = schema.get('properties') or {}
+        if isinstance(value, list):
+            arrays = [k for k in schema.get('required', ()) if (props.get(k) or {}).get('type') == 'array']
+            if len(arrays) == 1:
+                value = {arrays[0]: value}
+                fixes.append(f'{path}: wrapped bare array')
+        if isinstance(value, dict):
+            for key, sub in props.items():
+                if key in value:
+                    value[key], more = coerce(value[key], sub, f'{path}.{key}')
+                    fixes.extend(more)
+    elif kind == 'array':
+        items = schema.get('items') or {}
+        if isinstance(value, str) and items.get('type') == 'string':
+            value = [part.strip() for part in value.split(',') if part.strip()]
+            fixes.append(f'{path}: split string into list')
+        elif isinstance(value, dict) and len(value) == 1 and isinstance(next(iter(value.values())), list):
+            value = next(iter(value.values()))
+            fixes.append(f'{path}: unwrapped object')
+        if isinstance(value, list):
+            if len(value) > schema.get('maxItems', len(value)):
+                del value[schema['maxItems']:]
+                fixes.append(f'{path}: dropped items past maxItems')
+            for i, item in enumerate(value):
+                value[i], more = coerce(item, items, f'{path}[{i}]')
+                fixes.extend(more)
+    elif kind in ('number', 'integer'):
+        if isinstance(value, str):
+            match = _NUMBER.search(value)
+            if match:
+                number = float(match.group().replace(',', ''))
+                value = int(number) if kind == 'integer' or number.is_integer() else number
+                fixes.append(f'{path}: parsed number from string')
+    elif kind == 'string':
+        if _TYPES['number'](value):
+            value = str(value)
+            fixes.append(f'{path}: number to string')
+    return value, fixes
+
+
+def validate(value, schema, path: str = '$') -> list:
+    """Schema violations (empty if valid); format="json" accepts any object or array."""
+    if not isinstance(schema, dict):
+        return [] if isinstance(value, (dict, list)) else [f'{path}: expected an object or array']
+    kind = schema.get('type')
+    if kind and not _TYPES[kind](value):
+        return [f'{path}: expected {kind}, got {type(value).__name__}']
+    errors = []
+    if kind == 'object':
+        for key in schema.get('required', ()):
+            if key not in value:
+                errors.append(f'{path}: missing {key!r}')
+        for key, sub in (schema.get('properties') or {}).items():
+            if key in value:
+                errors.extend(validate(value[key], sub, f'{path}.{key}'))
+    elif kind == 'array':
+        if len(value) < schema.get('minItems', 0):
+            errors.append(f'{path}: fewer than {schema["minItems"]} items')
+        if len(value) > schema.get('maxItems', len(value)):
+            errors.append(f'{path}: more than {schema["maxItems"]} items')
+        for i, item in enumerate(value):
+            errors.extend(validate(item, schema.get('items') or {}, f'{path}[{i}]'))
+    return errors
+
+
+def parse(text: str, schema):
+    """
+    (value, fixes) for model output `text`; fixes lists the local repairs that
+    were needed (empty for clean output). Raises StructuredOutputError.
+    """
+    fixes, first_errors = [], None
+    body = strip_code_fences(text)
+    if body != text.strip():
+        fixes.append('code fences')
+    scanner = JsonScanner()
+    scanner.feed(body)
+    if scanner.start < 0:
+        raise StructuredOutputError('no JSON object or array in the output', text)
+    if body[:scanner.start].strip():
+        fixes.append('text before the value')
+    if scanner.end >= 0:
+        candidate = body[scanner.start:scanner.end]
+        if body[scanner.end:].strip():
+            fixes.append('text after the value')
+    else:
+        candidate = body[scanner.start:]
+
+    try:
+        candidates, mended = [json.loads(candidate)], ()
+    except ValueError as e:
+        texts, mended = _mend(candidate)
+        candidates = []
+        for attempt in texts:
+            try:
+                candidates.append(json.loads(attempt))
+            except ValueError:
+                continue
+        if not candidates:
+            raise StructuredOutputError(f'unparseable JSON: {e}', text)
+        fixes.extend(sorted(mended))
+
+    # Output cut off mid-element may only validate once that element is dropped.
+    for value in candidates:
+        value, coerced = coerce(value, schema)
+        errors = validate(value, schema)
+        if not errors:
+            return value, fixes + coerced
+        if first_errors is None:
+            first_errors = errors
+    raise StructuredOutputError('; '.join(first_errors[:3]), text)
+
+
+class StructuredOutput:
+    def __init__(self, retries: int = 1, early_stop: bool = True):
+        self.retries = retries
+        self.early_stop = early_stop
+        # endpoint -> {valid, repaired, invalid, retried, failed, early_stops, aborted}
+        self.counts = defaultdict(lambda: dict.fromkeys(
+            ('valid', 'repaired', 'invalid', 'retried', 'failed', 'early_stops', 'aborted'), 0))
+
+    @classmethod
+    def from_env(cls) -> 'StructuredOutput':
+        return cls(
+            retries=max(int(os.environ.get('STRUCTURED_RETRIES', '1')), 0),
+            early_stop=os.environ.get('STRUCTURED_EARLY_STOP', '1').lower() not in ('0', 'false', 'no'),
+        )
+
+    async def collect(self, deltas, endpoint: str) -> str:
+        """
+        Read content deltas (an async generator) until the JSON value is complete
+        or broken, then close the generator — which closes the upstream stream.
+        The rest of the delta that completed the value is dropped, so a clean
+        value is not counted as a repair for trailing text never asked for.
+        """
+        scanner = JsonScanner()
+        parts = []
+        try:
+            async for delta in deltas:
+                parts.append(delta)
+                if scanner.feed(delta) and self.early_stop:
+                    self.counts[endpoint]['aborted' if scanner.error else 'early_stops'] += 1
+                    if scanner.end >= 0:
+                        return scanner.text[:scanner.end]
+                    break
+        finally:
+            await deltas.aclose()
+        return ''.join(parts)
+
+    async def generate(self, endpoint: str, schema, produce):
+        """
+        Parse and validate the output of `produce()` (a factory for an async
+        generator of content deltas), generating again only when the output
+        cannot be repaired. Returns the value; raises StructuredOutputError once
+        the retries are spent. Upstream errors propagate unchanged.
+        """
+        counts = self.counts[endpoint]
+        for attempt in range(self.retries + 1):
+            if attempt:
+                counts['retried'] += 1
+            text = await self.collect(produce(), endpoint)
+            try:
+                value, fixes = parse(text, schema)
+            except StructuredOutputError as e:
+                counts['invalid'] += 1
+                logger.warning(f"Malformed {endpoint} output (attempt {attempt + 1}): {e}")
+                error = e
+                continue
+            if fixes:
+                counts['repaired'] += 1
+                logger.info(f"Repaired {endpoint} output locally: {', '.join(fixes)}")
+            else:
+                counts['valid'] += 1
+            return value
+        counts['failed'] += 1
+        raise error
+
+    def stats(self) -> dict:
+        return {'retries': self.retries, 'early_stop': self.early_stop,
+                'endpoints': {name: dict(c) for name, c in self.counts.items()}}
+
+
+structured_output = StructuredOutput.from_env()
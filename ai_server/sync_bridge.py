@@ -0,0 +1,97 @@
+"""
+Blocking facade over the async Ollama client, for scripts, cron jobs and
+worker threads.
+
+The async functions in main.py (ollama_chat, ollama_vision, ...) are the one
+implementation. Sync callers go through `sync_bridge.run(fn, *args)`, which
+submits the coroutine to a long-lived event loop and waits for the result:
+
+  * inside the server (e.g. from a thread-pool endpoint) it runs on the app's
+    own loop, attached by the lifespan, so it shares the connection pools,
+    the scheduler's queues and the response cache with async callers;
+  * in a plain script it runs on one background loop thread, started on first
+    use and reused for every call, so there is no per-call loop startup and
+    keep-alive connections survive between calls.
+
+Calling it from the event loop thread itself would block the loop on its own
+work and deadlock, so that raises RuntimeError — await the async API there.
+"""
+import atexit
+import asyncio
+import logging
+import threading
+import concurrent.futures
+
+from http_pool import http_pool
+
+logger = logging.getLogger(__name__)
+
+
+class SyncBridge:
+    def __init__(self):
+        self._app_loop = None
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """Run sync calls on the app's loop (call from the lifespan)."""
+        self._app_loop = loop
+
+    def detach(self):
+        self._app_loop = None
+
+    def _background_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='sync-bridge', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+            return self._loop
+
+    def _target_loop(self) -> asyncio.AbstractEventLoop:
+        app_loop = self._app_loop
+        if app_loop is not None and app_loop.is_running():
+            return app_loop
+        return self._background_loop()
+
+    def run(self, fn, *args, timeout: float = None, **kwargs):
+        """Call async `fn(*args, **kwargs)` from synchronous code and return its result."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError(f'{getattr(fn, "__name__", fn)}: sync facade called from a running event loop; '
+                               'await the async function instead')
+        future = asyncio.run_coroutine_threadsafe(fn(*args, **kwargs), self._target_loop())
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def close(self):
+        """Close the background loop's connection pools and stop its thread."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(http_pool.aclose(), loop).result(5)
+        except Exception as e:
+            logger.warning(f"Error closing sync bridge pools: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        loop.close()
+
+    def stats(self) -> dict:
+        return {
+            'attached_to_app_loop': self._app_loop is not None,
+            'background_loop': self._loop is not None,
+        }
+
+
+sync_bridge = SyncBridge()
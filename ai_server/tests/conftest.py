@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The server's modules are imported top-level (as uvicorn runs main.py from ai_server/).
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from batch_jobs import JobStore, JobsBusy
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_refuses_jobs_past_max_running():
+    async def scenario():
+        store, release = JobStore(max_running=2), asyncio.Event()
+
+        async def worker(item):
+            await release.wait()
+            return {'item': item}
+
+        first = store.start('test', [1, 2], worker, 2)
+        store.start('test', [3], worker, 1)
+        with pytest.raises(JobsBusy) as excinfo:
+            store.start('test', [4], worker, 1)
+        assert excinfo.value.status_code == 503 and 'Retry-After' in excinfo.value.headers
+        assert store.stats()['refused'] == 1
+
+        release.set()
+        await first.task
+        await asyncio.sleep(0)
+        store.start('test', [5], worker, 1)  # a finished job frees its place
+        assert store.stats()['running'] <= 2
+        await store.aclose()
+
+    _run(scenario())
+
+
+def test_job_results_and_snapshot(tmp_path):
+    async def scenario():
+        store = JobStore(persist_dir=str(tmp_path))
+
+        async def worker(item):
+            if item == 'bad':
+                raise ValueError('bad item')
+            return {'item': item}
+
+        job = store.start('test', ['a', 'bad'], worker, 2)
+        await job.task
+        await asyncio.sleep(0.05)
+        summary = job.summary()
+        assert summary['status'] == 'done' and summary['completed'] == 2 and summary['failed'] == 1
+        assert (tmp_path / f'{job.id}.json').exists()
+        assert store.get(job.id) is job
+
+    _run(scenario())
+
+
+def test_sweep_removes_expired_snapshots(tmp_path):
+    store = JobStore(ttl=60, persist_dir=str(tmp_path))
+    old, fresh = tmp_path / 'old.json', tmp_path / 'fresh.json'
+    old.write_text('{}')
+    fresh.write_text('{}')
+    expired = time.time() - 120
+    os.utime(old, (expired, expired))
+    assert store._sweep_files() == 1
+    assert not old.exists() and fresh.exists()
+
+
+def test_sweep_without_directory(tmp_path):
+    assert JobStore(persist_dir=str(tmp_path / 'missing'))._sweep_files() == 0
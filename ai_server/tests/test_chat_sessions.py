@@ -0,0 +1,166 @@
+import asyncio
+
+import chat_sessions
+from chat_sessions import SessionStore
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def _text(words: int) -> str:
+    return ' '.join(f'word{i}' for i in range(words))
+
+
+async def _drain(store):
+    while store._tasks:
+        await asyncio.gather(*list(store._tasks))
+
+
+def test_resume_by_id():
+    async def scenario():
+        store = SessionStore()
+        session = store.new('support')
+
+        async def summarize(summary, turns):
+            raise AssertionError('no fold under budget')
+
+        await store.record_turn(session, 'hi', 'hello', summarize)
+        resumed = await store.get(session.id)
+        assert resumed.turns == [['user', 'hi'], ['assistant', 'hello']]
+        assert await store.get('unknown') is None
+        assert store.stats()['resumed'] == 1 and store.stats()['expired'] == 1
+
+    _run(scenario())
+
+
+def test_fold_after_budget_keeps_recent_turns():
+    async def scenario():
+        store, calls = SessionStore(token_budget=100, keep_turns=2), []
+        session = store.new('support')
+
+        async def summarize(summary, turns):
+            calls.append([content for _, content in turns])
+            return 'they asked about products'
+
+        for i in range(3):
+            await store.record_turn(session, f'question {i} ' + _text(20), f'answer {i}', summarize)
+        await _drain(store)
+        folded = await store.get(session.id)
+        assert len(calls) == 1
+        assert folded.summary == 'they asked about products'
+        assert [content for _, content in folded.turns] == ['question 2 ' + _text(20), 'answer 2']
+        assert folded.folded == 4 and not folded.fold_started
+        assert store.stats()['folds'] == 1
+        assert 'they asked about products' in folded.messages('persona')[0]['content']
+
+    _run(scenario())
+
+
+def test_no_fold_under_budget_or_within_keep_turns():
+    async def scenario():
+        store = SessionStore(token_budget=10, keep_turns=4)
+        session = store.new('support')
+
+        async def summarize(summary, turns):
+            raise AssertionError('must not fold')
+
+        await store.record_turn(session, _text(30), _text(30), summarize)  # over budget, 2 <= keep_turns
+        await _drain(store)
+        assert store.stats()['folds'] == 0
+
+    _run(scenario())
+
+
+def test_turns_added_during_fold_are_kept_and_fold_not_repeated():
+    async def scenario():
+        store, release, calls = SessionStore(token_budget=50, keep_turns=2), asyncio.Event(), []
+        session = store.new('support')
+
+        async def summarize(summary, turns):
+            calls.append(len(turns))
+            await release.wait()
+            return 'summary'
+
+        await store.record_turn(session, _text(30), 'a1', summarize)
+        await store.record_turn(session, _text(30), 'a2', summarize)
+        await asyncio.sleep(0)
+        assert len(calls) == 1
+        # A turn arriving mid-fold is over budget too, but the fold in progress is not started again.
+        await store.record_turn(session, _text(30), 'a3', summarize)
+        await asyncio.sleep(0)
+        assert len(calls) == 1
+        release.set()
+        await _drain(store)
+        current = await store.get(session.id)
+        assert current.summary == 'summary' and current.folded == 2
+        assert [content for _, content in current.turns][-1] == 'a3'
+        assert len(current.turns) == 4
+
+    _run(scenario())
+
+
+def test_concurrent_fold_result_not_applied_twice():
+    async def scenario():
+        store = SessionStore(token_budget=50, keep_turns=2)
+        session = store.new('support')
+
+        async def no_fold(summary, turns):
+            raise AssertionError('unused')
+
+        store._maybe_fold = lambda *_: None
+        for i in range(2):
+            await store.record_turn(session, _text(30), f'a{i}', no_fold)
+
+        gate = asyncio.Event()
+
+        async def slow(summary, turns):
+            await gate.wait()
+            return 'first'
+
+        first = asyncio.ensure_future(store._fold(session.id, slow))
+        await asyncio.sleep(0.01)
+        # Another worker's stale fold finishing after this one must not cut turns again.
+        stale = await store.get(session.id)
+        stale.fold_started = 0.0
+        await store.put(stale)
+
+        async def fast(summary, turns):
+            return 'second'
+
+        await store._fold(session.id, fast)
+        gate.set()
+        await first
+        current = await store.get(session.id)
+        assert current.folded == 2
+        assert current.summary == 'second'
+        assert len(current.turns) == 2
+
+    _run(scenario())
+
+
+def test_failing_summaries_drop_oldest_turns_past_twice_the_budget():
+    async def scenario():
+        store = SessionStore(token_budget=40, keep_turns=2)
+        session = store.new('support')
+
+        async def failing(summary, turns):
+            raise RuntimeError('model down')
+
+        await store.record_turn(session, _text(15), 'a0', failing)
+        await store.record_turn(session, _text(15), 'a1', failing)
+        await _drain(store)
+        kept = await store.get(session.id)
+        # Over budget but under twice the budget: nothing is lost yet.
+        assert len(kept.turns) == 4 and kept.folded == 0
+        assert store.stats()['fold_failures'] == 1
+
+        for i in range(2, 5):
+            await store.record_turn(session, _text(15), f'a{i}', failing)
+            await _drain(store)
+        trimmed = await store.get(session.id)
+        assert trimmed.folded > 0 and trimmed.summary == ''
+        assert trimmed.turns[-1] == ['assistant', 'a4']
+        assert trimmed.history_tokens() <= 2 * store.token_budget + chat_sessions.estimate(_text(15))
+
+    _run(scenario())
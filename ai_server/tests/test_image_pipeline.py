@@ -0,0 +1,97 @@
+import io
+import base64
+import asyncio
+
+import httpx
+import pytest
+
+import image_pipeline
+from http_pool import http_pool
+from image_pipeline import ImageTooLarge, ImageUnreadable, prepare_image
+
+pillow = pytest.mark.skipif(image_pipeline.Image is None, reason='Pillow not installed')
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(image_pipeline, 'processed_cache', image_pipeline._ProcessedCache(1024 * 1024))
+
+
+def _jpeg(size=(2000, 1500)) -> bytes:
+    out = io.BytesIO()
+    image_pipeline.Image.new('RGB', size, (200, 30, 30)).save(out, format='JPEG')
+    return out.getvalue()
+
+
+class _Chunks(httpx.AsyncByteStream):
+    """A body sent in chunks with no Content-Length."""
+
+    def __init__(self, data: bytes, size: int = 1024):
+        self.data, self.size = data, size
+
+    async def __aiter__(self):
+        for i in range(0, len(self.data), self.size):
+            yield self.data[i:i + self.size]
+
+
+async def _prepare(body, url='https://cdn.test/photo.jpg', headers=None):
+    """prepare_image against a mock image host; returns (base64, timings, details)."""
+    def handler(request):
+        if isinstance(body, httpx.AsyncByteStream):
+            return httpx.Response(200, stream=body, headers=headers)
+        return httpx.Response(200, content=body, headers=headers)
+
+    http_pool._clients['image'] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    timings, details = {}, {}
+    try:
+        encoded = await prepare_image(url, timings, details)
+    finally:
+        await http_pool.aclose()
+    return encoded, timings, details
+
+
+def test_declared_size_over_the_cap_is_refused(monkeypatch):
+    monkeypatch.setattr(image_pipeline, 'IMAGE_MAX_BYTES', 1000)
+    with pytest.raises(ImageTooLarge) as excinfo:
+        _run(_prepare(b'x' * 500, headers={'content-length': '5000'}))
+    assert excinfo.value.status_code == 413
+
+
+def test_streamed_body_over_the_cap_is_refused(monkeypatch):
+    monkeypatch.setattr(image_pipeline, 'IMAGE_MAX_BYTES', 1000)
+    with pytest.raises(ImageTooLarge):
+        _run(_prepare(_Chunks(b'x' * 5000, size=300)))
+
+
+@pillow
+def test_undecodable_bytes_are_unreadable():
+    with pytest.raises(ImageUnreadable) as excinfo:
+        _run(_prepare(b'<html>not an image</html>'))
+    assert excinfo.value.status_code == 422
+
+
+@pillow
+def test_large_photo_is_downsized_and_timed():
+    raw = _jpeg()
+    encoded, timings, details = _run(_prepare(raw))
+    image = image_pipeline.Image.open(io.BytesIO(base64.b64decode(encoded)))
+    assert max(image.size) == image_pipeline.VISION_MAX_SIDE and image.format == 'JPEG'
+    assert set(timings) == {'fetch_ms', 'decode_ms', 'resize_ms', 'encode_ms'}
+    assert all(isinstance(v, float) for v in timings.values())
+    assert details == {'original_bytes': len(raw), 'cache_hit': False}
+
+
+@pillow
+def test_same_image_is_served_from_the_processed_cache():
+    raw = _jpeg()
+    first, _, _ = _run(_prepare(raw, url='https://cdn.test/a.jpg'))
+    # Same bytes under another URL: keyed by content, so no decode at all.
+    second, timings, details = _run(_prepare(raw, url='https://cdn.test/b.jpg'))
+    assert second == first
+    assert set(timings) == {'fetch_ms'}
+    assert details == {'original_bytes': len(raw), 'cache_hit': True}
+    assert image_pipeline.processed_cache.hits == 1 and image_pipeline.processed_cache.misses == 1
@@ -0,0 +1,220 @@
+import json
+import time
+import asyncio
+
+import httpx
+import pytest
+
+from http_pool import http_pool
+from meta_graph import MetaGraph, MetaError, MetaThrottled
+
+BASE = 'https://graph.test/v21.0'
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def _serve(handler):
+    """Route the shared 'meta' client (for the running loop) through `handler`."""
+    http_pool._clients['meta'] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def _graph(**kwargs):
+    return MetaGraph(BASE, **kwargs)
+
+
+def _age(graph, seconds):
+    """Pretend every cached entry was fetched `seconds` ago."""
+    for key, (fetched_at, value) in list(graph._cache.items()):
+        graph._cache[key] = (fetched_at - seconds, value)
+
+
+class _Loader:
+    """A load() whose calls return 'v1', 'v2', ...; `gate` holds them until set."""
+
+    def __init__(self):
+        self.calls = 0
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def __call__(self):
+        self.calls += 1
+        value = f'v{self.calls}'
+        await self.gate.wait()
+        return value
+
+
+# ── Usage-aware backoff ──────────────────────────────────────────────────────
+
+def test_usage_header_over_threshold_starts_a_backoff():
+    async def scenario():
+        graph = _graph(usage_throttle=90, backoff_base=60)
+        usage = {'x-app-usage': json.dumps({'call_count': 95, 'total_time': 10, 'total_cputime': 5})}
+        _serve(lambda request: httpx.Response(200, json={'id': '1'}, headers=usage))
+        assert await graph.request('GET', 'me') == {'id': '1'}
+        assert graph.usage == 95
+        with pytest.raises(MetaThrottled) as excinfo:
+            await graph.request('GET', 'me')
+        assert 59 < excinfo.value.retry_after <= 60 and excinfo.value.status == 429
+        assert graph.calls == 1 and graph.throttled == 1
+        await http_pool.aclose()
+
+    _run(scenario())
+
+
+def test_backoff_doubles_and_honours_regain_time():
+    async def scenario():
+        graph = _graph(backoff_base=60)
+        business = {'123': [{'type': 'ads_management', 'call_count': 100, 'estimated_time_to_regain_access': 30}]}
+        responses = [
+            httpx.Response(400, json={'error': {'message': 'User request limit reached', 'code': 17}}),
+            httpx.Response(400, json={'error': {'message': 'User request limit reached', 'code': 17}}),
+            httpx.Response(200, json={}, headers={'x-business-use-case-usage': json.dumps(business)}),
+            httpx.Response(200, json={}, headers={'x-app-usage': json.dumps({'call_count': 10})}),
+        ]
+        _serve(lambda request: responses.pop(0))
+        waits = []
+        for _ in range(4):
+            try:
+                await graph.request('GET', 'me')
+            except MetaThrottled:
+                raise
+            except MetaError as e:
+                assert e.code == 17
+            waits.append(graph._blocked_until - time.monotonic())
+            graph._blocked_until = 0.0  # let the next call through
+        # 60 s, then 120 s; then the header's 30 minutes beat the 240 s backoff.
+        assert 59 < waits[0] <= 60 and 119 < waits[1] <= 120 and 1799 < waits[2] <= 1800
+        assert waits[3] <= 0 and graph._strikes == 0  # a healthy answer resets the backoff
+        await http_pool.aclose()
+
+    _run(scenario())
+
+
+# ── Cache ────────────────────────────────────────────────────────────────────
+
+def test_fresh_then_stale_while_revalidate():
+    async def scenario():
+        graph, load = _graph(ttl=60, stale=900), _Loader()
+        assert await graph.cached('k', load, scope='act_1') == 'v1'
+        assert await graph.cached('k', load, scope='act_1') == 'v1' and graph.hits == 1
+        _age(graph, 120)
+        assert await graph.cached('k', load, scope='act_1') == 'v1'  # stale, refreshed in the background
+        await asyncio.sleep(0)
+        assert await graph.cached('k', load, scope='act_1') == 'v2'
+        assert graph.stale_hits == 1 and graph.refreshes == 1 and load.calls == 2
+
+    _run(scenario())
+
+
+def test_stale_entries_are_served_whatever_their_age_while_throttled():
+    async def scenario():
+        graph, load = _graph(ttl=60, stale=900), _Loader()
+        await graph.cached('k', load, scope='act_1')
+        _age(graph, 10_000)  # past ttl + stale
+        graph._blocked_until = time.monotonic() + 60
+        assert await graph.cached('k', load, scope='act_1') == 'v1'
+        assert graph.refreshes == 0 and load.calls == 1  # no refresh while backing off
+
+        async def throttled_load():
+            return await graph.request('GET', 'act_2/campaigns')
+
+        with pytest.raises(MetaThrottled):
+            await graph.cached('other', throttled_load, scope='act_2')  # uncached: fail fast
+
+    _run(scenario())
+
+
+def test_invalidate_drops_only_its_scope():
+    async def scenario():
+        graph, load = _graph(), _Loader()
+        await graph.cached('k', load, scope='act_1')
+        await graph.cached('k', load, scope='act_2')
+        graph.invalidate('act_1')
+        assert await graph.cached('k', load, scope='act_1') == 'v3'
+        assert await graph.cached('k', load, scope='act_2') == 'v2'
+
+    _run(scenario())
+
+
+def test_refresh_in_flight_at_invalidate_is_not_cached():
+    async def scenario():
+        graph, load = _graph(ttl=60, stale=900), _Loader()
+        await graph.cached('k', load, scope='act_1')
+        _age(graph, 120)
+        load.gate.clear()
+        assert await graph.cached('k', load, scope='act_1') == 'v1'  # starts a refresh (pre-write read)
+        await asyncio.sleep(0)
+        graph.invalidate('act_1')  # the write lands
+        load.gate.set()
+        await asyncio.sleep(0.01)
+        assert graph._refreshing == {}
+        assert await graph.cached('k', load, scope='act_1') == 'v3'  # a fresh read, not v2
+        assert graph.misses == 2
+
+    _run(scenario())
+
+
+def test_load_in_flight_at_invalidate_is_not_cached():
+    async def scenario():
+        graph, load = _graph(), _Loader()
+        load.gate.clear()
+        before_write = asyncio.ensure_future(graph.cached('k', load, scope='act_1'))
+        await asyncio.sleep(0)
+        graph.invalidate('act_1')
+        after_write = asyncio.ensure_future(graph.cached('k', load, scope='act_1'))  # must not join the old call
+        await asyncio.sleep(0)
+        load.gate.set()
+        assert await before_write == 'v1' and await after_write == 'v2'
+        assert await graph.cached('k', load, scope='act_1') == 'v2'
+
+    _run(scenario())
+
+
+# ── Batch ────────────────────────────────────────────────────────────────────
+
+def test_batch_maps_each_answer_to_its_request():
+    async def scenario():
+        graph = _graph()
+        sent = {}
+
+        def handler(request):
+            form = dict(httpx.QueryParams(request.content.decode()))
+            sent.update(form)
+            return httpx.Response(200, json=[
+                {'code': 200, 'body': json.dumps({'data': [{'id': 'c1'}]})},
+                {'code': 400, 'body': json.dumps({'error': {'message': 'Invalid field', 'code': 100}})},
+                None,
+                {'code': 200, 'body': json.dumps({'error': {'message': 'Hidden failure', 'code': 1}})},
+            ])
+
+        _serve(handler)
+        results = await graph.batch([
+            ('act_1/campaigns', {'fields': 'id,name'}),
+            ('act_1/insights', {'fields': 'nope'}),
+            ('act_1/adsets', None),
+            ('act_1/ads', {}),
+        ], token='tok')
+        assert results[0] == {'data': [{'id': 'c1'}]}
+        assert isinstance(results[1], MetaError) and results[1].code == 100 and results[1].status == 400
+        assert isinstance(results[2], MetaError) and 'timed out' in str(results[2])
+        assert isinstance(results[3], MetaError) and str(results[3]) == 'Hidden failure'
+        assert sent['access_token'] == 'tok'
+        assert [b['relative_url'] for b in json.loads(sent['batch'])] == [
+            'act_1/campaigns?fields=id%2Cname', 'act_1/insights?fields=nope', 'act_1/adsets', 'act_1/ads']
+        assert graph.batch_calls == 1 and graph.calls == 1
+        await http_pool.aclose()
+
+    _run(scenario())
+
+
+def test_batch_with_missing_answers_is_rejected():
+    async def scenario():
+        graph = _graph()
+        _serve(lambda request: httpx.Response(200, json=[{'code': 200, 'body': '{}'}]))
+        with pytest.raises(MetaError, match='Malformed'):
+            await graph.batch([('a', None), ('b', None)], token='tok')
+        await http_pool.aclose()
+
+    _run(scenario())
@@ -0,0 +1,45 @@
+import pytest
+
+import metrics
+
+
+def _family(kind, samples):
+    return {'type': kind, 'help': 'h', 'samples': samples}
+
+
+def test_merge_sums_counters_and_histograms():
+    a = {'c': _family('counter', {'c{route="/x"}': 3}), 'h': _family('histogram', {'h_count': 2, 'h_sum': 0.5})}
+    b = {'c': _family('counter', {'c{route="/x"}': 4}), 'h': _family('histogram', {'h_count': 1, 'h_sum': 0.25})}
+    merged = metrics.merge({'101': a, '102': b})
+    assert merged['c']['samples'] == {'c{route="/x"}': 7}
+    assert merged['h']['samples'] == {'h_count': 3, 'h_sum': 0.75}
+
+
+def test_merge_labels_gauges_by_worker():
+    a = {'g': _family('gauge', {'g{route="/x"}': 2, 'g': 9})}
+    b = {'g': _family('gauge', {'g{route="/x"}': 5, 'g': 9})}
+    merged = metrics.merge({'101': a, '102': b})
+    assert merged['g']['samples'] == {
+        'g{route="/x",worker="101"}': 2, 'g{worker="101"}': 9,
+        'g{route="/x",worker="102"}': 5, 'g{worker="102"}': 9,
+    }
+    assert 'g{worker="102"} 9' in metrics.render(merged)
+
+
+def test_registry_snapshot_renders():
+    registry = metrics.Registry()
+    counter = registry.counter('t_total', 'Test counter.', ('kind',))
+    gauge = registry.gauge('t_in_flight', 'Test gauge.')
+    histogram = registry.histogram('t_seconds', 'Test histogram.', buckets=(0.1, 1.0))
+    counter.labels('a').inc(2)
+    gauge.inc()
+    histogram.observe(0.5)
+    text = metrics.render(registry.snapshot())
+    assert 't_total{kind="a"} 2' in text
+    assert 't_in_flight 1' in text
+    assert 't_seconds_bucket{le="0.1"} 0' in text and 't_seconds_bucket{le="+Inf"} 1' in text
+
+
+def test_metric_base_is_abstract():
+    with pytest.raises(TypeError):
+        metrics._Metric('t', 'Test.')
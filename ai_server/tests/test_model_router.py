@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+import main
+from model_router import ModelRouter
+
+DEFAULT, SMALL = 'qwen2.5:7b', 'llama3.2:3b'
+GOOD = ('To add a product, open your store dashboard, choose Products, then Add product. '
+        'Fill in the title, price and photos, and press Publish when you are ready to sell.')
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def _router(**kwargs):
+    kwargs.setdefault('hold_chars', 40)
+    return ModelRouter(DEFAULT, SMALL, **kwargs)
+
+
+# ── route() ──────────────────────────────────────────────────────────────────
+
+def test_routing_is_off_unless_enabled(monkeypatch):
+    monkeypatch.delenv('MODEL_ROUTING', raising=False)
+    assert not ModelRouter.from_env(DEFAULT).enabled
+    monkeypatch.setenv('MODEL_ROUTING', '0')
+    router = ModelRouter.from_env(DEFAULT)
+    route = router.route('chatbot', 'support_bot', input_tokens=5, prompt_tokens=100)
+    assert not route.small and route.model == DEFAULT and route.reason == 'disabled'
+    monkeypatch.setenv('MODEL_ROUTING', '1')
+    assert ModelRouter.from_env(DEFAULT).enabled
+    assert not ModelRouter(DEFAULT, DEFAULT).enabled  # nothing smaller to route to
+
+
+@pytest.mark.parametrize('endpoint, kind, input_tokens, prompt_tokens, custom, reason', [
+    ('chatbot', 'support_bot', 5, 100, False, 'easy'),
+    ('island_chat', 'onboarding', 5, 100, False, 'easy'),
+    ('chatbot', 'sales_agent', 5, 100, False, 'kind'),
+    ('island_chat', 'business', 5, 100, False, 'kind'),
+    ('chatbot', 'support_bot', 5, 100, True, 'custom_prompt'),
+    ('chatbot', 'support_bot', 49, 100, False, 'long_input'),
+    ('chatbot', 'support_bot', 5, 1501, False, 'long_prompt'),
+])
+def test_route_reasons(endpoint, kind, input_tokens, prompt_tokens, custom, reason):
+    router = _router()
+    route = router.route(endpoint, kind, input_tokens, prompt_tokens, custom)
+    assert route.reason == reason
+    assert route.model == (SMALL if reason == 'easy' else DEFAULT) and route.small == (reason == 'easy')
+    assert router.decisions == {(endpoint, route.model, reason): 1}
+
+
+# ── check() ──────────────────────────────────────────────────────────────────
+
+@pytest.mark.parametrize('reply, tokens, cap, reason', [
+    (GOOD, 40, 300, None),
+    ('Ok.', 2, 300, 'too_short'),
+    (GOOD, 300, 300, 'hit_limit'),
+    ('I’m not sure, but you could try the dashboard.', 12, 300, 'low_confidence'),
+    ('As an AI, I cannot see your store.', 10, 300, 'low_confidence'),
+    ('您可以在仪表板中添加产品。', 12, 300, 'off_language'),
+    ('click add ' * 20, 40, 300, 'repetitive'),
+])
+def test_check_final_reply(reply, tokens, cap, reason):
+    assert _router().check(reply, tokens, cap) == reason
+
+
+def test_check_prefix_skips_length_checks():
+    router = _router()
+    assert router.check('Ok.') is None
+    assert router.check("Sorry, I don't know") == 'low_confidence'
+
+
+# ── Escalation in main.routed_chat / routed_stream ───────────────────────────
+
+@pytest.fixture
+def ollama(monkeypatch):
+    """Replace Ollama with canned replies per model; returns the list of models called."""
+    replies, calls = {}, []
+
+    async def chat(messages, model=None, temperature=0.7, max_tokens=1000, affinity_key=None, usage=None):
+        calls.append(model)
+        usage['completion_tokens'] = len(replies[model].split())
+        return replies[model]
+
+    async def chat_stream(messages, model=None, temperature=0.7, max_tokens=1000, affinity_key=None, usage=None):
+        calls.append(model)
+        text = replies[model]
+        for i in range(0, len(text), 10):
+            yield text[i:i + 10]
+        usage['completion_tokens'] = len(text.split())
+
+    monkeypatch.setattr(main, 'ollama_chat', chat)
+    monkeypatch.setattr(main, 'ollama_chat_stream', chat_stream)
+    monkeypatch.setattr(main, 'DEFAULT_MODEL', DEFAULT)
+    return replies, calls
+
+
+def _use(monkeypatch, router):
+    monkeypatch.setattr(main, 'model_router', router)
+    return router
+
+
+async def _stream(route):
+    served = {}
+    chunks = [chunk async for chunk in main.routed_stream([{'role': 'user', 'content': 'hi'}], route, served=served)]
+    return ''.join(chunks), served.get('model')
+
+
+def test_weak_reply_escalates_to_the_default_model(monkeypatch, ollama):
+    replies, calls = ollama
+    router = _use(monkeypatch, _router(enabled=True))
+    replies.update({SMALL: "I'm not sure how to do that.", DEFAULT: GOOD})
+    route = router.route('chatbot', 'support_bot', 5, 100)
+    content, model = _run(main.routed_chat([{'role': 'user', 'content': 'hi'}], route))
+    assert (content, model) == (GOOD, DEFAULT) and calls == [SMALL, DEFAULT]
+    assert router.escalations[('chatbot', 'low_confidence')]['count'] == 1
+
+
+def test_stream_escalates_before_anything_is_sent(monkeypatch, ollama):
+    replies, calls = ollama
+    router = _use(monkeypatch, _router(enabled=True))
+    # The hedge sits inside the first ROUTE_HOLD_CHARS characters, so nothing of it reaches the client.
+    replies.update({SMALL: "Hmm, I'm not sure. " + GOOD, DEFAULT: GOOD})
+    text, model = _run(_stream(router.route('chatbot', 'support_bot', 5, 100)))
+    assert (text, model) == (GOOD, DEFAULT) and calls == [SMALL, DEFAULT]
+    assert router.escalations[('chatbot', 'low_confidence')]['count'] == 1
+
+
+def test_stream_is_released_once_the_hold_window_passes(monkeypatch, ollama):
+    replies, calls = ollama
+    router = _use(monkeypatch, _router(enabled=True))
+    # Past ROUTE_HOLD_CHARS the reply is already being sent: a later hedge no longer escalates.
+    replies[SMALL] = GOOD + " Still, I'm not sure about fees."
+    text, model = _run(_stream(router.route('chatbot', 'support_bot', 5, 100)))
+    assert (text, model) == (replies[SMALL], SMALL) and calls == [SMALL]
+    assert router.escalations == {}
+
+
+def test_short_stream_is_checked_as_a_whole(monkeypatch, ollama):
+    replies, calls = ollama
+    router = _use(monkeypatch, _router(enabled=True))
+    replies.update({SMALL: 'Ok.', DEFAULT: GOOD})  # ends inside the hold window
+    text, model = _run(_stream(router.route('chatbot', 'support_bot', 5, 100)))
+    assert (text, model) == (GOOD, DEFAULT)
+    assert router.escalations[('chatbot', 'too_short')]['count'] == 1
+
+
+def test_disabled_routing_passes_straight_through(monkeypatch, ollama):
+    replies, calls = ollama
+    monkeypatch.setenv('MODEL_ROUTING', '0')
+    router = _use(monkeypatch, ModelRouter.from_env(DEFAULT))
+    replies[DEFAULT] = 'Ok.'  # would fail check(), but the default model's reply is never checked
+    route = router.route('chatbot', 'support_bot', 5, 100)
+    assert _run(main.routed_chat([{'role': 'user', 'content': 'hi'}], route)) == ('Ok.', DEFAULT)
+    assert _run(_stream(route)) == ('Ok.', DEFAULT)
+    assert calls == [DEFAULT, DEFAULT] and router.escalations == {}
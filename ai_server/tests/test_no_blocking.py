@@ -0,0 +1,28 @@
+import textwrap
+
+from bench import check_blocking
+
+
+def test_server_modules_have_no_blocking_calls_on_the_loop():
+    assert check_blocking.main([]) == 0
+
+
+def test_guard_flags_blocking_calls(tmp_path):
+    module = tmp_path / 'module.py'
+    module.write_text(textwrap.dedent('''
+        import time
+        import fcntl
+        import asyncio
+
+        async def handler(fd):
+            time.sleep(1)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            await asyncio.to_thread(lambda: time.sleep(1))
+            time.sleep(0)  # blocking-ok
+
+        def helper():
+            time.sleep(1)
+    '''))
+    problems = check_blocking.check_file(str(module))
+    assert [p.split(':')[1] for p in problems] == ['7', '8']
+    assert check_blocking.main([str(module)]) == 1
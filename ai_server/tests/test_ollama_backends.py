@@ -0,0 +1,208 @@
+import asyncio
+
+import httpx
+import pytest
+
+from http_pool import http_pool
+from ollama_backends import Backend, BackendPool, NoBackendAvailable, UpstreamStatusError
+
+GPU1, GPU2 = 'http://gpu-1:11434', 'http://gpu-2:11434'
+MODEL = 'llama3.2:3b'
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def _serve(handler):
+    """Route the pool's shared 'ollama' client (for the running loop) through `handler`."""
+    http_pool._clients['ollama'] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def _ok(request):
+    return httpx.Response(200, json={'response': 'hi', 'backend': request.url.host})
+
+
+async def _generate(pool, **kwargs):
+    async with pool.request(MODEL, 'POST', '/api/generate', json={'model': MODEL}, **kwargs) as resp:
+        return resp.json()
+
+
+class _BrokenStream(httpx.AsyncByteStream):
+    """Sends one NDJSON line, then the connection drops."""
+
+    async def __aiter__(self):
+        yield b'{"response": "partial"}\n'
+        raise httpx.ReadError('connection reset')
+
+
+# ── Circuit breaker ──────────────────────────────────────────────────────────
+
+def test_breaker_opens_then_half_opens_for_a_single_trial():
+    async def scenario():
+        pool = BackendPool([GPU1], retries=0, breaker_threshold=2, breaker_cooldown=15.0, health_interval=0)
+        backend = pool.backends[0]
+        release = asyncio.Event()
+        mode = {'fail': True}
+
+        async def handler(request):
+            if mode['fail']:
+                raise httpx.ConnectError('refused', request=request)
+            await release.wait()
+            return _ok(request)
+
+        _serve(handler)
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                await _generate(pool)
+        assert backend.state == Backend.OPEN and backend.failures == 2
+        # Open: no traffic at all until the cooldown has passed.
+        assert pool.pick(MODEL) is None
+        with pytest.raises(NoBackendAvailable):
+            await _generate(pool)
+
+        backend.opened_at -= pool.breaker_cooldown
+        mode['fail'] = False
+        trial = asyncio.ensure_future(_generate(pool))
+        await asyncio.sleep(0.01)
+        assert backend.state == Backend.HALF_OPEN and backend.trial_in_flight
+        # Only one trial request at a time while half-open.
+        assert pool.pick(MODEL) is None
+        release.set()
+        assert (await trial)['backend'] == 'gpu-1'
+        assert backend.state == Backend.CLOSED and backend.failures == 0 and not backend.trial_in_flight
+        assert pool.pick(MODEL) is backend
+        await http_pool.aclose()
+
+    _run(scenario())
+
+
+def test_failed_trial_reopens_the_breaker():
+    async def scenario():
+        pool = BackendPool([GPU1], retries=0, breaker_threshold=3, health_interval=0)
+        backend = pool.backends[0]
+        _serve(lambda request: httpx.Response(503))
+        for _ in range(3):
+            with pytest.raises(UpstreamStatusError):
+                await _generate(pool)
+        assert backend.state == Backend.OPEN
+        backend.opened_at -= pool.breaker_cooldown
+        # A single failure while half-open is enough to open it again.
+        with pytest.raises(UpstreamStatusError):
+            await _generate(pool)
+        assert backend.state == Backend.OPEN and not backend.available(backend.opened_at, pool.breaker_cooldown)
+        await http_pool.aclose()
+
+    _run(scenario())
+
+
+# ── Retries ──────────────────────────────────────────────────────────────────
+
+def _prefer_gpu1(pool):
+    # Warm on gpu-1 only, so least-outstanding routing tries it first.
+    pool.backends[0].loaded.add(MODEL)
+    return pool
+
+
+@pytest.mark.parametrize('failure', ['connect', '5xx'])
+def test_retries_on_a_different_backend(failure):
+    async def scenario():
+        pool = _prefer_gpu1(BackendPool([GPU1, GPU2], retries=1, health_interval=0))
+        hosts = []
+
+        def handler(request):
+            hosts.append(request.url.host)
+            if request.url.host == 'gpu-1':
+                if failure == 'connect':
+                    raise httpx.ConnectError('refused', request=request)
+                return httpx.Response(502)
+            return _ok(request)
+
+        _serve(handler)
+        assert (await _generate(pool))['backend'] == 'gpu-2'
+        assert hosts == ['gpu-1', 'gpu-2'] and pool.retried == 1
+        assert pool.backends[0].errors == 1 and pool.backends[1].errors == 0
+        await http_pool.aclose()
+
+    _run(scenario())
+
+
+def test_read_timeout_is_not_retried():
+    async def scenario():
+        pool = _prefer_gpu1(BackendPool([GPU1, GPU2], retries=1, health_interval=0))
+        hosts = []
+
+        def handler(request):
+            hosts.append(request.url.host)
+            raise httpx.ReadTimeout('timed out', request=request)
+
+        _serve(handler)
+        with pytest.raises(httpx.ReadTimeout):
+            await _generate(pool)
+        assert hosts == ['gpu-1'] and pool.retried == 0
+        assert pool.backends[0].errors == 1
+        await http_pool.aclose()
+
+    _run(scenario())
+
+
+def test_mid_stream_failure_is_not_retried():
+    async def scenario():
+        pool = _prefer_gpu1(BackendPool([GPU1, GPU2], retries=1, health_interval=0))
+        hosts = []
+
+        def handler(request):
+            hosts.append(request.url.host)
+            return httpx.Response(200, stream=_BrokenStream())
+
+        _serve(handler)
+        lines = []
+        with pytest.raises(httpx.ReadError):
+            async with pool.request(MODEL, 'POST', '/api/generate', stream=True, json={}) as resp:
+                async for line in resp.aiter_lines():
+                    lines.append(line)
+        assert lines == ['{"response": "partial"}']
+        assert hosts == ['gpu-1'] and pool.retried == 0
+        assert pool.backends[0].errors == 1 and pool.backends[0].outstanding == 0
+        await http_pool.aclose()
+
+    _run(scenario())
+
+
+def test_exhausted_retries_raise_the_last_error():
+    async def scenario():
+        pool = BackendPool([GPU1, GPU2], retries=1, health_interval=0)
+        _serve(lambda request: httpx.Response(500))
+        with pytest.raises(UpstreamStatusError) as excinfo:
+            await _generate(pool)
+        assert excinfo.value.status_code == 500 and pool.retried == 1
+        await http_pool.aclose()
+
+    _run(scenario())
+
+
+# ── Routing ──────────────────────────────────────────────────────────────────
+
+def test_pick_prefers_nodes_with_the_model_and_skips_open_breakers():
+    pool = BackendPool([GPU1, GPU2, 'http://cpu-1:11434'], health_interval=0)
+    gpu1, gpu2, cpu1 = pool.backends
+    gpu1.installed, gpu2.installed, cpu1.installed = {'other'}, {MODEL}, {MODEL}
+    cpu1.state, cpu1.opened_at = Backend.OPEN, float('inf')
+    assert {pool.pick(MODEL).url for _ in range(10)} == {GPU2}
+    assert pool.pick(MODEL, exclude=[gpu2]) is gpu1  # nothing else left: try it anyway
+
+
+def test_pick_sends_traffic_to_closed_breakers_when_every_probe_fails():
+    pool = BackendPool([GPU1, GPU2], health_interval=0)
+    for backend in pool.backends:
+        backend.healthy = False
+    pool.backends[1].state, pool.backends[1].opened_at = Backend.OPEN, float('inf')
+    assert pool.pick(MODEL) is pool.backends[0]
+
+
+def test_pick_keeps_an_affinity_key_on_one_backend_until_it_spills():
+    pool = BackendPool([GPU1, GPU2, 'http://cpu-1:11434'], health_interval=0, affinity_spill=2)
+    first = pool.pick(MODEL, affinity_key='session-1')
+    assert all(pool.pick(MODEL, affinity_key='session-1') is first for _ in range(10))
+    first.outstanding = 2
+    assert pool.pick(MODEL, affinity_key='session-1') is not first
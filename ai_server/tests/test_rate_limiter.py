@@ -0,0 +1,90 @@
+import pytest
+
+from rate_limiter import RateLimiter, MemoryBackend, SharedMemoryBackend
+
+WINDOW = 60
+
+
+def _backends():
+    yield MemoryBackend
+    try:
+        import fcntl  # noqa: F401
+    except ImportError:
+        return
+    yield SharedMemoryBackend
+
+
+@pytest.fixture(params=list(_backends()), ids=lambda cls: cls.__name__)
+def limiter(request, tmp_path):
+    if request.param is SharedMemoryBackend:
+        backend = SharedMemoryBackend(name=f'tb-test-{tmp_path.name}', slots=64, lock_dir=str(tmp_path))
+    else:
+        backend = MemoryBackend()
+    limiter = RateLimiter({}, WINDOW, backend)
+    yield limiter
+    backend.close()
+
+
+def test_burst_then_deny(limiter):
+    # A limit of 4/min allows a burst of 2, then one request every 20 seconds.
+    assert [limiter.hit('ip', 4, now=0.0)[0] for _ in range(3)] == [True, True, False]
+    allowed, retry = limiter.hit('ip', 4, now=0.0)
+    assert not allowed
+    assert retry == pytest.approx(20.0)
+    assert limiter.rejections == {'ip': 2}
+
+
+def test_vision_limit_burst_and_steady_rate(limiter):
+    # The documented trade-off for 12/min: 6 back to back, then 7 per minute at a steady pace.
+    assert sum(limiter.hit('ip', 12, now=0.0)[0] for _ in range(12)) == 6
+    steady = [t for t in range(1, 601) if limiter.hit('ip', 12, now=float(t))[0]]
+    assert len(steady) == 70
+
+
+def test_retry_after_is_exact(limiter):
+    limiter.hit('ip', 2, now=0.0)
+    allowed, retry = limiter.hit('ip', 2, now=10.0)
+    assert not allowed and retry == pytest.approx(20.0)
+    assert limiter.hit('ip', 2, now=10.0 + retry)[0]
+
+
+def test_keys_are_independent(limiter):
+    assert limiter.hit(('1.1.1.1', '/generate'), 1, now=0.0)[0]
+    assert not limiter.hit(('1.1.1.1', '/generate'), 1, now=0.0)[0]
+    assert limiter.hit(('2.2.2.2', '/generate'), 1, now=0.0)[0]
+    assert limiter.hit(('1.1.1.1', '/island-chat'), 1, now=0.0)[0]
+    assert limiter.rejections == {'/generate': 1}
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 12, 30])
+def test_never_more_than_limit_per_rolling_window(limiter, limit):
+    # Hammer the limiter every 0.25 s for five windows.
+    times = [i / 4 for i in range(WINDOW * 4 * 5)]
+    allowed = [t for t in times if limiter.hit('ip', limit, now=t)[0]]
+    worst = max(sum(1 for t in allowed if start <= t < start + WINDOW) for start in allowed)
+    assert worst == limit
+
+
+def test_recovers_after_idle(limiter):
+    for _ in range(5):
+        limiter.hit('ip', 4, now=0.0)
+    assert [limiter.hit('ip', 4, now=WINDOW)[0] for _ in range(3)] == [True, True, False]
+
+
+def test_memory_sweep_drops_recovered_keys():
+    backend = MemoryBackend()
+    limiter = RateLimiter({}, WINDOW, backend)
+    limiter.hit('a', 2, now=0.0)
+    limiter.hit('b', 2, now=50.0)
+    assert backend.sweep(40.0) == 1
+    assert len(backend) == 1
+
+
+def test_ahit_matches_hit(limiter):
+    import asyncio
+
+    async def scenario():
+        return [await limiter.ahit('ip', 2, now=0.0) for _ in range(2)]
+
+    (first, _), (second, retry) = asyncio.run(scenario())
+    assert first and not second and retry == pytest.approx(30.0)
@@ -0,0 +1,142 @@
+import asyncio
+
+from response_cache import ResponseCache, _DiskTier, cache_key
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+MESSAGES = [{'role': 'system', 'content': 'Write a product blurb.'},
+            {'role': 'user', 'content': 'Doubles  with\n extra pepper'}]
+
+
+# ── Keying ───────────────────────────────────────────────────────────────────
+
+def test_key_ignores_whitespace_and_option_order():
+    spaced = [{'role': 'system', 'content': ' Write a product   blurb. '},
+              {'role': 'user', 'content': 'Doubles with extra pepper'}]
+    assert cache_key('m', MESSAGES, {'temperature': 0, 'seed': 1}) == \
+        cache_key('m', spaced, {'seed': 1, 'temperature': 0})
+
+
+def test_key_separates_model_content_role_and_options():
+    base = cache_key('m', MESSAGES, {'temperature': 0})
+    assert cache_key('other', MESSAGES, {'temperature': 0}) != base
+    assert cache_key('m', MESSAGES, {'temperature': 0.2}) != base
+    assert cache_key('m', MESSAGES[:1] + [{'role': 'user', 'content': 'Bake'}], {'temperature': 0}) != base
+    assert cache_key('m', [dict(MESSAGES[0], role='user'), MESSAGES[1]], {'temperature': 0}) != base
+    assert cache_key('m', MESSAGES, None) == cache_key('m', MESSAGES, {})
+
+
+# ── Memory tier ──────────────────────────────────────────────────────────────
+
+def test_memory_hit_and_miss():
+    async def scenario():
+        cache = ResponseCache()
+        assert await cache.get('k') is None
+        await cache.put('k', {'response': 'hi'})
+        assert await cache.get('k') == {'response': 'hi'}
+        assert cache.stats()['hits'] == {'memory': 1, 'disk': 0} and cache.misses == 1
+
+    _run(scenario())
+
+
+def test_memory_entries_expire_after_ttl():
+    async def scenario():
+        cache = ResponseCache(ttl=0)
+        await cache.put('k', {'response': 'hi'})
+        assert await cache.get('k') is None
+        assert cache.stats()['memory']['entries'] == 0 and cache.stats()['memory']['bytes'] == 0
+
+    _run(scenario())
+
+
+def test_memory_tier_evicts_least_recently_used_by_bytes():
+    async def scenario():
+        value = 'x' * 90  # 92 bytes once JSON-encoded
+        cache = ResponseCache(max_bytes=300)
+        for key in 'abc':
+            await cache.put(key, value)
+        await cache.get('a')  # a is now the most recently used
+        await cache.put('d', value)
+        assert await cache.get('b') is None
+        assert all([await cache.get(k) for k in 'acd'])
+        assert cache.stats()['memory']['bytes'] <= 300
+        await cache.put('huge', 'x' * 400)  # larger than the whole tier: not cached
+        assert await cache.get('huge') is None and await cache.get('d') == value
+
+    _run(scenario())
+
+
+# ── Disk tier ────────────────────────────────────────────────────────────────
+
+def test_disk_tier_survives_restart_and_promotes_to_memory(tmp_path):
+    async def scenario():
+        path = str(tmp_path / 'cache.db')
+        cache = ResponseCache(disk_path=path)
+        await cache.put('k', {'response': 'hi'})
+        cache.close()
+        restarted = ResponseCache(disk_path=path)
+        assert await restarted.get('k') == {'response': 'hi'}
+        assert await restarted.get('k') == {'response': 'hi'}
+        assert restarted.hits_disk == 1 and restarted.hits_memory == 1
+        assert restarted.stats()['disk']['entries'] == 1
+        restarted.close()
+
+    _run(scenario())
+
+
+def test_disk_entries_expire_after_ttl(tmp_path):
+    tier = _DiskTier(str(tmp_path / 'cache.db'), max_bytes=1000)
+    tier.put('k', b'value', expires_at=110.0, now=100.0)
+    assert tier.get('k', now=105.0)[0] == b'value'
+    assert tier.get('k', now=110.0) is None
+    assert tier.usage()['entries'] == 0 and tier.usage()['bytes'] == 0
+    tier.close()
+
+
+def test_disk_tier_keeps_running_totals_without_scanning(tmp_path):
+    tier = _DiskTier(str(tmp_path / 'cache.db'), max_bytes=1000)
+    statements = []
+    tier._db.set_trace_callback(statements.append)
+    for i in range(5):
+        tier.put(f'k{i}', b'x' * 100, expires_at=1e12, now=float(i))
+    tier.put('k0', b'x' * 50, expires_at=1e12, now=10.0)  # replacing a row adjusts, not adds
+    assert tier.usage() == {'entries': 5, 'bytes': 450, 'max_bytes': 1000}
+    assert not [s for s in statements if 'SUM(size)' in s]
+    tier.close()
+
+
+def test_disk_tier_evicts_least_recently_used_to_low_water(tmp_path):
+    tier = _DiskTier(str(tmp_path / 'cache.db'), max_bytes=1000)
+    for i in range(10):
+        tier.put(f'k{i}', b'x' * 100, expires_at=1e12, now=float(i))
+    tier.get('k0', now=20.0)  # touched: survives the eviction
+    statements = []
+    tier._db.set_trace_callback(statements.append)
+    tier.put('k10', b'x' * 100, expires_at=1e12, now=21.0)
+    assert tier.usage()['bytes'] <= 1000 * _DiskTier.LOW_WATER
+    assert tier.get('k1', now=22.0) is None and tier.get('k2', now=22.0) is None
+    assert tier.get('k0', now=22.0) is not None and tier.get('k10', now=22.0) is not None
+    assert len([s for s in statements if 'SUM(size)' in s]) == 1
+    # The next put fits under the bound again, so it does not recount.
+    statements.clear()
+    tier.put('k11', b'x' * 100, expires_at=1e12, now=23.0)
+    assert not [s for s in statements if 'SUM(size)' in s]
+    tier.close()
+
+
+def test_disk_eviction_counts_rows_written_by_other_workers(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    mine, other = _DiskTier(path, max_bytes=1000), _DiskTier(path, max_bytes=1000)
+    for i in range(8):
+        other.put(f'o{i}', b'x' * 100, expires_at=1e12, now=float(i))
+    for i in range(3):
+        mine.put(f'm{i}', b'x' * 100, expires_at=1e12, now=10.0 + i)
+    # mine's own total only crosses the bound after the recount sees other's rows.
+    mine.put('m3', b'x' * 800, expires_at=1e12, now=20.0)
+    assert mine.usage()['bytes'] <= 900
+    assert mine.get('m3', now=21.0) is not None and mine.get('o0', now=21.0) is None
+    mine.close()
+    other.close()
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from scheduler import AdmissionScheduler, QueueFull, INTERACTIVE, BATCH
+
+MODEL = 'qwen2.5:7b'
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_admits_up_to_limit_without_waiting():
+    async def scenario():
+        scheduler = AdmissionScheduler(default_limit=2)
+        assert await scheduler.acquire(MODEL) == 0.0
+        assert await scheduler.acquire(MODEL, BATCH) == 0.0
+        stats = scheduler.stats()[MODEL]
+        assert stats['active'] == 2 and stats['queued'] == 0
+
+    _run(scenario())
+
+
+def test_interactive_served_before_batch():
+    async def scenario():
+        scheduler = AdmissionScheduler(default_limit=1)
+        await scheduler.acquire(MODEL)
+        order = []
+
+        async def request(name, priority):
+            await scheduler.acquire(MODEL, priority)
+            order.append(name)
+            scheduler.release(MODEL)
+
+        tasks = [asyncio.ensure_future(request('batch-1', BATCH)),
+                 asyncio.ensure_future(request('batch-2', BATCH)),
+                 asyncio.ensure_future(request('chat', INTERACTIVE))]
+        await _settle()
+        assert scheduler.stats()[MODEL]['queued'] == 3
+        scheduler.release(MODEL)
+        await asyncio.gather(*tasks)
+        assert order == ['chat', 'batch-1', 'batch-2']
+        assert scheduler.stats()[MODEL]['active'] == 0
+
+    _run(scenario())
+
+
+def test_full_queue_evicts_newest_batch_for_interactive():
+    async def scenario():
+        scheduler = AdmissionScheduler(default_limit=1, max_queue=2)
+        await scheduler.acquire(MODEL)
+        older = asyncio.ensure_future(scheduler.acquire(MODEL, BATCH))
+        newer = asyncio.ensure_future(scheduler.acquire(MODEL, BATCH))
+        await _settle()
+        assert scheduler.would_shed(MODEL, BATCH)
+        assert not scheduler.would_shed(MODEL, INTERACTIVE)
+
+        chat = asyncio.ensure_future(scheduler.acquire(MODEL, INTERACTIVE))
+        await _settle()
+        with pytest.raises(QueueFull):
+            await newer
+        assert not older.done()
+
+        scheduler.release(MODEL)
+        await chat
+        scheduler.release(MODEL)
+        await older
+        stats = scheduler.stats()[MODEL]
+        assert stats['shed'] == {'interactive': 0, 'batch': 1}
+        assert stats['admitted'] == {'interactive': 2, 'batch': 1}
+
+    _run(scenario())
+
+
+def test_full_queue_sheds_when_nothing_to_evict():
+    async def scenario():
+        scheduler = AdmissionScheduler(default_limit=1, max_queue=1)
+        await scheduler.acquire(MODEL)
+        waiter = asyncio.ensure_future(scheduler.acquire(MODEL, INTERACTIVE))
+        await _settle()
+        with pytest.raises(QueueFull) as excinfo:
+            await scheduler.acquire(MODEL, BATCH)
+        assert excinfo.value.status_code == 503
+        assert 'Retry-After' in excinfo.value.headers
+        with pytest.raises(QueueFull):
+            await scheduler.acquire(MODEL, INTERACTIVE)
+        scheduler.release(MODEL)
+        await waiter
+
+    _run(scenario())
+
+
+def test_queue_timeout_sheds():
+    async def scenario():
+        scheduler = AdmissionScheduler(default_limit=1, queue_timeout=0.05)
+        await scheduler.acquire(MODEL)
+        with pytest.raises(QueueFull):
+            await scheduler.acquire(MODEL, BATCH)
+        stats = scheduler.stats()[MODEL]
+        assert stats['queued'] == 0 and stats['shed']['batch'] == 1
+
+    _run(scenario())
+
+
+def test_cancelled_waiter_frees_its_place():
+    async def scenario():
+        scheduler = AdmissionScheduler(default_limit=1, max_queue=1)
+        await scheduler.acquire(MODEL)
+        waiter = asyncio.ensure_future(scheduler.acquire(MODEL, BATCH))
+        await _settle()
+        waiter.cancel()
+        await _settle()
+        assert scheduler.stats()[MODEL]['queued'] == 0
+        scheduler.release(MODEL)
+        assert scheduler.stats()[MODEL]['active'] == 0
+
+    _run(scenario())
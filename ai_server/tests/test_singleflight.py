@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_callers_share_one_call():
+    async def scenario():
+        flight, calls = SingleFlight(), []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'reply'
+
+        results = await asyncio.gather(*(flight.do('key', fn) for _ in range(5)))
+        assert results == ['reply'] * 5
+        assert len(calls) == 1
+        assert flight.stats() == {'in_flight': 0, 'leaders': 1, 'coalesced': 4, 'abandoned': 0}
+
+    _run(scenario())
+
+
+def test_leader_cancelled_followers_still_get_result():
+    async def scenario():
+        flight, release = SingleFlight(), asyncio.Event()
+
+        async def fn():
+            await release.wait()
+            return 'reply'
+
+        leader = asyncio.ensure_future(flight.do('key', fn))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do('key', fn))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await follower == 'reply'
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert flight.stats()['abandoned'] == 0
+
+    _run(scenario())
+
+
+def test_all_callers_cancelled_stops_the_call():
+    async def scenario():
+        flight, started, cancelled = SingleFlight(), asyncio.Event(), asyncio.Event()
+
+        async def fn():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        callers = [asyncio.ensure_future(flight.do('key', fn)) for _ in range(2)]
+        await started.wait()
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flight.stats()['abandoned'] == 1
+        assert flight.stats()['in_flight'] == 0
+
+    _run(scenario())
+
+
+def test_leader_error_reaches_every_caller_and_is_not_cached():
+    async def scenario():
+        flight, calls = SingleFlight(), []
+
+        async def failing():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise RuntimeError('upstream 500')
+
+        results = await asyncio.gather(*(flight.do('key', failing) for _ in range(3)),
+                                       return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert len(calls) == 1
+        assert flight.stats()['in_flight'] == 0
+
+        async def ok():
+            return 'reply'
+
+        assert await flight.do('key', ok) == 'reply'
+        assert flight.stats()['leaders'] == 2
+
+    _run(scenario())
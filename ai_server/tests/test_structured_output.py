@@ -0,0 +1,176 @@
+import asyncio
+
+import pytest
+
+from structured_output import JsonScanner, StructuredOutput, StructuredOutputError, parse, strip_code_fences
+
+LISTING = {
+    'type': 'object',
+    'required': ['title', 'tags', 'price'],
+    'properties': {
+        'title': {'type': 'string'},
+        'tags': {'type': 'array', 'items': {'type': 'string'}, 'maxItems': 3},
+        'price': {'type': 'number'},
+    },
+}
+CLEAN = '{"title": "Drill", "tags": ["tools"], "price": 450}'
+
+
+# ── JsonScanner ──────────────────────────────────────────────────────────────
+
+def _scan(*deltas):
+    scanner = JsonScanner()
+    for delta in deltas:
+        if scanner.feed(delta):
+            break
+    return scanner
+
+
+def test_scanner_finds_value_split_across_deltas():
+    deltas = ['Here you go: ', '{"a": [1, ', '{"b": "}]"}', ']}', ' trailing']
+    scanner = _scan(*deltas)
+    assert scanner.done and scanner.error is None
+    assert scanner.text[scanner.start:scanner.end] == '{"a": [1, {"b": "}]"}]}'
+
+
+def test_scanner_handles_escaped_quotes():
+    scanner = _scan('{"q": "say \\"hi\\" }"', '}')
+    assert scanner.done and scanner.error is None
+    assert scanner.end == len(scanner.text)
+
+
+def test_scanner_not_done_while_open():
+    scanner = _scan('```json\n', '{"a": [1, 2')
+    assert not scanner.done
+    assert scanner.start == len('```json\n') and scanner.end == -1
+
+
+def test_scanner_reports_mismatched_closer():
+    scanner = _scan('{"a": [1, 2}')
+    assert scanner.done
+    assert scanner.error and "expected ']'" in scanner.error
+
+
+def test_scanner_ignores_feeds_after_done():
+    scanner = _scan('[1]')
+    assert scanner.feed('[2]')
+    assert scanner.text == '[1]'
+
+
+# ── parse() repairs ──────────────────────────────────────────────────────────
+
+def test_parse_clean_output_needs_no_fixes():
+    assert parse(CLEAN, LISTING) == ({'title': 'Drill', 'tags': ['tools'], 'price': 450}, [])
+
+
+@pytest.mark.parametrize('text, fix', [
+    ('```json\n' + CLEAN + '\n```', 'code fences'),
+    ('Sure! ' + CLEAN, 'text before the value'),
+    (CLEAN + ' Hope this helps.', 'text after the value'),
+    ('{"title": "Drill", "tags": ["tools",], "price": 450,}', 'trailing comma'),
+    ('{"title": "Drill", "tags": ["tools"], "price": 450, "used": False, "note": None}', 'python literals'),
+])
+def test_parse_repairs(text, fix):
+    value, fixes = parse(text, LISTING)
+    assert value['title'] == 'Drill' and value['tags'] == ['tools'] and value['price'] == 450
+    assert fix in fixes
+
+
+def test_parse_truncated_output():
+    value, fixes = parse('{"title": "Drill", "tags": ["tools", "diy"], "price": 450, "note": "cordless an', LISTING)
+    assert value['tags'] == ['tools', 'diy'] and value['price'] == 450
+    assert 'truncated' in fixes
+
+
+def test_parse_drops_partial_element_to_validate():
+    schema = {'type': 'object', 'required': ['ads'], 'properties': {
+        'ads': {'type': 'array', 'items': {'type': 'object', 'required': ['headline', 'body']}}}}
+    text = '{"ads": [{"headline": "A", "body": "one"}, {"headline": "B", "bo'
+    value, fixes = parse(text, schema)
+    assert value == {'ads': [{'headline': 'A', 'body': 'one'}]}
+    assert 'truncated' in fixes
+
+
+def test_parse_coerces_to_schema():
+    value, fixes = parse('{"title": "Drill", "tags": "tools, diy", "price": "TT$1,200.50"}', LISTING)
+    assert value == {'title': 'Drill', 'tags': ['tools', 'diy'], 'price': 1200.5}
+    assert '$.tags: split string into list' in fixes
+    assert '$.price: parsed number from string' in fixes
+
+
+def test_parse_trims_max_items():
+    value, fixes = parse('{"title": "Drill", "tags": ["a", "b", "c", "d"], "price": 1}', LISTING)
+    assert value['tags'] == ['a', 'b', 'c']
+    assert '$.tags: dropped items past maxItems' in fixes
+
+
+@pytest.mark.parametrize('text', ['no json here', '{"title": 5}', '{"title": "Drill", "tags": ['])
+def test_parse_rejects_unrepairable_output(text):
+    with pytest.raises(StructuredOutputError) as excinfo:
+        parse(text, LISTING)
+    assert excinfo.value.text == text
+
+
+def test_parse_plain_json_format_requires_a_container():
+    assert parse('[1, 2]', 'json') == ([1, 2], [])
+    with pytest.raises(StructuredOutputError):
+        parse('"just a string"', 'json')
+
+
+def test_strip_code_fences():
+    assert strip_code_fences('```json\n{"a": 1}\n```') == '{"a": 1}'
+    assert strip_code_fences('{"a": 1}') == '{"a": 1}'
+
+
+# ── StructuredOutput.generate() ──────────────────────────────────────────────
+
+def _producer(*outputs, chunk=4):
+    """produce() factory: each call streams the next output in small deltas and records how far it got."""
+    outputs, sent = iter(outputs), []
+
+    def produce():
+        text = next(outputs)
+
+        async def deltas():
+            for i in range(0, len(text), chunk):
+                sent.append(text[i:i + chunk])
+                yield text[i:i + chunk]
+
+        return deltas()
+
+    return produce, sent
+
+
+def test_generate_stops_reading_once_value_is_complete():
+    produce, sent = _producer(CLEAN + ' ' + 'padding ' * 50)
+    handler = StructuredOutput(retries=1)
+    value = asyncio.run(handler.generate('listing', LISTING, produce))
+    assert value['title'] == 'Drill'
+    assert len(''.join(sent)) < len(CLEAN) + 8
+    counts = handler.stats()['endpoints']['listing']
+    assert counts['valid'] == 1 and counts['early_stops'] == 1
+
+
+def test_generate_repairs_without_retrying():
+    produce, _ = _producer('{"title": "Drill", "tags": ["tools",], "price": 450,}')
+    handler = StructuredOutput(retries=1)
+    assert asyncio.run(handler.generate('listing', LISTING, produce))['tags'] == ['tools']
+    counts = handler.stats()['endpoints']['listing']
+    assert counts['repaired'] == 1 and counts['retried'] == 0
+
+
+def test_generate_retries_once_then_fails():
+    produce, _ = _producer('not json', 'still not json')
+    handler = StructuredOutput(retries=1)
+    with pytest.raises(StructuredOutputError):
+        asyncio.run(handler.generate('ads', LISTING, produce))
+    counts = handler.stats()['endpoints']['ads']
+    assert counts['invalid'] == 2 and counts['retried'] == 1 and counts['failed'] == 1
+
+
+def test_generate_succeeds_on_retry():
+    produce, _ = _producer('not json', CLEAN)
+    handler = StructuredOutput(retries=1)
+    assert asyncio.run(handler.generate('ads', LISTING, produce))['price'] == 450
+    counts = handler.stats()['endpoints']['ads']
+    assert counts['retried'] == 1 and counts['valid'] == 1 and counts['failed'] == 0
@@ -0,0 +1,98 @@
+from token_budget import TokenBudget, MESSAGE_OVERHEAD, MIN_COMPLETION_TOKENS, estimate
+
+
+def _turn(role, words):
+    return {'role': role, 'content': ' '.join(f'word{i}' for i in range(words))}
+
+
+def _budget(**kwargs):
+    return TokenBudget(num_ctx=512, tokenizer_models={}, **kwargs)
+
+
+def test_short_prompt_is_untouched():
+    budget = _budget()
+    messages = [_turn('system', 10), _turn('user', 5)]
+    fitted, options, info = budget.fit('qwen2.5:7b', messages, max_tokens=200)
+    assert fitted == messages
+    assert info == {'prompt_tokens': budget.count_messages('qwen2.5:7b', messages), 'trimmed': False}
+    assert options == {'num_ctx': 512, 'num_predict': 200}
+    assert budget.trimmed == 0
+
+
+def test_num_ctx_is_constant_per_model():
+    budget = _budget(overrides={'qwen2.5:7b': 8192})
+    for max_tokens in (50, 500, 5000):
+        assert budget.fit('qwen2.5:7b', [_turn('user', 3)], max_tokens)[1]['num_ctx'] == 8192
+        assert budget.fit('llama3.2:3b', [_turn('user', 3)], max_tokens)[1]['num_ctx'] == 512
+
+
+def test_oldest_turns_dropped_first():
+    budget = _budget()
+    system = _turn('system', 20)
+    history = [_turn('user' if i % 2 == 0 else 'assistant', 60) for i in range(6)]
+    latest = _turn('user', 10)
+    fitted, options, info = budget.fit('m', [system] + history + [latest], max_tokens=200)
+    assert info['trimmed'] and budget.trimmed == 1
+    assert fitted[0] == system and fitted[-1] == latest
+    # What survives is a suffix of the history, and it fits next to the reserved headroom.
+    kept = fitted[1:-1]
+    assert kept == history[len(history) - len(kept):]
+    assert info['prompt_tokens'] <= 512 - 200
+    assert info['prompt_tokens'] == budget.count_messages('m', fitted)
+
+
+def test_headroom_is_capped_at_half_the_window():
+    budget = _budget()
+    messages = [_turn('system', 20)] + [_turn('user', 60) for _ in range(8)]
+    _, options, info = budget.fit('m', messages, max_tokens=10000)
+    assert info['prompt_tokens'] <= 512 - 256
+    assert options['num_predict'] == 512 - info['prompt_tokens']
+
+
+def test_oversized_latest_message_is_truncated():
+    budget = _budget()
+    system, huge = _turn('system', 10), _turn('user', 2000)
+    fitted, options, info = budget.fit('m', [system, huge], max_tokens=100)
+    assert fitted[0] == system
+    assert huge['content'].startswith(fitted[1]['content'])
+    assert len(fitted[1]['content']) < len(huge['content'])
+    assert info['prompt_tokens'] <= 512 - 100
+    assert options['num_predict'] == 100
+
+
+def test_num_predict_never_below_minimum():
+    budget = _budget()
+    _, options, _ = budget.fit('m', [_turn('user', 3)], max_tokens=10)
+    assert options['num_predict'] == MIN_COMPLETION_TOKENS
+
+
+def test_message_tokens_include_overhead():
+    budget = _budget()
+    message = _turn('user', 12)
+    assert budget.count_messages('m', [message]) == estimate(message['content']) + MESSAGE_OVERHEAD
+
+
+def test_too_long():
+    budget = _budget(max_prompt_tokens=50)
+    assert not budget.too_long('m', '')
+    assert not budget.too_long('m', 'a short question')
+    assert budget.too_long('m', 'word ' * 100)
+    assert budget.too_long('m', 'x' * 1000)
+
+
+def test_oversized_system_prompt_is_cut_and_latest_message_kept():
+    budget = _budget()
+    system, question = _turn('system', 2000), _turn('user', 10)
+    fitted, options, info = budget.fit('m', [system, question], max_tokens=200)
+    assert fitted[-1] == question
+    assert system['content'].startswith(fitted[0]['content'])
+    assert info['prompt_tokens'] <= 512 - 200
+    assert info['prompt_tokens'] + options['num_predict'] <= 512
+
+
+def test_oversized_system_prompt_and_message_share_the_budget():
+    budget = _budget()
+    fitted, options, info = budget.fit('m', [_turn('system', 2000), _turn('user', 2000)], max_tokens=200)
+    counts = [budget.count_messages('m', [m]) for m in fitted]
+    assert all(count > 100 for count in counts)
+    assert info['prompt_tokens'] <= 512 - 200
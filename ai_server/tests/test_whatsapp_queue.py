@@ -0,0 +1,236 @@
+import asyncio
+
+import httpx
+import pytest
+
+from rate_limiter import MemoryBackend
+from whatsapp_queue import WhatsAppQueue, RetryableSendError, _QueueDB, QUEUED, SENDING, SENT, FAILED
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def _queue(tmp_path, **kwargs):
+    kwargs.setdefault('shaper', None)
+    queue = WhatsAppQueue(str(tmp_path / 'queue.db'), **kwargs)
+    queue._db = _QueueDB(queue.path)
+    return queue
+
+
+async def _process(queue, send):
+    """Claim every due job and run it through _process once, as the dispatcher would."""
+    queue._send = send
+    queue._slots = asyncio.Semaphore(100)
+    jobs = await asyncio.to_thread(queue._db.claim, 1e12, 100, queue.lease)
+    for job in jobs:
+        await queue._slots.acquire()
+        await queue._process(job)
+    return jobs
+
+
+# ── Idempotency ──────────────────────────────────────────────────────────────
+
+def test_dedupe_key():
+    key = WhatsAppQueue.dedupe_key
+    assert key('1868', 'placed', 'o1') == key('1868', 'placed', 'o1')
+    assert key('1868', 'placed', 'o1') != key('1868', 'shipped', 'o1')
+    assert key('1868', 'placed', 'o1') != key('1869', 'placed', 'o1')
+    assert key('1868', 'a', 'o1', 'row-7') == key('1868', 'b', None, 'row-7') == 'key:row-7'
+    assert key('1868', 'placed') is None
+
+
+def test_same_key_collapses_to_one_job(tmp_path):
+    async def scenario():
+        queue = _queue(tmp_path)
+        first, created = await queue.enqueue('1868', 'Order placed', 'o1')
+        again, duplicate = await queue.enqueue('1868', 'Order placed', 'o1')
+        shipped, shipped_created = await queue.enqueue('1868', 'Order shipped', 'o1')
+        keyed, _ = await queue.enqueue('1868', 'hello', idempotency_key='row-1')
+        retried, keyed_again = await queue.enqueue('1868', 'hello (retry)', idempotency_key='row-1')
+        plain, _ = await queue.enqueue('1868', 'hello')
+        plain_again, plain_created = await queue.enqueue('1868', 'hello')
+        assert created and not duplicate and again['id'] == first['id']
+        assert shipped_created and shipped['id'] != first['id']
+        assert not keyed_again and retried['id'] == keyed['id'] and retried['body'] == 'hello'
+        assert plain_created and plain_again['id'] != plain['id']
+        queue._db.close()
+
+    _run(scenario())
+
+
+def test_dedupe_survives_reopen(tmp_path):
+    async def scenario():
+        queue = _queue(tmp_path)
+        job, _ = await queue.enqueue('1868', 'Order placed', 'o1')
+        queue._db.close()
+        reopened = _queue(tmp_path)
+        again, created = await reopened.enqueue('1868', 'Order placed', 'o1')
+        assert not created and again['id'] == job['id']
+        reopened._db.close()
+
+    _run(scenario())
+
+
+# ── Delivery ─────────────────────────────────────────────────────────────────
+
+def test_success_records_sid(tmp_path):
+    async def scenario():
+        queue = _queue(tmp_path)
+        job, _ = await queue.enqueue('1868', 'hi')
+
+        async def send(to, body):
+            return 'SM123'
+
+        await _process(queue, send)
+        done = await queue.get(job['id'])
+        assert done['status'] == SENT and done['sid'] == 'SM123' and done['attempts'] == 1
+        queue._db.close()
+
+    _run(scenario())
+
+
+def test_transient_errors_retry_with_backoff_until_max_attempts(tmp_path):
+    async def scenario():
+        queue = _queue(tmp_path, max_attempts=3, backoff_base=2.0, backoff_max=300.0)
+        job, _ = await queue.enqueue('1868', 'hi')
+        calls = []
+
+        async def send(to, body):
+            calls.append(body)
+            raise RetryableSendError('Twilio HTTP 503')
+
+        delays = []
+        for attempt in (1, 2):
+            await _process(queue, send)
+            row = await queue.get(job['id'])
+            assert row['status'] == QUEUED and row['attempts'] == attempt
+            assert row['last_error'] == 'Twilio HTTP 503'
+            delays.append(row['next_attempt_at'] - row['updated_at'])
+        # Exponential with jitter in [0.5, 1.0]: 1-2 s, then 2-4 s.
+        assert 1.0 - 1e-3 <= delays[0] <= 2.0 + 1e-3 and 2.0 - 1e-3 <= delays[1] <= 4.0 + 1e-3
+
+        await _process(queue, send)
+        row = await queue.get(job['id'])
+        assert row['status'] == FAILED and row['attempts'] == 3
+        assert len(calls) == 3 and queue.retried == 2 and queue.failed == 1
+        queue._db.close()
+
+    _run(scenario())
+
+
+def test_retry_after_is_honoured(tmp_path):
+    async def scenario():
+        queue = _queue(tmp_path, backoff_base=1.0)
+        job, _ = await queue.enqueue('1868', 'hi')
+
+        async def send(to, body):
+            raise RetryableSendError('Twilio HTTP 429', retry_after=120)
+
+        await _process(queue, send)
+        row = await queue.get(job['id'])
+        assert row['next_attempt_at'] - row['updated_at'] == pytest.approx(120, abs=1e-3)
+        queue._db.close()
+
+    _run(scenario())
+
+
+def test_network_errors_are_transient(tmp_path):
+    async def scenario():
+        queue = _queue(tmp_path)
+        job, _ = await queue.enqueue('1868', 'hi')
+
+        async def send(to, body):
+            raise httpx.ConnectError('connection refused')
+
+        await _process(queue, send)
+        row = await queue.get(job['id'])
+        assert row['status'] == QUEUED and 'ConnectError' in row['last_error']
+        queue._db.close()
+
+    _run(scenario())
+
+
+def test_permanent_errors_fail_at_once(tmp_path):
+    async def scenario():
+        queue = _queue(tmp_path, max_attempts=6)
+        job, _ = await queue.enqueue('1868', 'hi')
+
+        async def send(to, body):
+            raise RuntimeError('Twilio HTTP 400: invalid To number')
+
+        await _process(queue, send)
+        row = await queue.get(job['id'])
+        assert row['status'] == FAILED and row['attempts'] == 1
+        assert 'invalid To number' in row['last_error']
+        assert queue.retried == 0 and queue.failed == 1
+        queue._db.close()
+
+    _run(scenario())
+
+
+def test_rate_shaped_jobs_are_deferred_not_attempted(tmp_path):
+    async def scenario():
+        queue = _queue(tmp_path, shaper=MemoryBackend(), per_destination_per_min=1)
+        jobs = [(await queue.enqueue('1868', f'message {i}'))[0] for i in range(3)]
+        sent = []
+
+        async def send(to, body):
+            sent.append(body)
+            return f'SM{len(sent)}'
+
+        await _process(queue, send)
+        rows = [await queue.get(job['id']) for job in jobs]
+        # Burst of 2 per number; the third waits for the number's rate without using an attempt.
+        assert [r['status'] for r in rows] == [SENT, SENT, QUEUED]
+        assert rows[2]['attempts'] == 0 and rows[2]['next_attempt_at'] > rows[2]['updated_at']
+        assert queue.deferred == 1 and len(sent) == 2
+        queue._db.close()
+
+    _run(scenario())
+
+
+# ── Leases ───────────────────────────────────────────────────────────────────
+
+def test_expired_lease_is_reclaimed_after_a_crash(tmp_path):
+    db = _QueueDB(str(tmp_path / 'queue.db'))
+    job, _ = db.enqueue(None, '1868', 'hi', None, now=100.0)
+    claimed = db.claim(now=100.0, limit=10, lease=60.0)
+    assert [j['id'] for j in claimed] == [job['id']]
+    assert db.get(job['id'])['status'] == SENDING
+    # The worker holding it dies: nobody else may take it while the lease runs...
+    assert db.claim(now=150.0, limit=10, lease=60.0) == []
+    # ...and once it expires another worker picks it up again (at-least-once).
+    db.close()
+    db = _QueueDB(str(tmp_path / 'queue.db'))
+    reclaimed = db.claim(now=161.0, limit=10, lease=60.0)
+    assert [j['id'] for j in reclaimed] == [job['id']]
+    db.finish(job['id'], SENT, now=162.0, attempts=1, sid='SM1')
+    assert db.claim(now=1000.0, limit=10, lease=60.0) == []
+    db.close()
+
+
+def test_dispatcher_delivers_queued_jobs(tmp_path):
+    async def scenario():
+        queue = WhatsAppQueue(str(tmp_path / 'queue.db'), shaper=None, poll_interval=0.01, backoff_base=0.01)
+        sent, attempts = [], {}
+
+        async def send(to, body):
+            attempts[body] = attempts.get(body, 0) + 1
+            if body == 'flaky' and attempts[body] == 1:
+                raise RetryableSendError('Twilio HTTP 500')
+            sent.append(body)
+            return f'SM-{body}'
+
+        queue.start(send)
+        jobs = [(await queue.enqueue('1868', body))[0] for body in ('one', 'flaky')]
+        for _ in range(200):
+            rows = [await queue.get(job['id']) for job in jobs]
+            if all(row['status'] == SENT for row in rows):
+                break
+            await asyncio.sleep(0.01)
+        assert [row['status'] for row in rows] == [SENT, SENT]
+        assert rows[1]['attempts'] == 2 and rows[1]['sid'] == 'SM-flaky'
+        await queue.aclose()
+
+    _run(scenario())
@@ -0,0 +1,242 @@
+"""
+Token-aware prompt budgeting: count, trim and size every chat request to the
+model's context window.
+
+Ollama runs each model with a fixed context (num_ctx, 2048-4096 tokens by
+default) and silently drops the start of a prompt that does not fit, which
+takes the system prompt with it. Character caps are a poor proxy for that, so
+every request is fitted here:
+
+  * num_ctx is sent explicitly and is constant per model — a different
+    num_ctx per request would make Ollama reload the model;
+  * the completion gets min(max_tokens, num_ctx / 2) tokens of headroom;
+  * a prompt that still does not fit loses its oldest non-system turns first;
+    system messages too big to leave half the budget for the latest message
+    are cut at the tail, then the tail of the latest message is truncated.
+
+By default — and as shipped (requirements.txt does not include `tokenizers`,
+no TOKENIZER_DIR, TOKENIZER_DOWNLOAD=0) — every count is a conservative
+estimate (about 2 tokens per 7 characters, or one per word, whichever is
+higher), which errs towards trimming early. Exact counts come from the model's
+own tokenizer when the optional `tokenizers` package (pip install tokenizers)
+and a tokenizer.json are available — from TOKENIZER_DIR/<model>.json (':' and
+'/' replaced by '_'), or downloaded from the Hugging Face repo in
+TOKENIZER_MODELS when TOKENIZER_DOWNLOAD=1. Tokenizers are loaded once per
+model in the background; until then, and for unknown models, the estimate is
+used. Counts for static system prompts (personas, listing prompts) are memoized.
+
+Env config:
+    OLLAMA_NUM_CTX=4096                          context window sent for every model
+    OLLAMA_MODEL_NUM_CTX=qwen2.5:7b=8192,...     per-model override
+    MAX_PROMPT_TOKENS=1200                       cap on user-supplied input (was 4000 characters)
+    TOKENIZER_DIR=/models/tokenizers
+    TOKENIZER_MODELS=qwen2.5:7b=Qwen/Qwen2.5-7B-Instruct,...
+    TOKENIZER_DOWNLOAD=0
+"""
+import os
+import re
+import asyncio
+import logging
+from functools import lru_cache
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # optional — falls back to estimate()
+    Tokenizer = None
+
+logger = logging.getLogger(__name__)
+
+# Chat-template tokens around each message (role header, end-of-turn markers).
+MESSAGE_OVERHEAD = 5
+# Never squeeze the completion below this many tokens to fit a long prompt.
+MIN_COMPLETION_TOKENS = 64
+
+DEFAULT_TOKENIZER_MODELS = {
+    'qwen2.5:7b': 'Qwen/Qwen2.5-7B-Instruct',
+    'qwen3:4b': 'Qwen/Qwen3-4B',
+    'llama3.2:3b': 'meta-llama/Llama-3.2-3B-Instruct',
+    'qwen3-vl:8b': 'Qwen/Qwen3-VL-8B-Instruct',
+}
+
+_WORDS = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate(text: str) -> int:
+    """Tokenizer-free estimate; errs high for English (BPE vocabularies average ~4 chars/token)."""
+    if not text:
+        return 0
+    return max(len(text) * 2 // 7, len(_WORDS.findall(text)) if len(text) < 20000 else 0)
+
+
+def _parse_map(spec: str) -> dict:
+    out = {}
+    for part in (spec or '').split(','):
+        name, sep, value = part.strip().rpartition('=')
+        if sep and name and value:
+            out[name] = value
+    return out
+
+
+class TokenBudget:
+    def __init__(self, num_ctx: int = 4096, overrides: dict = None, max_prompt_tokens: int = 1200,
+                 tokenizer_dir: str = None, tokenizer_models: dict = None, download: bool = False):
+        self.num_ctx = num_ctx
+        self.overrides = {m: int(v) for m, v in (overrides or {}).items()}
+        self.max_prompt_tokens = max_prompt_tokens
+        self.tokenizer_dir = tokenizer_dir
+        self.tokenizer_models = dict(tokenizer_models or DEFAULT_TOKENIZER_MODELS)
+        self.download = download
+        self._tokenizers = {}  # model -> Tokenizer, or None once loading failed
+        self.trimmed = 0       # requests whose prompt had to be cut to fit
+        self._count_static = lru_cache(maxsize=512)(self._count)
+
+    @classmethod
+    def from_env(cls) -> 'TokenBudget':
+        models = dict(DEFAULT_TOKENIZER_MODELS)
+        models.update(_parse_map(os.environ.get('TOKENIZER_MODELS', '')))
+        return cls(
+            num_ctx=int(os.environ.get('OLLAMA_NUM_CTX', '4096')),
+            overrides=_parse_map(os.environ.get('OLLAMA_MODEL_NUM_CTX', '')),
+            max_prompt_tokens=int(os.environ.get('MAX_PROMPT_TOKENS', '1200')),
+            tokenizer_dir=os.environ.get('TOKENIZER_DIR'),
+            tokenizer_models=models,
+            download=os.environ.get('TOKENIZER_DOWNLOAD', '0').lower() in ('1', 'true', 'yes'),
+        )
+
+    def context_window(self, model: str) -> int:
+        return self.overrides.get(model, self.num_ctx)
+
+    # ── Tokenizers ───────────────────────────────────────────────────────────
+
+    def _load(self, model: str):
+        """Blocking: read or download one tokenizer (run via asyncio.to_thread)."""
+        if Tokenizer is None:
+            return None
+        if self.tokenizer_dir:
+            path = os.path.join(self.tokenizer_dir, model.replace(':', '_').replace('/', '_') + '.json')
+            if os.path.exists(path):
+                return Tokenizer.from_file(path)
+        repo = self.tokenizer_models.get(model)
+        if repo and self.download:
+            return Tokenizer.from_pretrained(repo)
+        return None
+
+    async def load_all(self, models):
+        """Load tokenizers for `models` off the event loop (call once at startup)."""
+        for model in models:
+            if model in self._tokenizers:
+                continue
+            try:
+                tokenizer = await asyncio.to_thread(self._load, model)
+            except Exception as e:
+                tokenizer = None
+                logger.warning(f"Tokenizer for {model} unavailable, estimating token counts: {e}")
+            self._tokenizers[model] = tokenizer
+            if tokenizer is not None:
+                self._count_static.cache_clear()  # drop estimates memoized before it loaded
+                logger.info(f"Loaded tokenizer for {model}")
+
+    def has_tokenizer(self, model: str) -> bool:
+        return self._tokenizers.get(model) is not None
+
+    # ── Counting ─────────────────────────────────────────────────────────────
+
+    def _count(self, model: str, text: str) -> int:
+        tokenizer = self._tokenizers.get(model)
+        if tokenizer is None:
+            return estimate(text)
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def count(self, model: str, text: str, static: bool = False) -> int:
+        """Tokens in `text` for `model`; static=True memoizes (use for fixed system prompts)."""
+        return self._count_static(model, text) if static else self._count(model, text)
+
+    def count_messages(self, model: str, messages: list) -> int:
+        return sum(self._message_tokens(model, m) for m in messages)
+
+    def _message_tokens(self, model: str, message: dict) -> int:
+        content = str(message.get('content') or '')
+        return MESSAGE_OVERHEAD + self.count(model, content, static=message.get('role') == 'system')
+
+    def too_long(self, model: str, text: str) -> bool:
+        """User input over MAX_PROMPT_TOKENS (cheap length check first, so huge bodies are not tokenized)."""
+        if not text:
+            return False
+        if len(text) > self.max_prompt_tokens * 8:
+            return True
+        return self.count(model, text) > self.max_prompt_tokens
+
+    # ── Fitting ──────────────────────────────────────────────────────────────
+
+    def fit(self, model: str, messages: list, max_tokens: int):
+        """
+        Size a chat request to `model`'s window. Returns (messages, options, info):
+        options carry num_ctx and num_predict; info has the prompt token count and
+        whether anything was cut.
+        """
+        window = self.context_window(model)
+        reserve = max(min(max_tokens, window // 2), 1)
+        budget = window - reserve
+        counts = [self._message_tokens(model, m) for m in messages]
+        total = sum(counts)
+        trimmed = False
+        if total > budget:
+            trimmed = True
+            messages, counts = list(messages), list(counts)
+            # Oldest turns first; keep system messages and the latest message.
+            i = 0
+            while total > budget and i < len(messages) - 1:
+                if messages[i].get('role') == 'system':
+                    i += 1
+                    continue
+                total -= counts.pop(i)
+                messages.pop(i)
+            # A (client-supplied) system prompt alone may not fit: cut system
+            # messages so at least half the budget is left for the latest message.
+            latest = counts[-1] if messages[-1].get('role') != 'system' else 0
+            system_excess = (total - latest) - (budget - min(latest, budget // 2))
+            for i in range(len(messages) - (1 if latest else 0)):
+                if system_excess <= 0:
+                    break
+                if messages[i].get('role') != 'system':
+                    continue
+                before = counts[i]
+                messages[i], counts[i] = self._truncate(model, messages[i], max(before - system_excess, 0))
+                system_excess -= before - counts[i]
+                total -= before - counts[i]
+            if total > budget:
+                messages[-1], counts[-1] = self._truncate(model, messages[-1], counts[-1] - (total - budget))
+                total = sum(counts)
+        if trimmed:
+            self.trimmed += 1
+        num_predict = max(min(max_tokens, window - total), MIN_COMPLETION_TOKENS)
+        return messages, {'num_ctx': window, 'num_predict': num_predict}, {
+            'prompt_tokens': total, 'trimmed': trimmed}
+
+    def _truncate(self, model: str, message: dict, target: int):
+        """Cut the end of one message down to about `target` tokens (overhead included)."""
+        content = str(message.get('content') or '')
+        keep = max(target - MESSAGE_OVERHEAD, 0)
+        tokenizer = self._tokenizers.get(model)
+        if tokenizer is not None:
+            encoding = tokenizer.encode(content, add_special_tokens=False)
+            end = encoding.offsets[keep - 1][1] if 0 < keep <= len(encoding.offsets) else (
+                len(content) if keep else 0)
+            content = content[:end]
+        else:
+            # Shrink proportionally until the estimate fits.
+            while content and estimate(content) > keep:
+                content = content[:int(len(content) * max(keep, 1) / estimate(content) * 0.95)]
+        message = dict(message, content=content)
+        return message, self._message_tokens(model, message)
+
+    def stats(self) -> dict:
+        return {
+            'trimmed': self.trimmed,
+            'context_windows': {m: self.context_window(m) for m in self.tokenizer_models},
+            'tokenizers': {m: self.has_tokenizer(m) for m in self.tokenizer_models},
+            'static_counts_cached': self._count_static.cache_info().currsize,
+        }
+
+
+token_budget = TokenBudget.from_env()
@@ -0,0 +1,371 @@
+"""
+Durable queue for outbound WhatsApp messages (Twilio).
+
+/send-whatsapp used to call Twilio inline, so every checkout waited on a
+Twilio round trip and a failed send was simply reported back. Messages are now
+written to a local SQLite table and the endpoint returns a job id at once; a
+dispatcher in each worker sends them in the background:
+
+  * claims due jobs in batches (one transaction per batch) and sends them
+    through a pool of WHATSAPP_WORKERS concurrent senders;
+  * paces sends for the whole account (WHATSAPP_MAX_PER_SECOND) and shapes
+    them per destination (WHATSAPP_PER_DESTINATION_PER_MIN) with the same GCRA
+    backends as the HTTP rate limiter — a job over its number's rate is
+    deferred, not failed;
+  * retries 429s, 5xx and network errors with exponential backoff and jitter
+    (honouring Retry-After) up to WHATSAPP_MAX_ATTEMPTS; other 4xx answers
+    (bad number, unapproved template) fail at once;
+  * is idempotent per dedupe key: the caller's idempotency_key, or else
+    (order_id, recipient, body) — re-posting the same message returns the
+    existing job instead of sending twice, while an order's later updates
+    ("shipped", "delivered") are new messages.
+
+Claims carry a lease, so jobs held by a worker that died are picked up again
+after WHATSAPP_LEASE seconds — delivery is at-least-once. All workers drain one
+table, kept in AI_SERVER_DATA_DIR (default: data/ next to this file, a volume
+in docker-compose.yml) — not in the tmp state dir, so queued messages survive
+reboots and tmp cleanup.
+
+Env config:
+    AI_SERVER_DATA_DIR=./data
+    WHATSAPP_QUEUE_PATH=$AI_SERVER_DATA_DIR/whatsapp_queue.db
+    WHATSAPP_WORKERS=8
+    WHATSAPP_BATCH_SIZE=20
+    WHATSAPP_MAX_ATTEMPTS=6
+    WHATSAPP_BACKOFF_BASE=2          seconds before the first retry (doubles per attempt)
+    WHATSAPP_BACKOFF_MAX=300
+    WHATSAPP_PER_DESTINATION_PER_MIN=6
+    WHATSAPP_MAX_PER_SECOND=20
+    WHATSAPP_LEASE=60
+    WHATSAPP_JOB_RETENTION=604800    seconds finished jobs stay queryable (7 days)
+"""
+import os
+import time
+import uuid
+import hashlib
+import random
+import asyncio
+import logging
+import sqlite3
+import threading
+
+import httpx
+
+from rate_limiter import backend_from_env, check_async
+
+logger = logging.getLogger(__name__)
+
+QUEUED, SENDING, SENT, FAILED = 'queued', 'sending', 'sent', 'failed'
+DATA_DIR = os.environ.get('AI_SERVER_DATA_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+_COLUMNS = ('id', 'order_id', 'to_number', 'body', 'status', 'attempts', 'next_attempt_at',
+            'sid', 'last_error', 'created_at', 'updated_at')
+
+
+class _QueueDB:
+    """SQLite job table. All methods are blocking — call via asyncio.to_thread."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10.0)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS whatsapp_jobs ('
+            ' id TEXT PRIMARY KEY, order_id TEXT, to_number TEXT NOT NULL, body TEXT NOT NULL,'
+            ' status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL,'
+            ' lease_until REAL, sid TEXT, last_error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)'
+        )
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(whatsapp_jobs)')}
+        if 'dedupe_key' not in columns:  # tables created before idempotency keys
+            self._db.execute('ALTER TABLE whatsapp_jobs ADD COLUMN dedupe_key TEXT')
+        # Idempotency used to be per (order_id, to_number), which swallowed an order's later updates.
+        self._db.execute('DROP INDEX IF EXISTS whatsapp_jobs_order')
+        self._db.execute('CREATE UNIQUE INDEX IF NOT EXISTS whatsapp_jobs_dedupe'
+                         ' ON whatsapp_jobs(dedupe_key) WHERE dedupe_key IS NOT NULL')
+        self._db.execute('CREATE INDEX IF NOT EXISTS whatsapp_jobs_due ON whatsapp_jobs(status, next_attempt_at)')
+
+    def _row(self, row) -> dict:
+        return dict(zip(_COLUMNS, row)) if row is not None else None
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._row(self._db.execute(
+                f'SELECT {", ".join(_COLUMNS)} FROM whatsapp_jobs WHERE id = ?', (job_id,)).fetchone())
+
+    def enqueue(self, order_id, to_number: str, body: str, dedupe_key, now: float):
+        """Insert a job; returns (job, created). A job with the same dedupe_key is returned as is."""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            try:
+                self._db.execute(
+                    'INSERT INTO whatsapp_jobs (id, order_id, to_number, body, dedupe_key, status,'
+                    ' next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (job_id, order_id, to_number, body, dedupe_key, QUEUED, now, now, now))
+                created = True
+            except sqlite3.IntegrityError:
+                job_id = self._db.execute(
+                    'SELECT id FROM whatsapp_jobs WHERE dedupe_key = ?', (dedupe_key,)).fetchone()[0]
+                created = False
+            return self._row(self._db.execute(
+                f'SELECT {", ".join(_COLUMNS)} FROM whatsapp_jobs WHERE id = ?', (job_id,)).fetchone()), created
+
+    def claim(self, now: float, limit: int, lease: float) -> list:
+        """Lease up to `limit` due jobs (including ones whose previous lease expired)."""
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._db.execute(
+                    f'SELECT {", ".join(_COLUMNS)} FROM whatsapp_jobs'
+                    ' WHERE (status = ? AND next_attempt_at <= ?) OR (status = ? AND lease_until < ?)'
+                    ' ORDER BY next_attempt_at LIMIT ?', (QUEUED, now, SENDING, now, limit)).fetchall()
+                self._db.executemany(
+                    'UPDATE whatsapp_jobs SET status = ?, lease_until = ?, updated_at = ? WHERE id = ?',
+                    [(SENDING, now + lease, now, row[0]) for row in rows])
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        return [self._row(row) for row in rows]
+
+    def finish(self, job_id: str, status: str, now: float, attempts: int, sid: str = None, error: str = None):
+        with self._lock:
+            self._db.execute(
+                'UPDATE whatsapp_jobs SET status = ?, attempts = ?, sid = ?, last_error = ?, lease_until = NULL,'
+                ' updated_at = ? WHERE id = ?', (status, attempts, sid, error, now, job_id))
+
+    def reschedule(self, job_id: str, at: float, now: float, attempts: int, error: str = None):
+        with self._lock:
+            self._db.execute(
+                'UPDATE whatsapp_jobs SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?,'
+                ' lease_until = NULL, updated_at = ? WHERE id = ?', (QUEUED, attempts, at, error, now, job_id))
+
+    def counts(self) -> dict:
+        with self._lock:
+            return dict(self._db.execute('SELECT status, COUNT(*) FROM whatsapp_jobs GROUP BY status').fetchall())
+
+    def purge(self, before: float) -> int:
+        with self._lock:
+            return self._db.execute('DELETE FROM whatsapp_jobs WHERE status IN (?, ?) AND updated_at < ?',
+                                    (SENT, FAILED, before)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RetryableSendError(Exception):
+    """Twilio answered 429/5xx; retry after `retry_after` seconds if given."""
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class WhatsAppQueue:
+    def __init__(self, path: str, workers: int = 8, batch_size: int = 20, max_attempts: int = 6,
+                 backoff_base: float = 2.0, backoff_max: float = 300.0, per_destination_per_min: float = 6,
+                 max_per_second: float = 20, lease: float = 60.0, retention: float = 7 * 86400,
+                 poll_interval: float = 0.5, shaper=None):
+        self.path = path
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.per_destination_per_min = per_destination_per_min
+        self.max_per_second = max_per_second
+        self.lease = lease
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self.shaper = shaper
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.deferred = 0   # held back by rate shaping
+        self.depth = {}     # status -> jobs, as of the last refresh
+        self._db = None
+        self._send = None
+        self._wake = None
+        self._slots = None
+        self._dispatcher = None
+        self._in_flight = set()
+
+    @classmethod
+    def from_env(cls) -> 'WhatsAppQueue':
+        return cls(
+            path=os.environ.get('WHATSAPP_QUEUE_PATH') or os.path.join(DATA_DIR, 'whatsapp_queue.db'),
+            workers=int(os.environ.get('WHATSAPP_WORKERS', '8')),
+            batch_size=int(os.environ.get('WHATSAPP_BATCH_SIZE', '20')),
+            max_attempts=int(os.environ.get('WHATSAPP_MAX_ATTEMPTS', '6')),
+            backoff_base=float(os.environ.get('WHATSAPP_BACKOFF_BASE', '2')),
+            backoff_max=float(os.environ.get('WHATSAPP_BACKOFF_MAX', '300')),
+            per_destination_per_min=float(os.environ.get('WHATSAPP_PER_DESTINATION_PER_MIN', '6')),
+            max_per_second=float(os.environ.get('WHATSAPP_MAX_PER_SECOND', '20')),
+            lease=float(os.environ.get('WHATSAPP_LEASE', '60')),
+            retention=float(os.environ.get('WHATSAPP_JOB_RETENTION', str(7 * 86400))),
+            shaper=backend_from_env('whatsapp'),
+        )
+
+    # ── Producer side ────────────────────────────────────────────────────────
+
+    @staticmethod
+    def dedupe_key(to_number: str, body: str, order_id: str = None, idempotency_key: str = None):
+        """The caller's key, else (order, recipient, body); None (never deduplicated) without either."""
+        if idempotency_key:
+            return f'key:{idempotency_key}'
+        if order_id:
+            digest = hashlib.sha256(body.encode('utf-8')).hexdigest()[:32]
+            return f'order:{order_id}:{to_number}:{digest}'
+        return None
+
+    async def enqueue(self, to_number: str, body: str, order_id: str = None, idempotency_key: str = None):
+        """Queue one message; returns (job, created). Safe to call again with the same key."""
+        key = self.dedupe_key(to_number, body, order_id, idempotency_key)
+        job, created = await asyncio.to_thread(self._db.enqueue, order_id or None, to_number, body, key, time.time())
+        if created and self._wake is not None:
+            self._wake.set()
+        return job, created
+
+    async def get(self, job_id: str):
+        if not job_id.isalnum():
+            return None
+        return await asyncio.to_thread(self._db.get, job_id)
+
+    # ── Dispatcher ───────────────────────────────────────────────────────────
+
+    async def _shape(self, to_number: str):
+        """(allowed, retry_after) against the per-destination rate; deferred jobs go back to the table."""
+        if self.shaper is None or self.per_destination_per_min <= 0:
+            return True, 0.0
+        interval = 60.0 / self.per_destination_per_min
+        # Burst of 2 per number (an order's notification plus its confirmation).
+        return await check_async(self.shaper, ('whatsapp', to_number), time.monotonic(), interval, 2 * interval)
+
+    async def _pace(self):
+        """Wait for the account-wide rate (shared by all workers) to admit one more send."""
+        if self.shaper is None or self.max_per_second <= 0:
+            return
+        interval = 1.0 / self.max_per_second
+        while True:
+            allowed, retry = await check_async(self.shaper, ('whatsapp', '*'), time.monotonic(), interval,
+                                               max(1.0, interval))
+            if allowed:
+                return
+            await asyncio.sleep(retry)
+
+    def _backoff(self, attempts: int, retry_after: float = None) -> float:
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+        return max(delay, retry_after or 0.0)
+
+    async def _process(self, job: dict):
+        try:
+            allowed, wait = await self._shape(job['to_number'])
+            if not allowed:
+                self.deferred += 1
+                await asyncio.to_thread(self._db.reschedule, job['id'], time.time() + wait, time.time(),
+                                        job['attempts'], job['last_error'])
+                return
+            attempts = job['attempts'] + 1
+            try:
+                sid = await self._send(job['to_number'], job['body'])
+            except RetryableSendError as e:
+                error, retry_after, retryable = str(e), e.retry_after, True
+            except httpx.TransportError as e:
+                error, retry_after, retryable = f'{type(e).__name__}: {e}', None, True
+            except Exception as e:
+                error, retry_after, retryable = str(e) or type(e).__name__, None, False
+            else:
+                self.sent += 1
+                await asyncio.to_thread(self._db.finish, job['id'], SENT, time.time(), attempts, sid=sid)
+                return
+            if retryable and attempts < self.max_attempts:
+                self.retried += 1
+                delay = self._backoff(attempts, retry_after)
+                await asyncio.to_thread(self._db.reschedule, job['id'], time.time() + delay, time.time(),
+                                        attempts, error[:500])
+            else:
+                self.failed += 1
+                logger.warning(f"WhatsApp job {job['id']} failed after {attempts} attempt(s): {error}")
+                await asyncio.to_thread(self._db.finish, job['id'], FAILED, time.time(), attempts,
+                                        error=error[:500])
+        except sqlite3.Error as e:
+            logger.warning(f"WhatsApp queue update failed for {job['id']}: {e}")  # lease expiry retries it
+        finally:
+            self._slots.release()
+
+    async def _dispatch_forever(self):
+        last_refresh = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_refresh > 5:
+                    last_refresh = time.monotonic()
+                    await asyncio.to_thread(self._db.purge, time.time() - self.retention)
+                    self.depth = await asyncio.to_thread(self._db.counts)
+                    if self.shaper is not None:
+                        self.shaper.sweep(time.monotonic())
+                await self._slots.acquire()  # at least one sender free before claiming
+                free = 1
+                while free < self.batch_size and not self._slots.locked():
+                    await self._slots.acquire()
+                    free += 1
+                self._wake.clear()  # before claiming, so an enqueue during the claim is not missed
+                jobs = await asyncio.to_thread(self._db.claim, time.time(), free, self.lease)
+                for _ in range(free - len(jobs)):
+                    self._slots.release()
+                for job in jobs:
+                    await self._pace()
+                    task = asyncio.ensure_future(self._process(job))
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._in_flight.discard)
+                if not jobs:
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"WhatsApp dispatcher error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    def start(self, send):
+        """
+        Open the queue and start dispatching (call from the app lifespan).
+        `await send(to_number, body)` delivers one message and returns its sid.
+        """
+        if self._dispatcher is not None:
+            return
+        if self._db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = _QueueDB(self.path)
+        self._send = send
+        self._wake = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._dispatcher = asyncio.ensure_future(self._dispatch_forever())
+
+    async def aclose(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        # Jobs cut off mid-send stay leased and are retried after WHATSAPP_LEASE.
+        for task in list(self._in_flight):
+            task.cancel()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if self.shaper is not None:
+            self.shaper.close()
+
+    def stats(self) -> dict:
+        return {
+            'queue': dict(self.depth),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'deferred': self.deferred,
+            'sending': len(self._in_flight),
+            'workers': self.workers,
+        }
+
+
+whatsapp_queue = WhatsAppQueue.from_env()
@@ -0,0 +1,91 @@
+"""
+Compare the JSON bundle with packs (bundle_format.py): build time, size on
+disk, time to pull out one file, and time to load every file.
+
+    python scripts/bench_bundle.py                    # this repo
+    python scripts/bench_bundle.py ~/Trinibuild --file ai_server/main.py --repeat 20
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+import bundle_format
+from bundle_project import PROJECT_ROOT, bundle_project, pack_project
+
+def _median_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+def _quiet(fn, *args, **kwargs):
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def _json_one(path, name):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)[name]
+
+def _json_all(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return len(json.load(f))
+
+def _pack_one(path, name):
+    with bundle_format.PackReader(path) as pack:
+        return pack.read_text(name)
+
+def _pack_all(path):
+    with bundle_format.PackReader(path) as pack:
+        return sum(1 for _ in pack.items())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('project_root', nargs='?', default=PROJECT_ROOT)
+    parser.add_argument('--file', help='entry to read back (default: the largest file)')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    codecs = ['zlib', 'none'] + (['zstd'] if bundle_format.zstandard is not None else [])
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, 'bundle.json')
+        start = time.perf_counter()
+        result = _quiet(bundle_project, args.project_root, json_path, 'json', workers=1)
+        rows.append(('json', json_path, time.perf_counter() - start))
+        if not result['files']:
+            raise SystemExit(f"no files to bundle under {args.project_root}")
+        for codec in codecs:
+            pack_path = os.path.join(tmp, f'bundle.{codec}.pack')
+            start = time.perf_counter()
+            stats = _quiet(pack_project, args.project_root, pack_path, codec)
+            rows.append((f'pack ({codec})', pack_path, time.perf_counter() - start))
+
+        with bundle_format.PackReader(rows[1][1]) as pack:
+            name = args.file or max(pack, key=lambda p: len(pack.read_bytes(p)))
+            if name not in pack:
+                raise SystemExit(f"{name} is not in the bundle")
+
+        print(f"\n{result['files']} files, {stats['raw_bytes']:,} bytes of source, "
+              f"{stats['duplicates']} duplicate contents; reading back {name}")
+        print(f"{'format':<14}{'size':>14}{'build s':>10}{'one file ms':>14}{'all files ms':>15}")
+        for label, path, build in rows:
+            if label == 'json':
+                one = _median_ms(lambda: _json_one(path, name), args.repeat)
+                every = _median_ms(lambda: _json_all(path), args.repeat)
+            else:
+                one = _median_ms(lambda: _pack_one(path, name), args.repeat)
+                every = _median_ms(lambda: _pack_all(path), args.repeat)
+            print(f"{label:<14}{os.path.getsize(path):>14,}{build:>10.2f}{one:>14.2f}{every:>15.1f}")
+
+if __name__ == "__main__":
+    sys.exit(main())
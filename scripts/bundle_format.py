@@ -0,0 +1,233 @@
+"""
+Packed project bundle: content-addressed, deduplicated, compressed, indexed.
+
+The JSON bundle repeats identical files (copied components, duplicated
+templates) and has to be parsed in full to get at any one of them. A pack
+stores each distinct content once, compressed on its own, with a sorted index
+at the end, so a reader can mmap the file and pull out a single entry with a
+binary search and one decompression.
+
+Layout (little-endian):
+
+    header   32 bytes   magic "TBBUNDL1", entries u32, blobs u32, index offset u64, reserved
+    blobs               compressed file contents, one per distinct SHA-256
+    blob table          per blob: offset u64, stored length u32, raw length u32, codec u8,
+                        first 12 bytes of the SHA-256 (32 bytes per record)
+    entry table         per path, sorted by UTF-8 bytes: path offset u32, path length u16,
+                        blob u32 (12 bytes per record)
+    path table          the UTF-8 paths, concatenated
+
+Codecs are chosen per blob: zstd (pip install zstandard) or zlib (the deflate
+stream inside gzip), and a blob is stored raw when compression does not make
+it smaller.
+
+    from bundle_format import PackReader
+    with PackReader('trinibuild_project_bundle.pack') as pack:
+        source = pack.read_text('ai_server/main.py')
+"""
+import io
+import os
+import mmap
+import zlib
+import struct
+import hashlib
+
+try:
+    import zstandard
+except ImportError:  # optional — zlib is used instead
+    zstandard = None
+
+MAGIC = b'TBBUNDL1'
+HEADER = struct.Struct('<8sIIQ8x')
+BLOB = struct.Struct('<QIIB3x12s')
+ENTRY = struct.Struct('<IH2xI')
+
+RAW, ZLIB, ZSTD = 0, 1, 2
+CODECS = {'none': RAW, 'zlib': ZLIB, 'zstd': ZSTD}
+DEFAULT_CODEC = 'zstd' if zstandard is not None else 'zlib'
+
+
+class PackError(Exception):
+    pass
+
+
+def compress(data: bytes, codec: str, level: int = None):
+    """(codec id, payload) for one blob; falls back to RAW when compression does not help."""
+    if codec == 'zstd':
+        if zstandard is None:
+            raise PackError('zstd needs the zstandard package (pip install zstandard)')
+        payload, codec_id = zstandard.ZstdCompressor(level=level or 6).compress(data), ZSTD
+    elif codec == 'zlib':
+        payload, codec_id = zlib.compress(data, level or 6), ZLIB
+    else:
+        return RAW, data
+    return (codec_id, payload) if len(payload) < len(data) else (RAW, data)
+
+
+def decompress(codec_id: int, payload: bytes, raw_length: int) -> bytes:
+    if codec_id == RAW:
+        return payload
+    if codec_id == ZLIB:
+        return zlib.decompress(payload, bufsize=max(raw_length, 1))
+    if codec_id == ZSTD:
+        if zstandard is None:
+            raise PackError('this pack uses zstd; pip install zstandard to read it')
+        return zstandard.ZstdDecompressor().decompress(payload, max_output_size=raw_length)
+    raise PackError(f'unknown codec {codec_id}')
+
+
+class PackWriter:
+    """
+    Streams blobs to `path` as entries are added; the index is written by close().
+    Compress off the writer's thread with compress() and pass the result to add(),
+    or let add() do it.
+    """
+
+    def __init__(self, path: str, codec: str = DEFAULT_CODEC):
+        if codec not in CODECS:
+            raise PackError(f'unknown codec {codec!r} (choose from {", ".join(CODECS)})')
+        self.path = path
+        self.codec = codec
+        self._f = open(path, 'wb')
+        self._f.write(HEADER.pack(MAGIC, 0, 0, 0))
+        self._offset = HEADER.size
+        self._blobs = []    # BLOB records
+        self._by_hash = {}  # sha256 digest -> blob number
+        self._entries = {}  # path -> blob number
+        self.raw_bytes = 0
+        self.duplicates = 0
+
+    def add(self, path: str, data: bytes, digest: bytes = None, compressed=None) -> bool:
+        """Add one file; returns False if its content was already stored (deduplicated)."""
+        if path in self._entries:
+            raise PackError(f'duplicate path {path}')
+        digest = digest or hashlib.sha256(data).digest()
+        self.raw_bytes += len(data)
+        blob = self._by_hash.get(digest)
+        if blob is not None:
+            self._entries[path] = blob
+            self.duplicates += 1
+            return False
+        codec_id, payload = compressed or compress(data, self.codec)
+        self._f.write(payload)
+        blob = self._by_hash[digest] = len(self._blobs)
+        self._blobs.append(BLOB.pack(self._offset, len(payload), len(data), codec_id, digest[:12]))
+        self._offset += len(payload)
+        self._entries[path] = blob
+        return True
+
+    def close(self):
+        index_offset = self._offset
+        self._f.write(b''.join(self._blobs))
+        names = sorted((path.encode('utf-8'), blob) for path, blob in self._entries.items())
+        paths, entries, cursor = io.BytesIO(), [], 0
+        for name, blob in names:
+            entries.append(ENTRY.pack(cursor, len(name), blob))
+            paths.write(name)
+            cursor += len(name)
+        self._f.write(b''.join(entries))
+        self._f.write(paths.getvalue())
+        self._f.seek(0)
+        self._f.write(HEADER.pack(MAGIC, len(names), len(self._blobs), index_offset))
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self._f.close()
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'blobs': len(self._blobs), 'duplicates': self.duplicates,
+                'raw_bytes': self.raw_bytes, 'stored_bytes': self._offset - HEADER.size}
+
+
+class PackReader:
+    """
+    Random access to a pack through mmap: opening reads only the header, and
+    each lookup is a binary search over the entry table plus one decompression.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, self._count, blobs, index_offset = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC:
+                raise PackError(f'{path} is not a bundle pack')
+            self._blob_base = index_offset
+            self._entry_base = index_offset + blobs * BLOB.size
+            self._path_base = self._entry_base + self._count * ENTRY.size
+            if self._path_base > len(self._mm):
+                raise PackError(f'{path} is truncated')
+        except Exception:
+            self._mm.close()
+            raise
+
+    def _entry(self, i: int):
+        """(path bytes, blob number) of the i-th entry in path order."""
+        path_offset, path_length, blob = ENTRY.unpack_from(self._mm, self._entry_base + i * ENTRY.size)
+        start = self._path_base + path_offset
+        return self._mm[start:start + path_length], blob
+
+    def _find(self, path: str):
+        name = path.encode('utf-8')
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count:
+            found, blob = self._entry(lo)
+            if found == name:
+                return blob
+        return None
+
+    def read_bytes(self, path: str) -> bytes:
+        blob = self._find(path)
+        if blob is None:
+            raise KeyError(path)
+        offset, length, raw_length, codec_id, _ = BLOB.unpack_from(self._mm, self._blob_base + blob * BLOB.size)
+        return decompress(codec_id, self._mm[offset:offset + length], raw_length)
+
+    def read_text(self, path: str) -> str:
+        return self.read_bytes(path).decode('utf-8')
+
+    def get(self, path: str, default=None):
+        try:
+            return self.read_text(path)
+        except KeyError:
+            return default
+
+    def paths(self):
+        for i in range(self._count):
+            yield self._entry(i)[0].decode('utf-8')
+
+    def items(self):
+        """(path, text) for every entry, in path order."""
+        for path in self.paths():
+            yield path, self.read_text(path)
+
+    def __contains__(self, path: str) -> bool:
+        return self._find(path) is not None
+
+    def __iter__(self):
+        return self.paths()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def close(self):
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,13 +1,40 @@
+"""
+Bundle the project's source files into one JSON (or NDJSON) file, or a pack.
+
+Entries are streamed to the output one file at a time, so memory stays flat
+however large the tree is; files are read by a thread pool. With --incremental
+a manifest (mtime, size, sha256 and the entry's byte range in the previous
+bundle) is kept next to the output, and unchanged files are copied straight
+from the previous bundle instead of being read again.
+
+    python scripts/bundle_project.py                      # this repo -> trinibuild_project_bundle.json
+    python scripts/bundle_project.py ~/Trinibuild -o /tmp/bundle.ndjson --format ndjson
+    python scripts/bundle_project.py --incremental        # re-read only what changed
+    python scripts/bundle_project.py --format pack        # deduplicated, compressed, indexed
+
+A pack (see bundle_format.py) stores each distinct file content once,
+compressed, behind an index that PackReader can search without loading the
+rest of the file.
+"""
 import os
+import sys
 import json
+import time
+import hashlib
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import bundle_format
 
 # Configuration
-PROJECT_ROOT = r"c:\Users\RAY\OneDrive\Documents\Trinibuild"
-OUTPUT_FILE = r"c:\Users\RAY\OneDrive\Documents\Trinibuild\trinibuild_project_bundle.json"
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT_NAME = "trinibuild_project_bundle.json"
+MANIFEST_VERSION = 1
 
 # Directories to ignore
 IGNORE_DIRS = {
-    'node_modules', '.git', '.vercel', '.vite', 'dist', 'build', '__pycache__', 
+    'node_modules', '.git', '.vercel', '.vite', 'dist', 'build', '__pycache__',
     'coverage', '.idea', '.vscode', 'trinibuild-google-ai-studio-', 'temp_app',
     'TRINI ANTIGRAVITY' # Looks like a backup or nested folder
 }
@@ -19,47 +46,246 @@ INCLUDE_EXTENSIONS = {
 
 # Files to specifically ignore
 IGNORE_FILES = {
-    'package-lock.json', 'yarn.lock', 'pnpm-lock.yaml', 'trinibuild_project_bundle.json', 'session.json'
+    'package-lock.json', 'yarn.lock', 'pnpm-lock.yaml', 'trinibuild_project_bundle.json', 'session.json',
+    'trinibuild_project_bundle.ndjson'
 }
 
+_INCLUDE_SUFFIXES = tuple(INCLUDE_EXTENSIONS)
+
 def is_text_file(filename):
-    return any(filename.endswith(ext) for ext in INCLUDE_EXTENSIONS)
-
-def bundle_project():
-    project_data = {}
-    
-    print(f"Scanning project at {PROJECT_ROOT}...")
-
-    for root, dirs, files in os.walk(PROJECT_ROOT):
-        # Modify dirs in-place to skip ignored directories
-        dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
-        
-        for file in files:
-            if file in IGNORE_FILES:
+    return filename.endswith(_INCLUDE_SUFFIXES)
+
+def iter_files(project_root, skip=(), prefix=''):
+    """Yield (rel_path, full_path, stat) for every file to bundle, in a stable order."""
+    try:
+        entries = sorted(os.scandir(project_root), key=lambda e: e.name)
+    except OSError as e:
+        print(f"Skipping {prefix or project_root}: {e}")
+        return
+    for entry in entries:
+        # Rel paths use forward slashes on every platform, for consistency
+        rel_path = prefix + entry.name
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in IGNORE_DIRS:
+                    yield from iter_files(entry.path, skip, rel_path + '/')
                 continue
-                
-            if not is_text_file(file):
+            if entry.is_dir():
+                continue  # symlink to a directory: not followed (a link loop would never end)
+            if entry.name in IGNORE_FILES or not is_text_file(entry.name) or entry.path in skip:
                 continue
+            yield rel_path, entry.path, entry.stat()
+        except OSError as e:
+            print(f"Skipping {rel_path}: {e}")
 
-            full_path = os.path.join(root, file)
-            rel_path = os.path.relpath(full_path, PROJECT_ROOT)
-            
-            # Normalize path separators to forward slashes for consistency
-            rel_path = rel_path.replace('\\', '/')
+def read_file(full_path, digest=False):
+    """(text, sha256 of the raw bytes if `digest`); newlines normalized as in text-mode reads."""
+    with open(full_path, 'rb') as f:
+        raw = f.read()
+    text = raw.decode('utf-8')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text, hashlib.sha256(raw).hexdigest() if digest else None
 
+def read_parallel(items, read, workers):
+    """
+    Yield (item, result, error) in input order, with reads running on a thread
+    pool. At most a few reads per worker are in flight, so memory stays bounded.
+    """
+    if workers <= 1:
+        for item in items:
             try:
-                with open(full_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    project_data[rel_path] = content
+                yield item, read(item), None
             except Exception as e:
-                print(f"Skipping {rel_path}: {e}")
+                yield item, None, e
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append((item, pool.submit(read, item)))
+            if len(pending) >= workers * 4:
+                yield _result(*pending.popleft())
+        while pending:
+            yield _result(*pending.popleft())
+
+def _result(item, future):
+    try:
+        return item, future.result(), None
+    except Exception as e:
+        return item, None, e
+
+class BundleWriter:
+    """
+    Streams entries to `f` (binary). JSON output matches json.dump(..., indent=2)
+    of the old all-in-memory bundle; NDJSON writes one {"path", "content"} per line.
+    encode() returns an entry's bytes and write() appends pre-encoded bytes, so an
+    unchanged entry can be copied from a previous bundle as-is.
+    """
+
+    def __init__(self, f, fmt):
+        self.f = f
+        self.fmt = fmt
+        self.count = 0
+        self.offset = 0
+        if fmt == 'json':
+            self._emit(b'{')
+
+    def _emit(self, data):
+        self.f.write(data)
+        self.offset += len(data)
+
+    def encode(self, rel_path, content):
+        if self.fmt == 'json':
+            return f'{json.dumps(rel_path)}: {json.dumps(content)}'.encode('utf-8')
+        return json.dumps({'path': rel_path, 'content': content}).encode('utf-8')
+
+    def write(self, entry):
+        """Append one encoded entry; returns its (offset, length) in the output."""
+        if self.fmt == 'json':
+            self._emit(b',\n  ' if self.count else b'\n  ')
+        start = self.offset
+        self._emit(entry)
+        if self.fmt == 'ndjson':
+            self._emit(b'\n')
+        self.count += 1
+        return start, len(entry)
+
+    def close(self):
+        if self.fmt == 'json':
+            self._emit(b'\n}' if self.count else b'}')
+
+def load_manifest(path, fmt, output_file):
+    """The previous run's manifest, or None if it cannot be reused for this output."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        bundle_size = os.path.getsize(output_file)
+    except (OSError, ValueError):
+        return None
+    if (manifest.get('version') != MANIFEST_VERSION or manifest.get('format') != fmt
+            or manifest.get('bundle_size') != bundle_size):
+        return None  # different format, or the bundle was changed since
+    return manifest
+
+def _output_path(project_root, output_file, fmt):
+    return os.path.abspath(output_file or os.path.join(project_root, OUTPUT_NAME.replace('.json', f'.{fmt}')))
+
+def _default_workers():
+    return min(32, (os.cpu_count() or 1) * 4)
+
+def bundle_project(project_root=PROJECT_ROOT, output_file=None, fmt='json', incremental=False,
+                   manifest_file=None, workers=None):
+    project_root = os.path.abspath(project_root)
+    output_file = _output_path(project_root, output_file, fmt)
+    manifest_file = manifest_file or output_file + '.manifest'
+    workers = workers or _default_workers()
+    start = time.perf_counter()
+
+    previous = load_manifest(manifest_file, fmt, output_file) if incremental else None
+    old_files = previous['files'] if previous else {}
+    old_bundle = open(output_file, 'rb') if previous else None
+    files = {}
+    read = reused = 0
+
+    print(f"Scanning project at {project_root}...")
+    tmp_file = output_file + '.tmp'
+    try:
+        with open(tmp_file, 'wb') as out:
+            writer = BundleWriter(out, fmt)
+
+            def load(item):
+                rel_path, full_path, st = item
+                old = old_files.get(rel_path)
+                if old and old['mtime_ns'] == st.st_mtime_ns and old['size'] == st.st_size:
+                    return None  # unchanged: copied from the previous bundle below
+                content, digest = read_file(full_path, digest=incremental)
+                return writer.encode(rel_path, content), digest
+
+            entries = iter_files(project_root, skip={output_file, tmp_file, manifest_file})
+            for (rel_path, _, st), result, error in read_parallel(entries, load, workers):
+                if error is not None:
+                    print(f"Skipping {rel_path}: {error}")
+                    continue
+                if result is None:
+                    old = old_files[rel_path]
+                    old_bundle.seek(old['offset'])
+                    entry, digest = old_bundle.read(old['length']), old['sha256']
+                    reused += 1
+                else:
+                    entry, digest = result
+                    read += 1
+                offset, length = writer.write(entry)
+                files[rel_path] = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'sha256': digest,
+                                   'offset': offset, 'length': length}
+            writer.close()
+    finally:
+        if old_bundle is not None:
+            old_bundle.close()
+    os.replace(tmp_file, output_file)
+
+    if incremental:
+        with open(manifest_file, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'format': fmt, 'bundle_size': os.path.getsize(output_file),
+                       'files': files}, f, separators=(',', ':'))
+
+    elapsed = time.perf_counter() - start
+    print(f"Bundled {len(files)} files ({read} read, {reused} unchanged) in {elapsed:.2f}s.")
+    print(f"Project bundle saved to {output_file}")
+    return {'files': len(files), 'read': read, 'reused': reused, 'seconds': elapsed}
+
+def pack_project(project_root=PROJECT_ROOT, output_file=None, codec=bundle_format.DEFAULT_CODEC, workers=None):
+    """Write a pack (bundle_format.py); files are read and compressed on the thread pool."""
+    project_root = os.path.abspath(project_root)
+    output_file = _output_path(project_root, output_file, 'pack')
+    workers = workers or _default_workers()
+    start = time.perf_counter()
+
+    def load(item):
+        content, _ = read_file(item[1])
+        data = content.encode('utf-8')
+        digest = hashlib.sha256(data).digest()
+        # zlib and zstd release the GIL, so compression runs in parallel too.
+        return data, digest, bundle_format.compress(data, codec)
+
+    print(f"Scanning project at {project_root}...")
+    tmp_file = output_file + '.tmp'
+    with bundle_format.PackWriter(tmp_file, codec) as writer:
+        entries = iter_files(project_root, skip={output_file, tmp_file})
+        for (rel_path, _, _), result, error in read_parallel(entries, load, workers):
+            if error is not None:
+                print(f"Skipping {rel_path}: {error}")
+                continue
+            writer.add(rel_path, *result)
+    os.replace(tmp_file, output_file)
+
+    stats = writer.stats()
+    elapsed = time.perf_counter() - start
+    print(f"Packed {stats['entries']} files ({stats['duplicates']} duplicates) with {codec}: "
+          f"{stats['raw_bytes']:,} -> {os.path.getsize(output_file):,} bytes in {elapsed:.2f}s.")
+    print(f"Project bundle saved to {output_file}")
+    return dict(stats, seconds=elapsed)
 
-    print(f"Bundled {len(project_data)} files.")
-    
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(project_data, f, indent=2)
-        
-    print(f"Project bundle saved to {OUTPUT_FILE}")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('project_root', nargs='?', default=PROJECT_ROOT)
+    parser.add_argument('-o', '--output', help=f'default: <project_root>/{OUTPUT_NAME} (.ndjson / .pack per format)')
+    parser.add_argument('--format', choices=('json', 'ndjson', 'pack'), default='json')
+    parser.add_argument('--codec', choices=sorted(bundle_format.CODECS), default=bundle_format.DEFAULT_CODEC,
+                        help='pack compression (default: zstd if installed, else zlib)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='keep a manifest and only re-read files whose mtime or size changed')
+    parser.add_argument('--manifest', help='default: <output>.manifest')
+    parser.add_argument('--workers', type=int,
+                        help='reader threads (default: 4 per CPU, max 32; 1 reads inline, best on a warm local disk)')
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.project_root):
+        parser.error(f"not a directory: {args.project_root}")
+    if args.format == 'pack':
+        if args.incremental:
+            parser.error("--incremental applies to json and ndjson bundles")
+        pack_project(args.project_root, args.output, args.codec, args.workers)
+        return
+    bundle_project(args.project_root, args.output, args.format, args.incremental, args.manifest, args.workers)
 
 if __name__ == "__main__":
-    bundle_project()
+    sys.exit(main())
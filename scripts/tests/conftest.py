@@ -0,0 +1,5 @@
+import os
+import sys
+
+# bundle_format and bundle_project are run as scripts from scripts/ and import each other top-level.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
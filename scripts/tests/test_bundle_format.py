@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+import bundle_format
+from bundle_format import PackWriter, PackReader, PackError, HEADER
+
+FILES = {
+    'ai_server/main.py': 'import os\n' * 200,
+    'components/Button.tsx': 'export const Button = () => null;\n' * 40,
+    'components/copy/Button.tsx': 'export const Button = () => null;\n' * 40,  # duplicate content
+    'docs/café.md': '# Café — menu\n',
+    'empty.txt': '',
+    'z.bin': '\x00\x01\x02',
+}
+
+
+def _codecs():
+    yield 'none'
+    yield 'zlib'
+    if bundle_format.zstandard is not None:
+        yield 'zstd'
+
+
+def _write(path, files, codec):
+    with PackWriter(str(path), codec=codec) as writer:
+        added = {name: writer.add(name, text.encode('utf-8')) for name, text in files.items()}
+    return writer, added
+
+
+@pytest.mark.parametrize('codec', list(_codecs()))
+def test_round_trip(tmp_path, codec):
+    pack = tmp_path / 'bundle.pack'
+    _write(pack, FILES, codec)
+    with PackReader(str(pack)) as reader:
+        assert len(reader) == len(FILES)
+        assert list(reader) == sorted(FILES, key=lambda p: p.encode('utf-8'))
+        assert dict(reader.items()) == FILES
+        for name, text in FILES.items():
+            assert name in reader
+            assert reader.read_text(name) == text
+        assert 'missing.py' not in reader
+        assert reader.get('missing.py', 'fallback') == 'fallback'
+        with pytest.raises(KeyError):
+            reader.read_bytes('missing.py')
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    pack = tmp_path / 'bundle.pack'
+    writer, added = _write(pack, FILES, 'zlib')
+    assert added['components/Button.tsx'] is True
+    assert added['components/copy/Button.tsx'] is False
+    stats = writer.stats()
+    assert stats['entries'] == len(FILES) and stats['blobs'] == len(FILES) - 1
+    assert stats['duplicates'] == 1
+
+    single = tmp_path / 'single.pack'
+    _write(single, {k: v for k, v in FILES.items() if k != 'components/copy/Button.tsx'}, 'zlib')
+    # The duplicate costs only its index entry and path, not another blob.
+    extra = os.path.getsize(pack) - os.path.getsize(single)
+    assert extra < len('components/copy/Button.tsx') + 16
+
+
+def test_compression_falls_back_to_raw_when_larger(tmp_path):
+    pack = tmp_path / 'bundle.pack'
+    data = os.urandom(256)
+    with PackWriter(str(pack), codec='zlib') as writer:
+        writer.add('random.bin', data)
+        assert writer.stats()['stored_bytes'] == len(data)
+    with PackReader(str(pack)) as reader:
+        assert reader.read_bytes('random.bin') == data
+
+
+def test_duplicate_path_rejected(tmp_path):
+    with PackWriter(str(tmp_path / 'bundle.pack'), codec='zlib') as writer:
+        writer.add('a.py', b'1')
+        with pytest.raises(PackError):
+            writer.add('a.py', b'2')
+
+
+def test_unknown_codec_rejected(tmp_path):
+    with pytest.raises(PackError):
+        PackWriter(str(tmp_path / 'bundle.pack'), codec='brotli')
+
+
+def test_reader_rejects_foreign_and_truncated_files(tmp_path):
+    foreign = tmp_path / 'foreign.pack'
+    foreign.write_bytes(b'{"files": {}}' + b' ' * HEADER.size)
+    with pytest.raises(PackError):
+        PackReader(str(foreign))
+
+    pack = tmp_path / 'bundle.pack'
+    _write(pack, FILES, 'zlib')
+    truncated = tmp_path / 'truncated.pack'
+    truncated.write_bytes(pack.read_bytes()[:HEADER.size + 64])  # cut inside the blobs
+    with pytest.raises(PackError):
+        PackReader(str(truncated))
+
+
+def test_empty_pack(tmp_path):
+    pack = tmp_path / 'empty.pack'
+    _write(pack, {}, 'zlib')
+    with PackReader(str(pack)) as reader:
+        assert len(reader) == 0 and list(reader) == []
+        assert 'a' not in reader
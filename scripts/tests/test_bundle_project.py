@@ -0,0 +1,28 @@
+import os
+
+from bundle_project import iter_files
+
+
+def _touch(path, text='x'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_walks_sorted_and_skips_ignored(tmp_path):
+    _touch(str(tmp_path / 'src' / 'b.ts'))
+    _touch(str(tmp_path / 'src' / 'a.py'))
+    _touch(str(tmp_path / 'src' / 'logo.png'))
+    _touch(str(tmp_path / 'node_modules' / 'x.js'))
+    _touch(str(tmp_path / 'package-lock.json'))
+    _touch(str(tmp_path / 'README.md'))
+    assert [rel for rel, _, _ in iter_files(str(tmp_path))] == ['README.md', 'src/a.py', 'src/b.ts']
+
+
+def test_directory_symlinks_are_not_followed(tmp_path):
+    _touch(str(tmp_path / 'src' / 'app.ts'))
+    _touch(str(tmp_path / 'shared' / 'util.ts'))
+    os.symlink(str(tmp_path), str(tmp_path / 'src' / 'loop'))  # would recurse forever if followed
+    os.symlink(str(tmp_path / 'shared'), str(tmp_path / 'linked.ts'))  # a directory despite the name
+    os.symlink(str(tmp_path / 'shared' / 'util.ts'), str(tmp_path / 'src' / 'util.ts'))
+    assert [rel for rel, _, _ in iter_files(str(tmp_path))] == ['shared/util.ts', 'src/app.ts', 'src/util.ts']
@@ -29,6 +29,7 @@ export interface AIResponse {
     content: string;
     model_used: string;
     processing_time_ms?: number;
+    session_id?: string;
 }
 
 export interface ChatbotRequest {
@@ -607,6 +608,51 @@ function generateLocalDoc(docType: string, formData: Record<string, string>): st
     }
 }
 
+// ─── Island chat session ─────────────────────────────────────────────────────
+
+// The server keeps the conversation (see ai_server/chat_sessions.py); we only
+// send history when there is no session yet or the server says it expired.
+let islandSessionId: string | null = null;
+
+type ChatTurn = { role: string; content: string };
+
+async function postIslandChat(body: Record<string, unknown>, onToken?: (delta: string) => void): Promise<Response> {
+    const AI_SERVER = import.meta.env.VITE_AI_SERVER_URL || 'http://localhost:8000';
+    return fetch(`${AI_SERVER}/island-chat`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ ...body, stream: !!onToken }),
+    });
+}
+
+/** Read an NDJSON reply: content deltas, then a {"done": true, ...} line. */
+async function readIslandStream(res: Response, onToken: (delta: string) => void): Promise<AIResponse> {
+    const reader = res.body!.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let content = '';
+    let done: any = {};
+    for (;;) {
+        const { value, done: finished } = await reader.read();
+        buffer += decoder.decode(value, { stream: !finished });
+        const lines = buffer.split('\n');
+        buffer = finished ? '' : lines.pop() || '';
+        for (const line of lines) {
+            if (!line.trim()) continue;
+            const event = JSON.parse(line);
+            if (event.error) throw new Error(event.error);
+            if (event.done) {
+                done = event;
+            } else if (event.content) {
+                content += event.content;
+                onToken(event.content);
+            }
+        }
+        if (finished) break;
+    }
+    return { content, model_used: done.model_used, session_id: done.session_id };
+}
+
 // ─── Exported Service ────────────────────────────────────────────────────────
 
 export const aiService = {
@@ -631,17 +677,21 @@ export const aiService = {
      * Calls the server-side /island-chat endpoint (tuned persona, accurate Juvay
      * facts, no fabricated claims). Falls back to the Trini canned responses on failure.
      */
-    async islandChat(message: string, history: { role: string; content: string }[] = [], mode: 'support' | 'onboarding' | 'sales' = 'support'): Promise<AIResponse> {
-        const AI_SERVER = import.meta.env.VITE_AI_SERVER_URL || 'http://localhost:8000';
+    async islandChat(message: string, history: ChatTurn[] = [], mode: 'support' | 'onboarding' | 'sales' = 'support',
+                     onToken?: (delta: string) => void): Promise<AIResponse> {
         try {
-            const res = await fetch(`${AI_SERVER}/island-chat`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ message, history, mode }),
-            });
+            let res = islandSessionId
+                ? await postIslandChat({ message, mode, session_id: islandSessionId }, onToken)
+                : await postIslandChat({ message, mode, history }, onToken);
+            if (res.status === 409) {
+                // Session expired server-side: start a new one from our copy of the history.
+                islandSessionId = null;
+                res = await postIslandChat({ message, mode, history }, onToken);
+            }
             if (!res.ok) throw new Error(`island-chat ${res.status}`);
-            const data = await res.json();
-            return { content: data.content, model_used: data.model_used || 'groq-island' };
+            const data: AIResponse = onToken ? await readIslandStream(res, onToken) : await res.json();
+            if (data.session_id) islandSessionId = data.session_id;
+            return { content: data.content, model_used: data.model_used || 'groq-island', session_id: data.session_id };
         } catch (error) {
             console.warn('Island chat unavailable, using Trini fallback:', error);
             return { content: getTriniFallback(message, 'platform'), model_used: 'fallback-trini' };
@@ -15,6 +15,11 @@ export const metaAdsService = {
     const r = await fetch(`${AI_SERVER}/meta/insights`);
     return r.json();
   },
+  // Campaigns and insights together (one Graph batch call server-side)
+  async getDashboard() {
+    const r = await fetch(`${AI_SERVER}/meta/dashboard`);
+    return r.json();
+  },
   async generateAdCopy(data: { business_type: string; product: string; island: string; objective: string }) {
     const r = await fetch(`${AI_SERVER}/meta/generate-ad-copy`, {
       method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(data)
@@ -33,6 +33,54 @@ export interface SMSPayload {
     message: string;
 }
 
+const AI_SERVER = import.meta.env.VITE_AI_SERVER_URL || 'https://juvay.app/ai';
+const JOB_POLL_DELAYS_MS = [500, 1000, 2000, 4000];
+
+/**
+ * Queue a message on the AI server (Twilio keys are server-side only) and wait
+ * briefly for delivery. The server answers 202 with a job; this polls the job's
+ * status_url and returns the Twilio sid once sent, or the job_id if it is still
+ * queued after the last poll. The idempotency key makes retries of the same
+ * queue row return the existing job instead of sending twice.
+ */
+async function sendViaAIServer(message: any, channel: 'whatsapp' | 'sms'): Promise<string> {
+    const label = channel === 'sms' ? 'SMS' : 'WhatsApp';
+    const phone = String(message.phone_number || '').replace(/[^0-9]/g, '');
+    const response = await fetch(`${AI_SERVER}/send-whatsapp`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            to: phone,
+            message: message.message,
+            idempotency_key: `${channel}:${message.id}`
+        })
+    });
+
+    if (!response.ok) {
+        throw new Error(`${label} send failed: ${response.statusText}`);
+    }
+
+    let job = await response.json();
+
+    if (!job.success) {
+        throw new Error(`${label} send failed: ${job.error || 'Unknown error'}`);
+    }
+
+    for (const delay of JOB_POLL_DELAYS_MS) {
+        if (job.status === 'sent' || job.status === 'failed') break;
+        await new Promise(resolve => setTimeout(resolve, delay));
+        const poll = await fetch(`${AI_SERVER}${job.status_url}`);
+        if (poll.ok) {
+            job = { ...job, ...(await poll.json()) };
+        }
+    }
+
+    if (job.status === 'failed') {
+        throw new Error(`${label} send failed: ${job.error || 'Unknown error'}`);
+    }
+    return job.sid || job.job_id;
+}
+
 export const notificationService = {
     // ============================================
     // IN-APP NOTIFICATIONS
@@ -335,29 +383,12 @@ export const notificationService = {
             return;
         }
 
-        // Route through our AI backend — Twilio keys are server-side only
-        const AI_SERVER = import.meta.env.VITE_AI_SERVER_URL || 'https://juvay.app/ai';
-        const phone = String(message.phone_number || '').replace(/[^0-9]/g, '');
-        const response = await fetch(`${AI_SERVER}/send-whatsapp`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ to: phone, message: message.message })
-        });
+        const messageId = await sendViaAIServer(message, 'whatsapp');
 
-        if (!response.ok) {
-            throw new Error(`WhatsApp send failed: ${response.statusText}`);
-        }
-
-        const data = await response.json();
-
-        if (!data.success) {
-            throw new Error(`WhatsApp send failed: ${data.error || 'Unknown error'}`);
-        }
-
-        // Update with WhatsApp message ID
+        // Update with WhatsApp message ID (the server job id if still queued)
         await supabase
             .from('whatsapp_queue')
-            .update({ whatsapp_message_id: data.sid })
+            .update({ whatsapp_message_id: messageId })
             .eq('id', message.id);
     },
 
@@ -428,28 +459,11 @@ export const notificationService = {
             return;
         }
 
-        // Route through our AI backend — Twilio keys are server-side only
-        const AI_SERVER = import.meta.env.VITE_AI_SERVER_URL || 'https://juvay.app/ai';
-        const phone = String(message.phone_number || '').replace(/[^0-9]/g, '');
-        const response = await fetch(`${AI_SERVER}/send-whatsapp`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ to: phone, message: message.message })
-        });
-
-        if (!response.ok) {
-            throw new Error(`SMS send failed: ${response.statusText}`);
-        }
-
-        const data = await response.json();
-
-        if (!data.success) {
-            throw new Error(`SMS send failed: ${data.error || 'Unknown error'}`);
-        }
+        const messageId = await sendViaAIServer(message, 'sms');
 
         await supabase
             .from('sms_queue')
-            .update({ sms_id: data.sid })
+            .update({ sms_id: messageId })
             .eq('id', message.id);
     },
 